@@ -9,8 +9,14 @@ GPS_UART = 1                        # UART device for GPS connection
 GPS_TX_PIN = 0                      # ESP32 pin - connected to GPS RX pin
 GPS_RX_PIN = 1                      # ESP32 pin - connected to GPS TX pin
 GPS_BAUD_RATE = 115200              # For LC29HEA, set 460800 - set to 115200 for most other models
+GPS_BAUD_DETECT = False             # If True, try other common baud rates if no valid data is received at GPS_BAUD_RATE
+# GPS_BAUD_TARGET = 460800          # Switch the GPS to this baud rate at startup (Quectel PQTMCFGUART - not saved to the GPS)
 GPS_SETUP_COMMANDS = []             # List of NMEA commands (without $ and checksum) to be sent to GPS device on startup.
-GPS_SETUP_RESPONSE_PREFIX = "$P"    # When reading responses to commands, only log lines which start with this prefix ($P = proprietary NMEA)
+GPS_SETUP_RESPONSE_PREFIX = ""      # Prefix of the response to wait for after each command. If empty (or a prefix of the command's own response, e.g. the old default "$P"), wait for the command's own response (e.g. $PQTMCFGUART,OK) or ACK ($PAIR001)
+GPS_COMMAND_TIMEOUT = 1000          # Time (ms) to wait for a response to each GPS command
+GPS_INGEST_THREAD = False           # Read the GPS UART from a separate thread, so it doesn't overflow while other tasks are busy
+GPS_INGEST_RING = 8192              # Size (bytes) of the ring buffer between the ingest thread and the GPS reader task
+GPS_INGEST_POLL_MS = 2              # Time (ms) the ingest thread sleeps when the UART has no data
 ENABLE_GPS_RESET = False            # If enabled, GPS will be reset via GPIO pin
 GPS_RESET_PIN = 8                   # The GPIO pin to toggle to reset the GPS device
 GPS_RESET_HIGH = True               # If True, pull the pin high to reset. If false, pull it low
@@ -26,10 +32,24 @@ SERIAL_TX_PIN = 3                   # Transmit pin
 SERIAL_RX_PIN = 4                   # Receive pin
 SERIAL_BAUD_RATE = 115200           # Serial baud rate
 LOG_TO_SERIAL = False               # If True, log messages are sent over serial, rather than to sys.stdout (REPL)
+LOG_LEVEL = "INFO"                  # Minimum level of messages to log: DEBUG, INFO, WARNING or ERROR
+LOG_RATE = 20                       # Maximum log messages written out per second (excess messages are dropped, 0 for unlimited)
+STATS_INTERVAL = 0                  # Seconds between $PSTAT metrics sentences on serial/bluetooth outputs (0 to disable)
+TRACE_SAMPLE = 0                    # Trace latency from the GPS UART to each output for 1 in N messages (0 to disable)
+LOOP_MONITOR_INTERVAL = 0           # Interval (ms) at which event loop lag is measured, e.g. 100 (0 to disable the monitor - a diagnostic, with a small cost per task step)
+LOOP_STALL_MS = 50                  # Event loop lag (ms) reported as a stall, and attributed to the task which was running
+GC_SCHEDULE = True                  # Run garbage collection between GPS epochs (when no data has arrived for GC_IDLE_MS)
+GC_IDLE_MS = 20                     # Time (ms) without GPS data before a scheduled collection can run
+GC_MIN_ALLOC = 8192                 # Bytes allocated since the last collection before collecting again
+GC_MAX_INTERVAL = 5000              # Collect at least this often (ms)
+# GC_THRESHOLD = 32768              # Also collect automatically after this many bytes are allocated (MicroPython gc.threshold)
+FRAME_POOL_COUNT = 16               # Preallocated buffers for RTCM frames queued for NTRIP servers (0 to allocate per frame)
+FRAME_POOL_BUFFER = 512             # Size of each frame buffer (larger frames are allocated separately)
 
 # Bluetooth configuration
 DEVICE_NAME = "ESP32_GPS"           # Bluetooth device name
 ENABLE_BLUETOOTH = False            # Output via bluetooth device
+BLUETOOTH_MAX_CONNECTIONS = 3       # Maximum bluetooth devices connected at once (each uses ~2KB RAM)
 
 # Wifi credentials - needed for NTRIP services
 # Either set here, or ensure wifi is enabled in boot.py
@@ -43,6 +63,26 @@ ESPNOW_MODE = ""                    # ESP Mode can be sender or receiver (or emp
 # If receiver, receive data from the first peer in the list as if it was a local GPS device.
 # ESPNOW_PEERS = [b"\xbb\xbb\xbb\xbb\xbb\xbb"] # List of mac addresses for peers.
 # ESPNOW_DISCOVER_PEERS = True      # Broadcast peer mac address, and add any recived to the list of peers
+# RTCM_SHAPE_ESPNOW = {1005: 10, 1033: 10, "MSM": 1}  # Minimum seconds between RTCM messages of each type sent by ESP-Now ("MSM" for whole MSM epochs). Other types are all sent
+RTCM_MSM4_ESPNOW = False            # Convert MSM7 observations to MSM4 before sending by ESP-Now (about 35-40% smaller)
+
+# Network broadcast - stream GPS data to TCP clients (e.g. loggers, QGIS) on the local network
+# BROADCAST_PORT = 10110            # TCP port to listen on (unset to disable)
+# BROADCAST_BIND_ADDRESS = "0.0.0.0"  # Address to bind the broadcast server
+# BROADCAST_MODE = "all"            # Data to send: all (raw GPS stream), nmea (NMEA only) or rtcm (RTCM frames only)
+# BROADCAST_MAX_CLIENTS = 5         # Maximum connected TCP clients
+# BROADCAST_BUFFER = 8192           # Bytes buffered for clients - slow clients further behind than this skip ahead
+# BROADCAST_UDP_PORT = 10110        # Also send data as UDP broadcasts to this port
+
+# Recorder - record the raw GPS stream (NMEA and RTCM) to flash, for post-processing (PPK)
+ENABLE_RECORDER = False             # Record GPS data to files on flash
+RECORDER_PATH = "/gnss"             # Directory for recordings
+RECORDER_FILE_SIZE = 1048576        # Start a new file when the current one reaches this size (bytes)
+RECORDER_FILE_SECS = 3600           # Start a new file when the current one is this old (seconds)
+RECORDER_MAX_SIZE = 8388608         # Total size of recordings (bytes) - oldest files are deleted first
+RECORDER_MIN_FREE = 65536           # Free space (bytes) to leave on the filesystem - oldest files are deleted first
+RECORDER_BLOCKS = 4                 # Number of 4KB RAM blocks to buffer data in before writing to flash
+RECORDER_FLUSH_INTERVAL = 10        # Seconds before a partly filled block (or pending index entries) is written out
 
 ENABLE_SHELL = False                # If True, enable the remote command shell
 SHELL_PASSWORD = "esp32-gps"        # Set a password for shell access
@@ -53,13 +93,32 @@ NTRIP_MODE = "client"               # To enable NTRIP services, comma-separated
 # Client/Server config
 NTRIP_CASTER = "crtk.net"           # NTRIP caster address
 NTRIP_PORT = 2101                   # NTRIP caster port
-NTRIP_MOUNT = "ESP32"               # NTRIP mount. Note there is no support for NEAR/GGA automatic mountpoints.
+NTRIP_MOUNT = "ESP32"               # NTRIP mount (the initial mount if NTRIP_CLIENT_NEAREST_MOUNT is enabled).
 NTRIP_CLIENT_CREDENTIALS = "c:c"    # NTRIP client credentials (in form user:pass). Centipede: "c:c". rtk2go: "your@email.com:none" (for all modes)
 NTRIP_SERVER_CREDENTIALS = "c:c"    # NTRIP server credentials (in form user:pass).
+NTRIP_SERVER_BUFFER = 8192          # Bytes of RTCM frames buffered for upload (replayed after reconnecting).
+# RTCM_SHAPE_NTRIP = {1005: 10, 1033: 10, "MSM": 1}   # Minimum seconds between RTCM messages of each type uploaded by the NTRIP server ("MSM" for whole MSM epochs)
+RTCM_MSM4_NTRIP = False             # Convert MSM7 observations to MSM4 before uploading by the NTRIP server (about 35-40% smaller)
+# NTRIP_SERVER_TARGETS = [("192.168.1.10", 2101, "ESP32", "c:c"), ("rtk2go.com", 2101, "MYBASE", "me@example.com:none")]  # Upload to several casters at once (overrides NTRIP_CASTER/PORT/MOUNT for the server).
+
+DNS_CACHE_TTL = 300                 # Seconds to cache caster DNS lookups (refreshed in the background, last known address used on failure).
+
+# Client position config
+NTRIP_CLIENT_GGA = False            # Send GGA position to the caster: True, False, or "auto" (if the sourcetable says the mount needs NMEA, e.g. VRS).
+NTRIP_CLIENT_GGA_INTERVAL = 10      # Seconds between GGA uploads.
+NTRIP_CLIENT_NEAREST_MOUNT = False  # Select the nearest mount from the caster sourcetable, using the current GPS position.
+NTRIP_CLIENT_RECHECK_KM = 10        # Distance moved (km) before checking for a nearer mount again.
+
+# Client failover config
+# NTRIP_CLIENT_CANDIDATES = [("caster2.example.com", 2101, "MOUNT", "user:pass")]  # Fallback casters/mounts, used if NTRIP_CASTER fails.
+NTRIP_CLIENT_STANDBY = False        # Keep a warm standby connection to the next best candidate, for instant failover.
+NTRIP_CLIENT_STALL_TIMEOUT = 10     # Seconds without complete correction frames before reconnecting/failing over.
+NTRIP_CLIENT_STATUS_INTERVAL = 0    # Seconds between $PCORR correction age status sentences on serial/bluetooth outputs (0 to disable).
 
 # Caster config
 NTRIP_CASTER_BIND_ADDRESS = "0.0.0.0"  # Address to bind the NTRIP caster
 NTRIP_CASTER_BIND_PORT = 2101          # Port to bind the NTRIP caster
+NTRIP_CASTER_MSM4 = False              # Serve <MOUNT>_MSM4: each mount's MSM7 observations converted to MSM4
 # Sourcetable map - add one STR line to authorise each mountpoint.
 # Full details at: https://software.rtcm-ntrip.org/wiki/STR
 # RTCM format protocol here: https://github.com/MichaelBeechan/RTCM3.3/blob/main/RTCM3.3.PDF
@@ -0,0 +1,13 @@
+""" Config variables for running the NTRIP Caster on a host (CPython) - see src/caster_host.py"""
+
+NTRIP_CASTER_BIND_ADDRESS = "0.0.0.0"  # Address to bind the NTRIP caster
+NTRIP_CASTER_BIND_PORT = 2101          # Port to bind the NTRIP caster
+NTRIP_CASTER_BACKLOG = 128             # Pending connection queue length (raise for many clients connecting at once)
+NTRIP_CLIENT_CREDENTIALS = "c:c"       # NTRIP client credentials (in form user:pass)
+NTRIP_SERVER_CREDENTIALS = "c:c"       # NTRIP server credentials (in form user:pass)
+# Sourcetable map - add one STR line to authorise each mountpoint.
+# Full details at: https://software.rtcm-ntrip.org/wiki/STR
+NTRIP_SOURCETABLE = """
+STR;ESP32;ESP32_GPS;RTCM3.3;;2;GLO+GAL+QZS+BDS+GPS;NONE;GBR;56.62;-3.94;0;0;NTRIP ESP32_GPS;none;B;N;15200;ESP32_GPS
+ENDSOURCETABLE
+"""
@@ -1,7 +1,11 @@
+import asyncio
 import bluetooth
 import errno
-import time
+from compat import ThreadSafeFlag, sleep_ms, ticks_diff, ticks_ms
+from metrics import registry
 from micropython import const
+from ring import Ring
+from rtcm import Framer
 try:
     from debug import DEBUG
 except ImportError:
@@ -11,6 +15,15 @@ except ImportError:
 IRQ_CENTRAL_CONNECT = const(1)
 IRQ_CENTRAL_DISCONNECT = const(2)
 IRQ_GATTS_WRITE = const(3)
+IRQ_MTU_EXCHANGED = const(21)
+
+# Default ATT MTU (before any exchange), and the maximum we will negotiate
+DEFAULT_MTU = const(23)
+MAX_MTU = const(247)
+# ATT notification header (opcode + handle)
+ATT_HEADER = const(3)
+# Time (ms) to wait before retrying a notify after ENOMEM
+RETRY_MS = const(5)
 
 FLAG_READ = const(0x0002)
 FLAG_WRITE_NO_RESPONSE = const(0x0004)
@@ -32,52 +45,297 @@ UART_SERVICE = (
     (UART_TX, UART_RX),
 )
 
+class Peer():
+    """Per-connection output state: queued data, MTU and stats.
+
+    Outgoing data is queued in buf[start:end]. Each connection has its own queue,
+    so a slow central only drops its own backlog rather than holding up others.
+    """
+
+    def __init__(self, size=2048, latency=None, probe=None):
+        self.conn = None
+        self.mtu = DEFAULT_MTU
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        # Time of the last ENOMEM from the stack (notifies are retried after RETRY_MS)
+        self.busy = None
+        # Notify latency is sampled by marking the end of the queue (as a total byte count),
+        # and timing how long until it is sent
+        self.queued_total = 0
+        self.consumed = 0
+        self.mark = None
+        self.mark_time = None
+        self.notifies = 0
+        self.retries = 0
+        self.dropped = 0
+        self.latency_last = None
+        self.latency_max = 0
+        self.latency_avg = 0
+        # Histogram of notify latency (shared by all connections)
+        self.latency = latency
+        # Latency tracing from GPS ingest (see latency.Probe)
+        self.probe = probe
+
+    def reset(self, conn=None):
+        """Clear state for a new connection."""
+        self.conn = conn
+        self.mtu = DEFAULT_MTU
+        self.start = self.end = 0
+        self.busy = self.mark = self.mark_time = None
+        self.queued_total = self.consumed = 0
+        self.notifies = self.retries = self.dropped = 0
+        self.latency_last = None
+        self.latency_max = self.latency_avg = 0
+        if self.probe:
+            self.probe.mark = None
+
+    def queued(self):
+        return self.end - self.start
+
+    def queue(self, data, now, stamp=None):
+        """Queue data, dropping the oldest data (up to a sentence boundary) if full.
+
+        If stamp (ingest time) is set, the latency until data is notified is traced.
+        """
+        size = len(self.buf)
+        if len(data) > size:
+            data = data[-size:]
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.end + len(data) > size:
+            excess = self.end - self.start + len(data) - size
+            if excess > 0:
+                start = self.start + excess
+                while start < self.end and self.buf[start - 1] != 10:
+                    start += 1
+                self.dropped += start - self.start
+                self.consumed += start - self.start
+                self.start = start
+                if self.mark is not None and self.consumed >= self.mark:
+                    # Marked data was dropped - no latency sample
+                    self.mark = None
+                if self.probe:
+                    self.probe.dropped(self.consumed)
+            # Move unsent data to the start of the buffer (in place - no allocation per notify)
+            remain = self.end - self.start
+            if remain <= self.start:
+                self.buf[:remain] = self.mv[self.start:self.end]
+            else:
+                # Regions overlap - move in chunks no longer than the gap, so each copy doesn't overlap
+                gap = self.start
+                for pos in range(0, remain, gap):
+                    count = min(gap, remain - pos)
+                    self.buf[pos:pos + count] = self.mv[gap + pos:gap + pos + count]
+            self.start, self.end = 0, remain
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        self.queued_total += len(data)
+        if self.mark is None:
+            self.mark = self.queued_total
+            self.mark_time = now
+        if stamp is not None and self.probe:
+            self.probe.queued(self.queued_total, stamp)
+
+    def next_chunk(self):
+        """Return the next chunk of queued data which fits in one notification.
+
+        Several sentences are coalesced into each notification, ending at a sentence boundary where possible.
+        """
+        size = min(self.mtu, MAX_MTU) - ATT_HEADER
+        end = min(self.end, self.start + size)
+        if end < self.end:
+            # Split after the last whole sentence that fits
+            buf = self.buf
+            for i in range(end - 1, self.start, -1):
+                if buf[i] == 10:
+                    end = i + 1
+                    break
+        return self.mv[self.start:end]
+
+    def sent(self, size, now):
+        """Remove size bytes (successfully notified) from the queue."""
+        self.start += size
+        self.consumed += size
+        self.notifies += 1
+        if self.mark is not None and self.consumed >= self.mark:
+            # Record how long the marked data waited to be sent
+            self.latency_last = ticks_diff(now, self.mark_time)
+            self.latency_max = max(self.latency_max, self.latency_last)
+            self.latency_avg += (self.latency_last - self.latency_avg) // 8
+            if self.latency:
+                self.latency.observe(self.latency_last)
+            self.mark = None
+        if self.probe:
+            self.probe.sent(self.consumed)
+
+    def status(self):
+        return (
+            f"conn {self.conn}: MTU {self.mtu}, queued: {self.queued()} bytes, notifies: {self.notifies}, "
+            f"retries: {self.retries}, dropped: {self.dropped} bytes, "
+            f"latency: {self.latency_last}ms last, {self.latency_avg}ms avg, {self.latency_max}ms max"
+        )
+
+
 class Blue():
 
-    def __init__(self, name="ESP32_GPS"):
+    def __init__(self, name="ESP32_GPS", tx_size=2048, rx_size=4096, rx_event=None, max_connections=3, trace=False):
         self.name = name
         self.ble = bluetooth.BLE()
         self.ble.active(True)
         self.ble.irq(self.irq)
         ((self.handle_tx, self.handle_rx),) = self.ble.gatts_register_services((UART_SERVICE,))
         self.ble.gatts_set_buffer(self.handle_tx, 1024, True)
-        self.connections = set()
+        self.ble.config(mtu=MAX_MTU)
+        # Per-connection state is preallocated, and assigned on connect
+        latency = registry.histogram("ble.latency_ms")
+        if trace:
+            # Trace latency from GPS ingest (each connection tracks its own traced message)
+            from latency import Probe
+        self.peers = [Peer(tx_size, latency, Probe("ble") if trace else None) for _ in range(max_connections)]
+        # { conn_handle: Peer }
+        self.connections = {}
         self.write_callback = None
+        # Data written by centrals (e.g. RTCM corrections, or NMEA commands for the GPS) is queued by
+        # the IRQ handler, and sent to write_callback (as whole RTCM frames/NMEA sentences) by rx_loop
+        self.rx_ring = Ring(rx_size)
+        self.rx_event = rx_event or ThreadSafeFlag()
+        self.rx_framer = Framer(2048)
+        self.rx_sentences = 0
+        self.tx_event = asyncio.Event()
+        # Time (ms) to wait for more data before notifying, so sentences are coalesced
+        self.coalesce_ms = 10
+        self.connects = 0
+        self.rejected = 0
+        # Bytes dropped by connections which have since disconnected
+        self.dropped = 0
+        registry.gauge("ble.connections", lambda: len(self.connections))
+        registry.gauge("ble.dropped", self.total_dropped)
+        registry.gauge("ble.queued", lambda: sum(p.queued() for p in self.connections.values()))
+        registry.gauge("ble.rx_frames", lambda: self.rx_framer.frames)
+        registry.gauge("ble.rx_sentences", lambda: self.rx_sentences)
+        registry.gauge("ble.rx_overflows", lambda: self.rx_ring.overflow_bytes)
         self.advertise()
 
     def advertise(self):
         interval_us = 500000
-        payload = b'\x02\x01\x06' + bytes([len(self.name) + 1, 0x09]) + self.name
+        name = self.name.encode()
+        payload = b'\x02\x01\x06' + bytes([len(name) + 1, 0x09]) + name
         self.ble.gap_advertise(interval_us, adv_data=payload)
 
     def irq(self, event, data):
         # Track connections so we can send notifications.
         if event == IRQ_CENTRAL_CONNECT:
             conn, _, _ = data
-            self.connections.add(conn)
+            for peer in self.peers:
+                if peer.conn is None:
+                    peer.reset(conn)
+                    self.connections[conn] = peer
+                    self.connects += 1
+                    break
+            else:
+                # No free connection slots
+                self.rejected += 1
+                self.ble.gap_disconnect(conn)
+                return
+            if len(self.connections) < len(self.peers):
+                # Keep advertising so other centrals can connect
+                self.advertise()
         elif event == IRQ_CENTRAL_DISCONNECT:
             conn, _, _ = data
-            self.connections.remove(conn)
+            peer = self.connections.pop(conn, None)
+            if peer:
+                self.dropped += peer.dropped
+                peer.conn = None
             self.advertise()
+        elif event == IRQ_MTU_EXCHANGED:
+            conn, mtu = data
+            if conn in self.connections:
+                self.connections[conn].mtu = mtu
         elif event == IRQ_GATTS_WRITE:
             _, value_handle = data
-            value = self.ble.gatts_read(value_handle)
-            if value_handle == self.handle_rx and self.write_callback:
-                self.write_callback(value)
+            if value_handle == self.handle_rx:
+                # Don't process data in IRQ context - queue it for rx_loop
+                self.rx_ring.write(self.ble.gatts_read(value_handle))
+                self.rx_event.set()
 
     def is_connected(self):
         return len(self.connections) > 0
 
-    def send(self, data):
-        self.ble.gatts_write(self.handle_tx, data)
-        for conn in self.connections:
+    def send(self, data, stamp=None):
+        """Queue data to be notified to all connections (by send_loop) - never blocks."""
+        now = ticks_ms()
+        for peer in self.connections.values():
+            peer.queue(data, now, stamp)
+        self.tx_event.set()
+
+    async def send_loop(self):
+        """Notify queued data to each connection in turn.
+
+        If the stack is full for a connection, it is retried after RETRY_MS while other connections carry on.
+        """
+        while True:
+            await self.tx_event.wait()
+            await sleep_ms(self.coalesce_ms)
+            self.tx_event.clear()
             while True:
-                try:
-                    self.ble.gatts_notify(conn, self.handle_tx)
+                pending = False
+                progress = False
+                now = ticks_ms()
+                for peer in list(self.connections.values()):
+                    if not peer.queued():
+                        continue
+                    pending = True
+                    if peer.busy is not None and ticks_diff(now, peer.busy) < RETRY_MS:
+                        continue
+                    chunk = peer.next_chunk()
+                    try:
+                        self.ble.gatts_notify(peer.conn, self.handle_tx, chunk)
+                    except OSError as e:
+                        if e.errno == errno.ENOMEM:
+                            peer.busy = now
+                            peer.retries += 1
+                            continue
+                        if peer.conn in self.connections:
+                            raise
+                        # Disconnected while sending
+                        continue
+                    peer.busy = None
+                    peer.sent(len(chunk), now)
+                    progress = True
+                if not pending:
                     break
-                except OSError as e:
-                    if e.errno == errno.ENOMEM:
-                        # Retry notify once stack has drained
-                        time.sleep_ms(5)
-                    else:
-                        raise
+                # Let other tasks queue more data (so it can be coalesced), or wait for the stack to drain
+                await sleep_ms(0 if progress else RETRY_MS)
+
+    def total_dropped(self):
+        """Bytes dropped by all connections (including those since disconnected)."""
+        return self.dropped + sum(p.dropped for p in self.connections.values())
+
+    async def rx_loop(self):
+        """Send whole RTCM frames and NMEA sentences written by centrals to write_callback.
+
+        Anything else (e.g. a truncated sentence, or a frame failing its CRC) is discarded.
+        """
+        framer = self.rx_framer
+        while True:
+            await self.rx_event.wait()
+            while len(self.rx_ring):
+                framer.commit(self.rx_ring.readinto(framer.writable(len(self.rx_ring))))
+                while (msg := framer.pop()) is not None:
+                    if msg[0] == 36:
+                        self.rx_sentences += 1
+                    if self.write_callback:
+                        self.write_callback(msg)
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        return (
+            f"BLE: {len(self.connections)}/{len(self.peers)} connections, {self.connects} connects, {self.rejected} rejected, "
+            f"{self.total_dropped()} bytes dropped\n"
+            + "".join(f"{peer.status()}\n" for peer in self.connections.values()) +
+            f"BLE RX: {self.rx_framer.frames} frames, {self.rx_sentences} sentences, queued: {len(self.rx_ring)} bytes, "
+            f"overflows: {self.rx_ring.overflows} ({self.rx_ring.overflow_bytes} bytes), "
+            f"CRC errors: {self.rx_framer.crc_errors}, discarded: {self.rx_framer.discarded} bytes"
+        )
@@ -0,0 +1,143 @@
+"""Stream GPS data (NMEA and/or RTCM) to network clients over TCP, and optionally UDP broadcast.
+
+Data is written once into a shared ring buffer, and each TCP client reads from
+its own position (cursor) in the ring, so the cost of each write doesn't depend
+on the number of clients. A client which falls more than the ring size behind
+skips ahead to live data (counted as dropped).
+"""
+import asyncio
+import socket
+from rtcm import PREAMBLE
+from devices import Logger
+from metrics import registry
+try:
+    from debug import DEBUG
+except ImportError:
+    DEBUG=False
+
+log = Logger.getLogger().log
+
+
+class Broadcast():
+
+    def __init__(self, bind_address="0.0.0.0", bind_port=10110, mode="all", size=8192, max_clients=5, udp_port=None):
+        self.name = "Broadcast"
+        self.bind_address = bind_address
+        self.bind_port = bind_port
+        # all (raw stream), nmea (NMEA sentences only) or rtcm (whole RTCM frames only)
+        self.mode = mode
+        self.max_clients = max_clients
+        # Seconds to wait for a client to accept data before disconnecting it
+        self.drain_timeout = 10
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        # Total bytes ever written - data at position pos is at buf[pos % size]
+        self.total = 0
+        self.event = asyncio.Event()
+        self.clients = 0
+        self.connects = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.udp_port = udp_port
+        self.udp = None
+        self.udp_errors = 0
+        self.shutdown_event = asyncio.Event()
+        # Latency tracing from GPS ingest, to the first client sent each traced message (see latency.Probe)
+        self.probe = None
+        registry.gauge("broadcast.clients", lambda: self.clients)
+        registry.gauge("broadcast.bytes", lambda: self.total)
+        registry.gauge("broadcast.dropped", lambda: self.dropped)
+
+    def write(self, data, stamp=None):
+        """Queue data (a whole NMEA sentence or RTCM frame) for all clients (tracing its latency if stamp is set)."""
+        if self.mode == "nmea":
+            if data[0] != 36:
+                return
+        elif self.mode == "rtcm":
+            # data is a whole message (see gps_data) - only RTCM frames are sent
+            if data[0] != PREAMBLE:
+                return
+        size = len(self.buf)
+        if len(data) > size:
+            data = data[-size:]
+        pos = self.total % size
+        first = min(len(data), size - pos)
+        self.buf[pos:pos + first] = data[:first]
+        if first < len(data):
+            self.buf[:len(data) - first] = data[first:]
+        self.total += len(data)
+        if stamp is not None and self.probe:
+            self.probe.queued(self.total, stamp)
+        self.event.set()
+        if self.udp:
+            try:
+                self.udp.sendto(data, ("255.255.255.255", self.udp_port))
+            except OSError:
+                self.udp_errors += 1
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        if self.clients >= self.max_clients:
+            log("[%s] Rejecting client %s - too many clients.", self.name, addr)
+            self.rejected += 1
+            writer.close()
+            return
+        log("[%s] Client connected: %s", self.name, addr)
+        self.clients += 1
+        self.connects += 1
+        size = len(self.buf)
+        # Start from live data
+        cursor = self.total
+        try:
+            while True:
+                if cursor == self.total:
+                    self.event.clear()
+                    await self.event.wait()
+                if self.total - cursor > size:
+                    # Client fell too far behind (ring overwritten) - skip to live data
+                    self.dropped += self.total - cursor
+                    cursor = self.total
+                    if self.probe:
+                        self.probe.dropped(cursor)
+                    continue
+                # Send up to the end of the ring (the wrapped remainder is sent next time round)
+                pos = cursor % size
+                end = min(size, pos + self.total - cursor)
+                writer.write(self.mv[pos:end])
+                cursor += end - pos
+                if self.probe:
+                    self.probe.sent(cursor)
+                # Disconnect clients which stop reading altogether
+                await asyncio.wait_for(writer.drain(), self.drain_timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            log("[%s] Client disconnected: %s", self.name, addr)
+            self.clients -= 1
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        return (
+            f"Broadcast: port {self.bind_port} ({self.mode}), {self.clients}/{self.max_clients} clients, "
+            f"{self.connects} connects, {self.rejected} rejected, {self.total} bytes written, {self.dropped} bytes dropped"
+            + (f", UDP port {self.udp_port} ({self.udp_errors} errors)" if self.udp else "")
+        )
+
+    async def run(self):
+        if self.udp_port:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.udp.setblocking(False)
+            log("[%s] UDP broadcast on port %s", self.name, self.udp_port)
+        log("[%s] Listening on %s:%s", self.name, self.bind_address, self.bind_port)
+        server = await asyncio.start_server(self.handle_client, self.bind_address, self.bind_port)
+        # Wait for shutdown signal
+        await self.shutdown_event.wait()
+        server.close()
+        await server.wait_closed()
+        if self.udp:
+            self.udp.close()
@@ -0,0 +1,48 @@
+"""Run the NTRIP Caster standalone under CPython (e.g. as a hub on a Linux host).
+
+Usage: python3 src/caster_host.py [-c config.host.py]
+"""
+import argparse
+import asyncio
+import importlib.util
+import ntrip
+from devices import Logger
+
+log = Logger.getLogger().log
+
+
+def load_config(path):
+    """Load a config file (python syntax, as for config.py on the device)."""
+    spec = importlib.util.spec_from_file_location("config", path)
+    cfg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cfg)
+    return cfg
+
+
+async def run(cfg):
+    caster = ntrip.Caster(
+        getattr(cfg, "NTRIP_CASTER_BIND_ADDRESS", "0.0.0.0"),
+        getattr(cfg, "NTRIP_CASTER_BIND_PORT", 2101),
+        cfg.NTRIP_SOURCETABLE,
+        cfg.NTRIP_CLIENT_CREDENTIALS,
+        cfg.NTRIP_SERVER_CREDENTIALS,
+        backlog=getattr(cfg, "NTRIP_CASTER_BACKLOG", 128),
+    )
+    try:
+        await caster.run()
+    finally:
+        await caster.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32-GPS NTRIP Caster (host mode)")
+    parser.add_argument("-c", "--config", default="config.host.py", help="Path to host config file")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(load_config(args.config)))
+    except KeyboardInterrupt:
+        log("Ctrl-C received - shutting down.")
+
+
+if __name__ == "__main__":
+    main()
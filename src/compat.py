@@ -0,0 +1,79 @@
+"""Fallbacks for MicroPython-only functions, so shared modules also run under CPython."""
+import asyncio
+import gc
+import sys
+import time
+
+try:
+    sleep_ms = asyncio.sleep_ms
+except AttributeError:
+    async def sleep_ms(ms):
+        await asyncio.sleep(ms / 1000)
+
+try:
+    wait_for_ms = asyncio.wait_for_ms
+except AttributeError:
+    async def wait_for_ms(aw, timeout):
+        return await asyncio.wait_for(aw, timeout / 1000)
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:
+    import _thread
+
+    class ThreadSafeFlag():
+        """Event which is cleared once waited on, and can be set from another thread."""
+
+        def __init__(self):
+            self.event = asyncio.Event()
+            self.loop = None
+            self.thread = None
+
+        def set(self):
+            if self.loop and _thread.get_ident() != self.thread:
+                # asyncio.Event isn't thread safe - set it from the event loop's thread
+                self.loop.call_soon_threadsafe(self.event.set)
+            else:
+                self.event.set()
+
+        def clear(self):
+            self.event.clear()
+
+        async def wait(self):
+            self.loop = asyncio.get_running_loop()
+            self.thread = _thread.get_ident()
+            await self.event.wait()
+            self.event.clear()
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    def ticks_ms():
+        return time.monotonic_ns() // 1000000
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_diff(new, old):
+        return new - old
+
+try:
+    print_exception = sys.print_exception
+except AttributeError:
+    from traceback import print_exception as _print_exception
+
+    def print_exception(e, file=sys.stderr):
+        _print_exception(type(e), e, e.__traceback__, file=file)
+
+try:
+    mem_alloc = gc.mem_alloc
+    mem_free = gc.mem_free
+except AttributeError:
+    # CPython doesn't report heap use
+    def mem_alloc():
+        return 0
+
+    def mem_free():
+        return 0
@@ -1,6 +1,10 @@
 """Handle GPS & Serial devices via UART, and provide helper functions."""
+import asyncio
 import sys
 import time
+from compat import ThreadSafeFlag, print_exception, sleep_ms, ticks_diff, ticks_ms, ticks_us
+from ring import Ring
+from rtcm import Framer
 try:
     from machine import UART
 except ImportError:
@@ -22,37 +26,241 @@ def nmea_checksum(sentence):
     return f"{cksum:02X}"
 
 
+def nmea_valid(sentence):
+    """Check the checksum of an NMEA sentence (bytes)."""
+    star = sentence.find(b"*")
+    if star < 1 or len(sentence) < star + 3:
+        return False
+    cksum = 0
+    for c in sentence[1:star]:
+        cksum ^= c
+    try:
+        return cksum == int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
+# Baud rates to try when detecting the GPS baud rate (most common first)
+BAUD_RATES = (115200, 460800, 921600, 230400, 9600, 38400, 57600)
+
+
 class GPS():
 
     def __init__(self, uart=1, baudrate=115200, tx=0, rx=1):
         logging = Logger.getLogger()
         self.log = logging.log
         self.utc_time = "00:00:00"
+        # Commands awaiting a response: [match prefix, event, response]
+        self.waiters = []
+        # Commands sent at once (before waiting for responses) by send_commands
+        self.pipeline = 4
+        self.timeouts = 0
+        # Splits data read from the UART into NMEA sentences and RTCM frames
+        self.framer = Framer(2048)
+        self.baudrate = baudrate
+        # Bytes read from the UART (by the GPS reader task)
+        self.bytes_read = 0
+        # Large rx buffer to allow for high baud rates (4096 bytes is ~90ms at 460800)
+        self.rxbuf = 4096
+        # Times the UART rx buffer was found full when read (data has probably been lost)
+        self.rx_full = 0
+        # Ingest thread (see start_ingest): ring buffer it fills, and flag set when it adds data
+        self.ring = None
+        self.ingest_event = ThreadSafeFlag()
+        self.ingesting = False
+        # Times the ingest thread found the ring full, and the most data the ring has held
+        self.ring_full = 0
+        self.ring_max = 0
+        # Time (ticks_us) the oldest data in the ring was read from the UART
+        self.ring_stamp = 0
+        self.ingest_errors = 0
         try:
-            self.uart = UART(uart,baudrate=baudrate, tx=tx, rx=rx, txbuf=1024, rxbuf=1024)
+            self.uart = UART(uart,baudrate=baudrate, tx=tx, rx=rx, txbuf=1024, rxbuf=self.rxbuf)
         except Exception as e:
-            self.log(f"ERROR: Unable to open UART ({uart}) device. No GPS device enabled.")
+            self.log("ERROR: Unable to open UART (%s) device. No GPS device enabled.", uart, level=LOG_ERROR)
+
+
+    def set_baud(self, baudrate):
+        self.uart.init(baudrate=baudrate)
+        self.baudrate = baudrate
+        if self.ring is not None:
+            # Discard data read at the old rate (the reader task is the ring's consumer)
+            self.ring.tail = self.ring.head
+        self.framer.reset()
+
+    def start_ingest(self, size=8192, poll_ms=2):
+        """Read the UART from a separate thread, into a ring buffer read by the GPS reader task.
+
+        The thread keeps draining the UART's rx buffer while the event loop is busy
+        (e.g. with caster fan-out or BLE notifies), so it doesn't overflow.
+        """
+        import _thread
+        self.ring = Ring(size)
+        self.ingesting = True
+        _thread.start_new_thread(self.ingest, (poll_ms,))
+
+    def stop_ingest(self):
+        self.ingesting = False
+
+    def ingest(self, poll_ms):
+        """Ingest thread - move data from the UART to the ring, and signal the reader task."""
+        uart = self.uart
+        ring = self.ring
+        buf = bytearray(1024)
+        mv = memoryview(buf)
+        while self.ingesting:
+            try:
+                size = uart.any()
+                if size:
+                    if size >= self.rxbuf:
+                        self.rx_full += 1
+                    if not (free := ring.free()):
+                        # Reader task is behind - leave data in the UART until there is room
+                        self.ring_full += 1
+                    else:
+                        size = uart.readinto(mv[:min(size, free, len(buf))]) or 0
+                        if not len(ring):
+                            self.ring_stamp = ticks_us()
+                        ring.write(mv[:size])
+                        self.ring_max = max(self.ring_max, len(ring))
+                        self.ingest_event.set()
+                        if size == len(buf):
+                            # More data is probably waiting
+                            continue
+            except Exception as e:
+                self.ingest_errors += 1
+                if DEBUG:
+                    print_exception(e)
+            time.sleep(poll_ms / 1000)
+
+    async def check_baud(self, baudrate, timeout_ms=1500, needed=3):
+        """Return True if valid NMEA sentences (checksum) or RTCM frames (CRC) are received at baudrate."""
+        self.set_baud(baudrate)
+        # Discard data received at the old rate
+        self.uart.read()
+        valid = 0
+        start = ticks_ms()
+        while valid < needed and ticks_diff(ticks_ms(), start) < timeout_ms:
+            if (size := self.uart.any()):
+                self.framer.commit(self.uart.readinto(self.framer.writable(size)) or 0)
+                while (msg := self.framer.pop()) is not None:
+                    # RTCM frames are only returned if the CRC is valid
+                    if msg[0] != 36 or nmea_valid(bytes(msg)):
+                        valid += 1
+            await sleep_ms(10)
+        self.framer.reset()
+        return valid >= needed
+
+    async def detect_baud(self, rates=BAUD_RATES):
+        """Find the GPS baud rate (trying the current rate first). Returns the rate, or None."""
+        current = self.baudrate
+        for rate in (current,) + tuple(r for r in rates if r != current):
+            if await self.check_baud(rate):
+                self.log("GPS baud rate detected: %s", rate)
+                return rate
+        self.log("Unable to detect GPS baud rate - using %s", current)
+        self.set_baud(current)
+        return None
+
+    async def negotiate_baud(self, target, timeout_ms=1000):
+        """Switch the GPS (Quectel, via PQTMCFGUART) and UART to a higher baud rate, and verify it.
+
+        Needs the GPS reader task running (for command responses). Returns True on success.
+        """
+        if target <= self.baudrate:
+            return True
+        old = self.baudrate
+        if not await self.command(f"PQTMCFGUART,W,{target}", timeout_ms=timeout_ms):
+            self.log("GPS did not accept baud rate %s", target)
+            return False
+        # Give the GPS time to switch
+        await sleep_ms(100)
+        self.set_baud(target)
+        if await self.command("PQTMVERNO", timeout_ms=timeout_ms):
+            self.log("GPS baud rate changed: %s -> %s", old, target)
+            return True
+        self.log("No GPS response at %s - reverting to %s", target, old)
+        self.set_baud(old)
+        return False
+
+    async def log_throughput(self, seconds=10):
+        """Log how much of the UART bandwidth is used by GPS data."""
+        start = self.bytes_read
+        await asyncio.sleep(seconds)
+        rate = (self.bytes_read - start) // seconds
+        # 10 bits per byte (8N1)
+        capacity = self.baudrate // 10
+        self.log("GPS UART: %s B/s of %s B/s at %s baud (%s%% used, %s B/s headroom)", rate, capacity, self.baudrate, 100 * rate // capacity, capacity - rate)
+        if rate > capacity * 9 // 10:
+            self.log("WARNING: GPS UART is close to capacity - data may be lost. Consider a higher baud rate (GPS_BAUD_TARGET).")
+
+    @staticmethod
+    def response_prefix(msg):
+        """Return the expected response prefix for a command.
+
+        Quectel PAIR commands are acknowledged with $PAIR001,<command id>,<result>.
+        Other commands (e.g. PQTMCFGxxx) respond with a sentence starting with the command name.
+        """
+        name = msg.split(",", 1)[0].split("*", 1)[0]
+        if name.startswith("PAIR") and name[4:].isdigit():
+            return f"$PAIR001,{name[4:]},".encode()
+        return f"${name},".encode()
 
+    def match_prefix(self, msg, resp_prefix=""):
+        """Return the prefix to match a command's response with, and whether it identifies the command.
 
-    def write_nmea(self, msg, resp_prefix=""):
-        """Write NMEA sentence to the GPS (adding $ and checksum)."""
-        msg =msg.lstrip("$")
+        A configured prefix which the command's own response starts with (e.g. "$P") is narrowed to
+        that response, so other sentences (e.g. $PQTMEPE) or other commands' responses don't match.
+        """
+        own = self.response_prefix(msg)
+        if isinstance(resp_prefix, str):
+            resp_prefix = resp_prefix.encode()
+        if not resp_prefix or own.startswith(resp_prefix):
+            return own, True
+        return resp_prefix, False
+
+    async def command(self, msg, resp_prefix="", timeout_ms=1000):
+        """Write an NMEA command to the GPS (adding $ and checksum), and wait for its response.
+
+        Responses are passed in (from the GPS reader task) by `check_response`. If resp_prefix
+        isn't set, it is worked out from the command. Returns the response, or None on timeout.
+        """
+        msg = msg.lstrip("$")
         if not "*" in msg:
             chksum = nmea_checksum(msg)
             msg = f"{msg}*{chksum}"
-        self.log(f"Sent GPS Cmd: {msg}")
+        waiter = [self.match_prefix(msg, resp_prefix)[0], asyncio.Event(), None]
+        self.waiters.append(waiter)
+        self.log("Sent GPS Cmd: %s", msg)
         self.uart.write(f"${msg}\r\n")
-        start = time.ticks_ms()
-        # Read back any GPS responses for 200ms after write
-        while time.ticks_diff(time.ticks_ms(), start) < 200:
-            if self.uart.any():
-                resp = self.uart.read(self.uart.any())
-                if resp and resp.startswith(resp_prefix):
-                    self.log(f"GPS Response: {resp.decode()}")
-                    # Hand back for remote shell to return
-                    return resp
-            else:
-                time.sleep_ms(5)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout_ms / 1000)
+            self.log("GPS Response: %s", waiter[2].decode().strip())
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.log("No GPS response to: %s", msg)
+        finally:
+            self.waiters.remove(waiter)
+        return waiter[2]
+
+    async def send_commands(self, cmds, resp_prefix="", timeout_ms=1000):
+        """Send a list of commands, with up to `pipeline` awaiting responses at once. Returns the responses."""
+        pipeline = self.pipeline
+        if not all(self.match_prefix(cmd.lstrip("$"), resp_prefix)[1] for cmd in cmds):
+            # Responses to a custom prefix can't be told apart - wait for each before sending the next
+            pipeline = 1
+        resps = []
+        for i in range(0, len(cmds), pipeline):
+            resps.extend(await asyncio.gather(*[self.command(cmd, resp_prefix, timeout_ms) for cmd in cmds[i:i + pipeline]]))
+        return resps
+
+    def check_response(self, sentence):
+        """Pass an NMEA sentence from the GPS to the oldest command waiting for it (if any)."""
+        for waiter in self.waiters:
+            if waiter[2] is None and sentence.startswith(waiter[0]):
+                waiter[2] = sentence
+                waiter[1].set()
+                return True
+        return False
 
     def pqtmepe_to_gst(self, pqtmepe):
         """
@@ -96,9 +304,34 @@ class GPS():
         cs = nmea_checksum(gst_body)
         return f"${gst_body}*{cs}".encode()
 
+# Log levels
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+LOG_LEVELS = {"DEBUG": LOG_DEBUG, "INFO": LOG_INFO, "WARNING": LOG_WARNING, "ERROR": LOG_ERROR}
+
+
 class Logger:
-    """Log to stdout, or via a handler."""
+    """Log to stdout, or via a handler.
+
+    Messages below `level` are discarded before formatting: pass format args
+    separately (`log("Error: %s", e, level=LOG_ERROR)`) so they are only formatted
+    if logged. Records are kept in a fixed-size ring of recent messages. Once
+    `drain` is running, records are written to the handler in the background at
+    a bounded rate (dropping the oldest if the ring fills), otherwise immediately.
+    """
     _handler = sys.stdout
+    level = LOG_INFO
+    size = 64
+    # Ring of (ticks_ms, level, message) - record n is at records[n % size]
+    records = [None] * size
+    written = 0
+    drained = 0
+    dropped = 0
+    reported = 0
+    draining = False
+    event = None
 
     def getLogger():
         return Logger()
@@ -108,10 +341,71 @@ class Logger:
         """Set handler (must have .write(str) method)."""
         cls._handler = handler
 
-    def log(self, msg):
+    def log(self, msg, *args, level=LOG_INFO):
+        cls = Logger
+        if level < cls.level:
+            return
+        if args:
+            msg = msg % args
+        cls.records[cls.written % cls.size] = (ticks_ms(), level, msg)
+        cls.written += 1
+        if cls.draining:
+            if cls.written - cls.drained > cls.size:
+                # Ring full - oldest record overwritten before it was written out
+                cls.dropped += 1
+                cls.drained += 1
+            cls.event.set()
+        else:
+            cls.drained = cls.written
+            cls.write(msg)
+
+    @classmethod
+    def write(cls, msg):
+        msg = str(msg)
         if not msg.endswith("\n"):
             msg = msg + "\n"
-        Logger._handler.write(str(msg))
+        cls._handler.write(msg)
+
+    @classmethod
+    def write_next(cls):
+        """Write the next record to the handler."""
+        if cls.dropped != cls.reported:
+            cls.write(f"[LOG] {cls.dropped - cls.reported} messages dropped")
+            cls.reported = cls.dropped
+        cls.write(cls.records[cls.drained % cls.size][2])
+        cls.drained += 1
+
+    @classmethod
+    async def drain(cls, rate=20):
+        """Write records to the handler in the background, at up to `rate` per second (0 for unlimited)."""
+        cls.event = asyncio.Event()
+        cls.draining = True
+        interval = 1000 // rate if rate > 0 else 0
+        try:
+            while True:
+                if cls.drained == cls.written:
+                    cls.event.clear()
+                    await cls.event.wait()
+                cls.write_next()
+                await sleep_ms(interval)
+        finally:
+            cls.draining = False
+
+    @classmethod
+    def flush(cls):
+        """Write out all pending records now (e.g. at shutdown)."""
+        while cls.drained < cls.written:
+            cls.write_next()
+
+    @classmethod
+    def recent(cls, count=20):
+        """Return the most recent records (as strings), oldest first."""
+        names = {v: k for k, v in LOG_LEVELS.items()}
+        start = max(cls.written - min(count, cls.size), 0)
+        return [
+            f"{rec[0]} {names.get(rec[1], rec[1])} {rec[2]}"
+            for rec in (cls.records[n % cls.size] for n in range(start, cls.written))
+        ]
 
 
 class Serial():
@@ -130,7 +424,7 @@ class Serial():
                     # Send log messages to serial output
                     logging.setHandler(self.SerialHandler(self.uart))
             except Exception as e:
-                log(f"ERROR: Unable to open UART ({uart}) device.. Serial output disabled.")
+                log("ERROR: Unable to open UART (%s) device.. Serial output disabled.", uart, level=LOG_ERROR)
 
 
     class SerialHandler():
@@ -153,4 +447,4 @@ class Serial():
                         chksum = nmea_checksum(msg_str)
                         self.uart.write(f"$PLOG,{msg_str}*{chksum}\r\n")
             except Exception as e:
-                sys.print_exception(e)
+                print_exception(e)
@@ -0,0 +1,72 @@
+"""Latency tracing: how long GPS data takes from the UART to each output.
+
+The GPS reader stamps a sample of messages (1 in `sample`) with the time
+(`ticks_us`) they were read from the UART. The NTRIP caster and client stamp
+a sample of the data they read from the network in the same way. Each output records the time from
+that stamp until the message is handed to its transport (UART write, BLE
+notify, ESP-Now send, socket write) in its own histogram (latency.<output>_us).
+
+Outputs which queue data as a byte stream track one traced message at a time
+with a `Probe`, by the stream position its last byte will have been sent at.
+Messages which aren't sampled carry no stamp (None), so tracing costs next to
+nothing when disabled.
+"""
+from compat import ticks_diff, ticks_us
+from metrics import registry
+
+# Latency histogram bounds (us)
+BOUNDS = (500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000, 2000000)
+
+
+def histogram(name):
+    return registry.histogram(f"latency.{name}_us", BOUNDS)
+
+
+class Probe():
+    """Latency of traced data through a byte stream (a queue), one traced message at a time."""
+
+    def __init__(self, name):
+        self.hist = histogram(name)
+        # Stream position at which the traced message has been sent, and its ingest stamp
+        self.mark = None
+        self.stamp = 0
+
+    def queued(self, end, stamp):
+        """Traced data (stamped at ingest) was queued, ending at stream position end."""
+        if self.mark is None:
+            self.mark = end
+            self.stamp = stamp
+
+    def sent(self, total):
+        """The stream has been sent (handed to the transport) up to position total."""
+        if self.mark is not None and total >= self.mark:
+            observe(self.hist, self.stamp)
+            self.mark = None
+
+    def dropped(self, total):
+        """The stream was dropped (not sent) up to position total."""
+        if self.mark is not None and total >= self.mark:
+            self.mark = None
+
+
+class Tracer():
+
+    def __init__(self, sample=16):
+        # Trace 1 in sample messages
+        self.sample = sample
+        self.count = 0
+        self.traced = registry.counter("latency.traced")
+
+    def stamp(self, read_us):
+        """Return the stamp for the next message (read from the UART at read_us), or None if not sampled."""
+        self.count += 1
+        if self.count < self.sample:
+            return None
+        self.count = 0
+        self.traced.inc()
+        return read_us
+
+
+def observe(hist, stamp):
+    """Record the latency of a message stamped at ingest, handed to its transport now."""
+    hist.observe(ticks_diff(ticks_us(), stamp))
@@ -1,11 +1,15 @@
 import asyncio
+import gc
+import time
 from os import rename
 from machine import Pin, reset
-from sys import print_exception
-from time import sleep_ms
+from compat import ThreadSafeFlag, print_exception, sleep_ms, ticks_diff, ticks_ms, ticks_us
 from net import Net
 import config as cfg
-from devices import Logger
+from devices import LOG_DEBUG, LOG_ERROR, LOG_LEVELS, NMEA_LEN, Logger, nmea_checksum
+from latency import observe
+from metrics import registry
+from rtcm import PREAMBLE, Framer, msg_type
 try:
     from debug import DEBUG
 except ImportError:
@@ -20,22 +24,52 @@ class ESP32GPS():
         self.net = None
         self.blue = None
         self.gps = None
-        self.irq_event = asyncio.ThreadSafeFlag()
-        self.espnow_event = asyncio.ThreadSafeFlag()
+        self.irq_event = ThreadSafeFlag()
+        self.espnow_event = ThreadSafeFlag()
         self.shutdown_event = asyncio.Event()
         self.serial = None
         self.ntrip_caster = None
-        self.ntrip_server = None
+        self.ntrip_uplink = None
         self.ntrip_client = None
+        self.broadcast = None
+        self.recorder = None
         self.tasks = []
+        self.monitor = None
+        self.frame_pool = None
+        self.gc_scheduler = None
+        # Latency tracing (see latency.py), if enabled
+        self.tracer = None
+        self.serial_latency = None
+        # RTCM bandwidth shaping for ESP-Now output (see shaper.py)
+        self.espnow_shaper = None
+        # MSM7 -> MSM4 conversion for ESP-Now output (see transcode.py)
+        self.espnow_transcoder = None
         self.shell_callbacks = {}
+        # Messages from the GPS (or ESPNow), by NMEA sentence type or RTCM message number
+        self.sentences = registry.tally("gps.sentences")
+        self.serial_skipped = registry.counter("serial.skipped")
+        registry.gauge("tasks", lambda: sum(1 for t in self.tasks if not t.done()))
+        registry.gauge("log.queued", lambda: Logger.written - Logger.drained)
+        registry.gauge("log.dropped", lambda: Logger.dropped)
+        if hasattr(gc, "mem_free"):
+            registry.gauge("mem.free", gc.mem_free)
+            registry.gauge("mem.alloc", gc.mem_alloc)
+
+    def create_task(self, coro, tag):
+        """Start a background task (tagged, so the loop monitor can attribute stalls to it)."""
+        if self.monitor:
+            task = self.monitor.create_task(coro, tag)
+        else:
+            task = asyncio.create_task(coro)
+        self.tasks.append(task)
+        return task
 
     def gps_reset(self):
         if (
             hasattr(cfg, "ENABLE_GPS_RESET") and
             (pin := getattr(cfg, "GPS_RESET_PIN", None))
         ):
-            log(f"Resetting GPS device via pin: {pin}")
+            log("Resetting GPS device via pin: %s", pin)
             reset_pin = Pin(pin, Pin.OUT)
             # Default to resetting by going 'high'
             reset_val = 1
@@ -45,7 +79,7 @@ class ESP32GPS():
 
             # Sset reset value
             reset_pin.value(reset_val)
-            sleep_ms(100)
+            time.sleep(0.1)
             # Revert to inverse of reset value
             reset_pin.value(not reset_val)
 
@@ -58,22 +92,39 @@ class ESP32GPS():
         reset()
 
 
-    def setup_gps(self):
+    async def setup_gps(self):
         log("Enabling GPS device.")
         from devices import GPS
         try:
             self.gps = GPS(uart=cfg.GPS_UART, baudrate=cfg.GPS_BAUD_RATE, tx=cfg.GPS_TX_PIN, rx=cfg.GPS_RX_PIN)
         except (AttributeError, ValueError, OSError) as e:
-            log(f"Error setting up GPS: {e}")
+            log("Error setting up GPS: %s", e, level=LOG_ERROR)
             return
         if hasattr(self.gps, "uart"):
+            registry.gauge("gps.bytes_in", lambda: self.gps.bytes_read)
+            registry.gauge("gps.discarded", lambda: self.gps.framer.discarded)
+            registry.gauge("gps.rx_full", lambda: self.gps.rx_full)
+            if getattr(cfg, "GPS_BAUD_DETECT", False):
+                await self.gps.detect_baud()
+            if getattr(cfg, "GPS_INGEST_THREAD", False):
+                # Drain the UART from a second thread, so it doesn't overflow while the event loop is busy
+                self.gps.start_ingest(getattr(cfg, "GPS_INGEST_RING", 8192), getattr(cfg, "GPS_INGEST_POLL_MS", 2))
+                registry.gauge("gps.ring_full", lambda: self.gps.ring_full)
+                registry.gauge("gps.ring_max", lambda: self.gps.ring_max)
+                log("GPS ingest thread started (%d byte ring).", len(self.gps.ring.buf) - 1)
+            # Reader must be running to receive command responses
+            self.create_task(self.gps_reader(), "gps_reader")
             if (cmds := getattr(cfg, "GPS_SETUP_COMMANDS", None)):
-                # Prefix used to filter response messages
+                # Prefix of the expected responses (if not set, matched to each command)
                 prefix = getattr(cfg, "GPS_SETUP_RESPONSE_PREFIX", "")
-                for cmd in cmds:
-                    self.gps.write_nmea(cmd, prefix)
+                start = ticks_ms()
+                resps = await self.gps.send_commands(cmds, prefix, getattr(cfg, "GPS_COMMAND_TIMEOUT", 1000))
+                log("GPS setup: %s commands in %sms, %s responses.", len(cmds), ticks_diff(ticks_ms(), start), len([r for r in resps if r]))
                 if hasattr(cfg, "GPS_SETUP_COMMANDS_RESET"):
                     self.gps_reset()
+            if (target := getattr(cfg, "GPS_BAUD_TARGET", None)):
+                await self.gps.negotiate_baud(target)
+            self.create_task(self.gps.log_throughput(), "gps_throughput")
 
     def setup_serial(self):
         from devices import Serial
@@ -85,24 +136,36 @@ class ESP32GPS():
             pass
 
 
-    def setup_networks(self):
+    async def setup_networks(self):
         txpower = getattr(cfg, "WIFI_TXPOWER", None)
         self.net = Net(txpower=txpower)
         # Note: We start wifi first, as this will define the channel to be used.
         # Wifi connections also enable power management, which espnow startup will later disable.
         # See: https://docs.micropython.org/en/latest/library/espnow.html#espnow-and-wifi-operation
+        espnow_mode = getattr(cfg, "ESPNOW_MODE", None)
         if ((ssid := getattr(cfg, "WIFI_SSID", None)) and (psk := getattr(cfg, "WIFI_PSK"))):
             self.net.enable_wifi(ssid=cfg.WIFI_SSID, key=cfg.WIFI_PSK)
+            # Connect (and reconnect) in the background
+            self.create_task(self.net.wifi_supervisor(), "wifi")
+            if espnow_mode:
+                # ESPNow must use the AP's channel, so give wifi a chance to connect first
+                await self.net.wait_connected(10000)
         # Start ESPNow if peers provided
         peers = getattr(cfg, "ESPNOW_PEERS", set())
-        if (espnow_mode := getattr(cfg, "ESPNOW_MODE", None)):
+        if espnow_mode:
             self.net.enable_espnow(peers=peers)
+            if espnow_mode == "sender" and (intervals := getattr(cfg, "RTCM_SHAPE_ESPNOW", None)):
+                from shaper import Shaper
+                self.espnow_shaper = Shaper("espnow", intervals)
+            if espnow_mode == "sender" and getattr(cfg, "RTCM_MSM4_ESPNOW", False):
+                from transcode import MSM4Transcoder
+                self.espnow_transcoder = MSM4Transcoder("espnow")
             if hasattr(cfg, "ESPNOW_DISCOVER_PEERS"):
                 # Regularly broadcast presence for peer discovery
-                self.tasks.append(asyncio.create_task(self.net.espnow_broadcast()))
+                self.create_task(self.net.espnow_broadcast(), "espnow_broadcast")
                 if espnow_mode == "sender":
                     # Read occasionally to look for peers
-                    self.tasks.append(asyncio.create_task(self.net.espnow_find_peers()))
+                    self.create_task(self.net.espnow_find_peers(), "espnow_peers")
 
     def esp32_write_data(self, value):
         """Callback to run if device is written to (BLE, Serial)"""
@@ -111,91 +174,240 @@ class ESP32GPS():
     async def ntrip_client_read(self):
         """Read data from NTRIP client and write to GPS device."""
         while True:
-            async for data in ntrip_client.iter_data():
-                self.esp32_write_data(data)
+            # Each item is a memoryview of whole RTCM frames, written without copying
+            async for frames in self.ntrip_client.iter_data():
+                self.esp32_write_data(frames)
+
+    def nmea_output(self, sentence):
+        """Write a locally generated NMEA sentence to serial and bluetooth outputs."""
+        if getattr(cfg, "ENABLE_SERIAL_CLIENT", False) and hasattr(self.serial, "uart"):
+            self.serial.uart.write(sentence)
+        if self.blue and self.blue.is_connected():
+            self.blue.send(sentence)
+
+    async def ntrip_client_status(self, interval):
+        """Regularly output NTRIP client status as a $PCORR sentence."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.nmea_output(self.ntrip_client.status_nmea())
+            except Exception as e:
+                log("[NTRIP STATUS] Output exception: %r", e, level=LOG_ERROR)
+
+    def count_message(self, msg):
+        """Count a message by NMEA sentence type (e.g. GNGGA) or RTCM message number."""
+        if msg[0] == 36:
+            self.sentences.inc(msg[1:msg.find(b",")])
+        elif msg[0] == PREAMBLE and len(msg) > 5:
+            self.sentences.inc(msg_type(msg))
+
+    def stats_nmea(self):
+        """Return metrics as $PSTAT proprietary NMEA sentences (name=value fields), split as for $PLOG."""
+        sentences = []
+        body = ""
+        for field in registry.fields():
+            field = field[:NMEA_LEN - 6]
+            if body and len(body) + len(field) + 1 > NMEA_LEN - 6:
+                sentences.append(body)
+                body = ""
+            body += ("," if body else "") + field
+        if body:
+            sentences.append(body)
+        return [f"$PSTAT,{body}*{nmea_checksum('PSTAT,' + body)}\r\n".encode() for body in sentences]
+
+    async def stats_output(self, interval):
+        """Regularly output metrics as $PSTAT sentences."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for sentence in self.stats_nmea():
+                    self.nmea_output(sentence)
+            except Exception as e:
+                log("[STATS] Output exception: %r", e, level=LOG_ERROR)
 
     async def espnow_reader(self):
-        """Read from ESPNow in async loop, and send for outputting."""
+        """Read from ESPNow in async loop, and send each whole NMEA sentence/RTCM frame for outputting.
+
+        Senders pack data into full ESPNow messages, so sentences and frames are reassembled here.
+        """
         discover_peers = getattr(cfg, "ESPNOW_DISCOVER_PEERS", False)
+        framer = Framer(2048)
         while True:
             try:
                 data = await self.net.espnow_recv(discover_peers=discover_peers)
                 if data:
-                    await self.gps_data(data)
+                    framer.feed(data)
+                    while (msg := framer.pop()) is not None:
+                        await self.gps_data(bytes(msg) if msg[0] == 36 else msg)
             except Exception as e:
                 print_exception(e)
             await asyncio.sleep(0)
 
     async def gps_reader(self):
         # FIXME: Move to code where this task is instantiated
-        if (
+        forward = (
             "server" in getattr(cfg, "NTRIP_MODE", []) or
+            # Client needs position for GGA upload/nearest mount
+            (
+                "client" in getattr(cfg, "NTRIP_MODE", []) and
+                (getattr(cfg, "NTRIP_CLIENT_GGA", False) or getattr(cfg, "NTRIP_CLIENT_NEAREST_MOUNT", False))
+            ) or
             getattr(cfg, "ESPNOW_MODE", None) == "sender" or
+            getattr(cfg, "BROADCAST_PORT", None) or
+            getattr(cfg, "ENABLE_RECORDER", False) or
             hasattr(cfg, "ENABLE_SERIAL_CLIENT") or
             (self.blue and self.blue.is_connected())
-        ):
-            while True:
-                try:
-                    data = self.gps.uart.read()
-                    if data:
-                        await self.gps_data(data)
-                except Exception as e:
-                    print_exception(e)
-                await asyncio.sleep_ms(0)
-
-    async def gps_data(self, line):
+        )
+        uart = self.gps.uart
+        framer = self.gps.framer
+        rxbuf = self.gps.rxbuf
+        # If the ingest thread is running, read from its ring buffer rather than the UART
+        ring = self.gps.ring
+        tracer = self.tracer
+        stamp = None
+        # Always read (even if there are no outputs) so command responses are received
+        while True:
+            try:
+                if ring is not None:
+                    if not len(ring):
+                        await self.gps.ingest_event.wait()
+                    size = len(ring)
+                    src = ring
+                else:
+                    size = uart.any()
+                    if size >= rxbuf:
+                        self.gps.rx_full += 1
+                    src = uart
+                if size:
+                    if tracer:
+                        # Time the data was read from the UART (by the ingest thread, for the oldest data in the ring)
+                        read_us = self.gps.ring_stamp if ring is not None else ticks_us()
+                    size = src.readinto(framer.writable(size)) or 0
+                    framer.commit(size)
+                    self.gps.bytes_read += size
+                    if self.gc_scheduler:
+                        self.gc_scheduler.activity()
+                    # Handle each whole NMEA sentence/RTCM frame
+                    while (msg := framer.pop()) is not None:
+                        if msg[0] == 36:
+                            # NMEA sentences are short, and are parsed as bytes
+                            msg = bytes(msg)
+                        # RTCM frames stay a view of the framer's buffer - valid until the next read,
+                        # as outputs copy (or have finished with) the data before gps_data returns
+                        self.count_message(msg)
+                        if self.gps.waiters and msg[0] == 36:
+                            self.gps.check_response(msg)
+                        if forward:
+                            if tracer:
+                                stamp = tracer.stamp(read_us)
+                            await self.gps_data(msg, stamp)
+            except Exception as e:
+                print_exception(e)
+            await sleep_ms(0)
+
+    async def gps_data(self, line, stamp=None):
         """Read GPS data and send to configured outputs.
 
         All exceptions are caught and logged to avoid crashing the main thread.
 
-        NMEA sentences are sent to (if enabled): USB serial, Bluetooth, ESPNow and NTRIP server (only non-NMEA data).
+        NMEA sentences are sent to (if enabled): USB serial, Bluetooth, ESPNow and NTRIP server (only RTCM frames).
+
+        NMEA sentences are bytes, RTCM frames a memoryview (which outputs must copy, not keep).
+        If stamp (the time it was read from the GPS UART) is set, its latency to each output is traced.
         """
         if not line:
             return
-        isNMEA = False
+        is_nmea = line[0] == 36
         # Handle NMEA sentences
-        if line.startswith(b"$") and line.endswith(b"\r\n"):
-            isNMEA = True
+        if is_nmea and line.endswith(b"\r\n"):
             if cfg.ENABLE_GPS and cfg.PQTMEPE_TO_GGST:
                 if line.startswith(b"$GNRMC"):
                     # Extract UTC_TIME (as str) for use in GST sentence creation
                     self.gps.utc_time = line.split(b",",2)[1].decode("UTF-8")
                 if line.startswith(b"$PQTMEPE"):
                     line = self.gps.pqtmepe_to_gst(line)
+        if self.ntrip_client and is_nmea and b"GGA," in line:
+            # Track position for NTRIP client GGA upload/nearest mount
+            self.ntrip_client.update_position(line)
         try:
             if cfg.ENABLE_SERIAL_CLIENT:
                 # Only send a line if the last transmit completed - avoid buffer overflow
                 if self.serial.uart.txdone():
                     self.serial.uart.write(line)
                     self.serial.uart.flush()
+                    if stamp is not None:
+                        observe(self.serial_latency, stamp)
+                else:
+                    self.serial_skipped.inc()
         except Exception as e:
-            log(f"[GPS DATA] USB serial send exception: {print_exception(e)}")
+            log("[GPS DATA] USB serial send exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
         try:
             if cfg.ENABLE_BLUETOOTH and self.blue.is_connected():
-                self.blue.send(line)
+                self.blue.send(line, stamp)
         except Exception as e:
-            log(f"[GPS DATA] BT send exception: {print_exception(e)}")
+            log("[GPS DATA] BT send exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
+
+        try:
+            if self.recorder:
+                self.recorder.write(line)
+                if not self.recorder.clock_set and is_nmea and line.startswith(b"$G") and line[3:7] == b"RMC,":
+                    self.recorder.set_clock(line)
+        except Exception as e:
+            log("[GPS DATA] Recorder exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
+
+        try:
+            if self.broadcast:
+                self.broadcast.write(line, stamp)
+        except Exception as e:
+            log("[GPS DATA] Broadcast send exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
 
         try:
             if self.net.espnow_connected and cfg.ESPNOW_MODE == "sender":
-                await self.net.espnow_sendall(line)
+                if not self.espnow_shaper or self.espnow_shaper.allow(line):
+                    if self.espnow_transcoder and not is_nmea:
+                        line = self.espnow_transcoder.convert(line)
+                    await self.net.espnow_sendall(line, stamp)
         except Exception as e:
-            log(f"[GPS DATA] ESPNow send exception: {print_exception(e)}")
+            log("[GPS DATA] ESPNow send exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
 
         try:
-            # Don't sent NMEA sentences to NTRIP server
-            if not isNMEA and self.ntrip_server:
-                await self.ntrip_server.send_data(line)
+            # The NTRIP server only sends RTCM frames (NMEA is ignored)
+            if self.ntrip_uplink:
+                await self.ntrip_uplink.send_data(line, stamp)
         except Exception as e:
-            log(f"[GPS DATA] NTRIP server send exception: {print_exception(e)}")
+            log("[GPS DATA] NTRIP server send exception: %r", e, level=LOG_ERROR)
+            if DEBUG:
+                print_exception(e)
         # Settle
         await asyncio.sleep(0)
 
     def setup_shell_callbacks(self):
-        for cmd in ["CFG", "GPS", "RESET", "RESETGPS"]:
+        for cmd in ["BLE", "BROADCAST", "CFG", "GPS", "LOG", "LOOP", "MEM", "NTRIP", "RECORD", "RESET", "RESETGPS", "STATS", "WIFI"]:
             self.shell_callbacks[cmd] = getattr(self, f"cb_{cmd}")
 
     # Callback functions for shell remote commands
+    def cb_BLE(self, opts):
+        """Report bluetooth connections and notification stats."""
+        if self.blue:
+            return self.blue.status()
+        return "Bluetooth not enabled."
+
+    def cb_BROADCAST(self, opts):
+        """Report network broadcast clients and stats."""
+        if self.broadcast:
+            return self.broadcast.status()
+        return "Broadcast not enabled."
+
     def cb_CFG(self, opts):
         """Report current config or update config.py on the device."""
         conf_dict = { k: getattr(cfg, k) for k in dir(cfg) if k.isupper() }
@@ -223,13 +435,86 @@ class ESP32GPS():
         except OSError as e:
             return(f"Unable to save config to file: {e}")
 
-    def cb_GPS(self, opts):
+    async def cb_GPS(self, opts):
         """Write a command to the GPS device."""
         if hasattr(self.gps, "uart"):
-            # Prefix used to filter response messages
+            # Prefix of the expected response (if not set, matched to the command)
             prefix = getattr(cfg, "GPS_SETUP_RESPONSE_PREFIX", "")
             # Return the GPS response output
-            return self.gps.write_nmea(opts, prefix)
+            return await self.gps.command(opts, prefix, getattr(cfg, "GPS_COMMAND_TIMEOUT", 1000)) or "No response from GPS."
+
+    def cb_LOG(self, opts):
+        """Return recent log messages (from memory - doesn't affect serial output)."""
+        try:
+            count = int(opts) if opts else 20
+        except ValueError:
+            return "Usage: LOG [count]"
+        lines = Logger.recent(count)
+        lines.append(f"({Logger.written} logged, {Logger.written - Logger.drained} queued, {Logger.dropped} dropped)")
+        return "\n".join(lines)
+
+    def cb_LOOP(self, opts):
+        """Report event loop lag, stalls, and step times for each task."""
+        if self.monitor:
+            return self.monitor.status()
+        return "Loop monitor not enabled."
+
+    def cb_MEM(self, opts):
+        """Report heap usage, scheduled GC pauses and the frame buffer pool."""
+        status = []
+        if self.gc_scheduler:
+            status.append(self.gc_scheduler.status())
+        elif hasattr(gc, "mem_free"):
+            status.append(f"Heap: {gc.mem_free()} bytes free, {gc.mem_alloc()} allocated (GC not scheduled)")
+        if self.frame_pool:
+            status.append(self.frame_pool.status())
+        return "\n".join(status) or "No memory stats available."
+
+    def cb_NTRIP(self, opts):
+        """Report NTRIP client status (correction age) and server upload stats."""
+        status = []
+        if self.ntrip_client:
+            status.append(self.ntrip_client.status())
+        if self.ntrip_uplink:
+            status.append(self.ntrip_uplink.status())
+        if self.ntrip_caster and self.ntrip_caster.transcoder:
+            status.append(self.ntrip_caster.transcoder.status())
+        if status:
+            from resolver import resolver
+            status.append(resolver.status())
+        return "\n".join(status) or "No NTRIP client or server running."
+
+    def cb_RECORD(self, opts):
+        """Report recorder status, list recordings, or extract the raw data recorded between 2 times."""
+        if not self.recorder:
+            return "Recorder not enabled."
+        args = opts.split()
+        if not args:
+            return self.recorder.status()
+        if args[0] == "LIST":
+            return self.recorder.list()
+        if args[0] == "GET" and len(args) == 3:
+            from recorder import parse_time
+            try:
+                start, end = parse_time(args[1]), parse_time(args[2])
+            except (ValueError, OverflowError):
+                return "Invalid time - use YYYY-MM-DDTHH:MM[:SS]"
+            # Streamed by the shell, chunk by chunk
+            return self.recorder.extract(start, end)
+        return "Usage: RECORD [LIST | GET <start> <end>]"
+
+    def cb_STATS(self, opts):
+        """Report all metrics (or those starting with a prefix, e.g. STATS ble)."""
+        return registry.report(opts.strip())
+
+    def cb_WIFI(self, opts):
+        """Report wifi link status and reconnect stats (and ESP-Now shaping/transcoding)."""
+        status = self.net.status()
+        if self.espnow_shaper:
+            status += "\n" + self.espnow_shaper.status()
+        if self.espnow_transcoder:
+            status += "\n" + self.espnow_transcoder.status()
+        return status
 
     def cb_RESETGPS(self, opts):
         """Reset just the GPS device."""
@@ -256,17 +541,47 @@ class ESP32GPS():
         a. NTRIP services (caster, server, client)
         """
 
+        # Measure event loop lag, and which task caused any stalls
+        if (interval := getattr(cfg, "LOOP_MONITOR_INTERVAL", 0)):
+            from monitor import Monitor
+            self.monitor = Monitor(interval, getattr(cfg, "LOOP_STALL_MS", 50))
+            self.tasks.append(asyncio.create_task(self.monitor.run()))
+
+        # Collect garbage between GPS epochs, rather than whenever an allocation fails
+        if getattr(cfg, "GC_SCHEDULE", True):
+            from memory import GCScheduler
+            self.gc_scheduler = GCScheduler(
+                idle_ms=getattr(cfg, "GC_IDLE_MS", 20),
+                min_alloc=getattr(cfg, "GC_MIN_ALLOC", 8192),
+                max_interval_ms=getattr(cfg, "GC_MAX_INTERVAL", 5000),
+                threshold=getattr(cfg, "GC_THRESHOLD", None),
+            )
+            self.create_task(self.gc_scheduler.run(), "gc")
+
+        # Trace the latency from GPS ingest to each output, for 1 in TRACE_SAMPLE messages
+        if (sample := getattr(cfg, "TRACE_SAMPLE", 0)):
+            from latency import Tracer, histogram
+            self.tracer = Tracer(sample)
+            self.serial_latency = histogram("serial")
+
+        # Log messages are written out in the background (at a limited rate), so they don't hold up GPS data
+        Logger.level = LOG_DEBUG if DEBUG else LOG_LEVELS.get(getattr(cfg, "LOG_LEVEL", "INFO"), LOG_LEVELS["INFO"])
+        self.create_task(Logger.drain(getattr(cfg, "LOG_RATE", 20)), "log")
+
         # Start serial early, as logs may be redirected to it.
         if getattr(cfg, "ENABLE_SERIAL_CLIENT", None):
             self.setup_serial()
             if hasattr(self.serial, "uart"):
-                log(f"Serial output enabled (UART{self.serial.id})")
+                log("Serial output enabled (UART%s)", self.serial.id)
             else:
                 # Serial setup didn't create uart for some reason, so turn off serial logging
                 cfg.ENABLE_SERIAL_CLIENT = False
 
         # Set up wifi
-        self.setup_networks()
+        await self.setup_networks()
+        if self.tracer:
+            from latency import Probe
+            self.net.espnow_probe = Probe("espnow")
 
         # Set up remote shell
         if hasattr(cfg, "ENABLE_SHELL"):
@@ -280,20 +595,19 @@ class ESP32GPS():
             if (passwd := getattr(cfg, "SHELL_PASSWORD", None)):
                 kwargs["password"] = passwd
             sh = Shell(callbacks=self.shell_callbacks, **kwargs)
-            self.tasks.append(asyncio.create_task(sh.run()))
+            self.create_task(sh.run(), "shell")
 
         # Expect to receive gps data (from device, or ESPNOW)
         src_data = True
         espnow_mode = getattr(cfg, "ESPNOW_MODE", None)
         if cfg.ENABLE_GPS:
-            self.setup_gps()
-            self.tasks.append(asyncio.create_task(self.gps_reader()))
+            await self.setup_gps()
             # sender goes with GPS device
             if espnow_mode == "sender":
                 log("ESPNow: sender mode.")
         elif espnow_mode == "receiver":
             log("ESPNow: receiver mode.")
-            self.tasks.append(asyncio.create_task(self.espnow_reader()))
+            self.create_task(self.espnow_reader(), "espnow_reader")
         else:
             log("No GPS source available. Serial, Bluetooth and NTRIP server output will be disabled.")
             src_data = False
@@ -303,32 +617,112 @@ class ESP32GPS():
         if src_data and cfg.ENABLE_BLUETOOTH:
             from blue import Blue
             log("Enabling Bluetooth")
-            self.blue = Blue(name=cfg.DEVICE_NAME)
+            self.blue = Blue(name=cfg.DEVICE_NAME, rx_event=self.irq_event, max_connections=getattr(cfg, "BLUETOOTH_MAX_CONNECTIONS", 3), trace=bool(self.tracer))
             # Set custom BLE write callback
             self.blue.write_callback = self.esp32_write_data
-
-        # NTRIP needs a network connection
-        if self.net.wifi_connected:
+            self.create_task(self.blue.send_loop(), "ble_send")
+            self.create_task(self.blue.rx_loop(), "ble_rx")
+
+        if src_data and getattr(cfg, "ENABLE_RECORDER", False):
+            from recorder import Recorder
+            self.recorder = Recorder(
+                getattr(cfg, "RECORDER_PATH", "/gnss"),
+                blocks=getattr(cfg, "RECORDER_BLOCKS", 4),
+                file_size=getattr(cfg, "RECORDER_FILE_SIZE", 1048576),
+                file_secs=getattr(cfg, "RECORDER_FILE_SECS", 3600),
+                max_size=getattr(cfg, "RECORDER_MAX_SIZE", 8388608),
+                min_free=getattr(cfg, "RECORDER_MIN_FREE", 65536),
+                flush_interval=getattr(cfg, "RECORDER_FLUSH_INTERVAL", 10),
+            )
+            self.create_task(self.recorder.run(), "recorder")
+
+        # NTRIP and broadcast need a network connection (which may still be connecting, or reconnect later)
+        if self.net.wifi_connected or self.net.ssid:
+            if src_data and (port := getattr(cfg, "BROADCAST_PORT", None)):
+                from broadcast import Broadcast
+                self.broadcast = Broadcast(
+                    getattr(cfg, "BROADCAST_BIND_ADDRESS", "0.0.0.0"),
+                    port,
+                    mode=getattr(cfg, "BROADCAST_MODE", "all"),
+                    size=getattr(cfg, "BROADCAST_BUFFER", 8192),
+                    max_clients=getattr(cfg, "BROADCAST_MAX_CLIENTS", 5),
+                    udp_port=getattr(cfg, "BROADCAST_UDP_PORT", None),
+                )
+                if self.tracer:
+                    self.broadcast.probe = Probe("broadcast")
+                self.create_task(self.broadcast.run(), "broadcast")
             if cfg.NTRIP_MODE:
                 import ntrip
+                from resolver import resolver
+                resolver.ttl = getattr(cfg, "DNS_CACHE_TTL", 300)
             if "caster" in cfg.NTRIP_MODE:
                 self.ntrip_caster = ntrip.Caster(cfg.NTRIP_CASTER_BIND_ADDRESS, cfg.NTRIP_CASTER_BIND_PORT, cfg.NTRIP_SOURCETABLE, cfg.NTRIP_CLIENT_CREDENTIALS, cfg.NTRIP_SERVER_CREDENTIALS)
-                self.tasks.append(asyncio.create_task(self.ntrip_caster.run()))
+                if self.tracer:
+                    self.ntrip_caster.tracer = self.tracer
+                    self.ntrip_caster.latency = histogram("caster")
+                if getattr(cfg, "NTRIP_CASTER_MSM4", False):
+                    from transcode import MSM4Transcoder
+                    self.ntrip_caster.transcoder = MSM4Transcoder("caster")
+                self.create_task(self.ntrip_caster.run(), "caster")
                 # Allow Caster to start before Server/Client
                 await asyncio.sleep(2)
             if src_data and "server" in cfg.NTRIP_MODE:
-                self.ntrip_server = ntrip.Server(cfg.NTRIP_CASTER, cfg.NTRIP_PORT, cfg.NTRIP_MOUNT, cfg.NTRIP_SERVER_CREDENTIALS)
-                self.tasks.append(asyncio.create_task(self.ntrip_server.run()))
+                targets = getattr(cfg, "NTRIP_SERVER_TARGETS", None) or [
+                    (cfg.NTRIP_CASTER, cfg.NTRIP_PORT, cfg.NTRIP_MOUNT, cfg.NTRIP_SERVER_CREDENTIALS)
+                ]
+                servers = []
+                for target in targets:
+                    server = ntrip.Server(*target)
+                    server.max_pending_bytes = getattr(cfg, "NTRIP_SERVER_BUFFER", 8192)
+                    if self.tracer:
+                        server.latency = histogram("ntrip_server")
+                    if len(targets) > 1:
+                        server.name = f"Server {server.host}"
+                    servers.append(server)
+                    self.net.link_callbacks.append(server.link_up)
+                    self.create_task(server.run(), "ntrip_server")
+                # RTCM frames are queued for the servers in preallocated buffers
+                if (count := getattr(cfg, "FRAME_POOL_COUNT", 16)):
+                    from memory import BufferPool
+                    self.frame_pool = BufferPool(count, getattr(cfg, "FRAME_POOL_BUFFER", 512))
+                self.ntrip_uplink = ntrip.Uplink(servers, self.frame_pool)
+                if (intervals := getattr(cfg, "RTCM_SHAPE_NTRIP", None)):
+                    from shaper import Shaper
+                    self.ntrip_uplink.shaper = Shaper("ntrip", intervals)
+                if getattr(cfg, "RTCM_MSM4_NTRIP", False):
+                    from transcode import MSM4Transcoder
+                    self.ntrip_uplink.transcoder = MSM4Transcoder("ntrip")
             if cfg.ENABLE_GPS and "client" in cfg.NTRIP_MODE:
                 self.ntrip_client = ntrip.Client(cfg.NTRIP_CASTER, cfg.NTRIP_PORT, cfg.NTRIP_MOUNT, cfg.NTRIP_CLIENT_CREDENTIALS)
-                self.tasks.append(asyncio.create_task(self.ntrip_client.run()))
-                self.tasks.append(self.ntrip_client_read())
+                self.ntrip_client.send_gga = getattr(cfg, "NTRIP_CLIENT_GGA", False)
+                self.ntrip_client.gga_interval = getattr(cfg, "NTRIP_CLIENT_GGA_INTERVAL", 10)
+                self.ntrip_client.nearest_mount = getattr(cfg, "NTRIP_CLIENT_NEAREST_MOUNT", False)
+                self.ntrip_client.recheck_km = getattr(cfg, "NTRIP_CLIENT_RECHECK_KM", 10)
+                for candidate in getattr(cfg, "NTRIP_CLIENT_CANDIDATES", []):
+                    self.ntrip_client.add_candidate(*candidate)
+                self.ntrip_client.standby_enabled = getattr(cfg, "NTRIP_CLIENT_STANDBY", False)
+                self.ntrip_client.stall_timeout = getattr(cfg, "NTRIP_CLIENT_STALL_TIMEOUT", 10)
+                if self.tracer:
+                    self.ntrip_client.tracer = self.tracer
+                    self.ntrip_client.latency = histogram("ntrip_client")
+                self.net.link_callbacks.append(self.ntrip_client.link_up)
+                self.create_task(self.ntrip_client.run(), "ntrip_client")
+                self.create_task(self.ntrip_client_read(), "ntrip_client_read")
+                if (interval := getattr(cfg, "NTRIP_CLIENT_STATUS_INTERVAL", 0)):
+                    self.create_task(self.ntrip_client_status(interval), "ntrip_status")
+
+        if (interval := getattr(cfg, "STATS_INTERVAL", 0)):
+            self.create_task(self.stats_output(interval), "stats")
 
         # Wait for shutdown_event signal
         await self.shutdown_event.wait()
 
     async def shutdown(self):
         """Clean up background processes, handlers etc on exit."""
+        # Stop the GPS ingest thread
+        if self.gps and self.gps.ring is not None:
+            self.gps.stop_ingest()
+
         # Stop bluetooth irq handling
         if hasattr(self.blue, "ble"):
             self.blue.ble.irq(None)
@@ -346,6 +740,11 @@ class ESP32GPS():
 
         # Wait for tasks to exit
         await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Write out any recorded data still in RAM
+        if self.recorder:
+            self.recorder.close()
+        # Write out any log messages still queued
+        Logger.flush()
 
 if __name__ == "__main__":
     e32gps = ESP32GPS()
@@ -372,5 +771,5 @@ if __name__ == "__main__":
             if getattr(cfg, "CRASH_RESET", None):
                 log("Hard resetting due to crash...")
                 # Delay (to prevent restart tight loop, and give time to read the exception)
-                sleep_ms(5000)
+                time.sleep(5)
                 reset()
@@ -0,0 +1,144 @@
+"""Memory management for the data path: a pool of preallocated buffers, and scheduled garbage collection.
+
+`BufferPool` holds fixed-size bytearrays, allocated once at startup. Data which
+must outlive the GPS reader's buffer (e.g. RTCM frames queued for upload) is
+copied into a pooled `Buffer`, shared by reference count, and returned to the
+pool by `release`. If the pool is empty (or the data too large), a one-off
+buffer is allocated instead, and counted as a miss.
+
+`GCScheduler` runs `gc.collect()` in the quiet time between GPS epochs (once
+no data has been read for `idle_ms`), when enough has been allocated since the
+last collection - rather than letting a collection happen mid-epoch when an
+allocation fails.
+"""
+import gc
+from compat import mem_alloc, mem_free, sleep_ms, ticks_diff, ticks_ms, ticks_us
+from metrics import registry
+
+# GC pause histogram bounds (us)
+PAUSE_BOUNDS = (100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+# Releases of buffers with no references left (should always be 0)
+over_released = registry.counter("pool.over_released")
+
+
+class Buffer():
+    """A buffer from a pool. `data` is a memoryview of the valid data."""
+
+    def __init__(self, size, pool=None):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.data = self.mv[:0]
+        self.pool = pool
+        self.refs = 0
+        # Ingest time (ticks_us) of the data, if its latency is traced
+        self.stamp = None
+
+    def release(self):
+        """Drop one reference - the buffer returns to its pool when the last is released."""
+        if self.refs <= 0:
+            # Released more times than it was referenced - a bug in the caller. Counted (see
+            # STATS pool), and not returned to the pool again, which would let two frames share it.
+            over_released.inc()
+            return
+        self.refs -= 1
+        if not self.refs and self.pool:
+            self.pool.free.append(self)
+
+
+class BufferPool():
+
+    def __init__(self, count=16, size=512):
+        self.size = size
+        self.free = [Buffer(size, self) for _ in range(count)]
+        self.count = count
+        self.low = count
+        self.acquired = 0
+        self.misses = 0
+        registry.gauge("pool.in_use", lambda: self.count - len(self.free))
+        registry.gauge("pool.misses", lambda: self.misses)
+
+    def copy(self, data, refs=1):
+        """Return a Buffer holding a copy of data, with refs references."""
+        nbytes = len(data)
+        if self.free and nbytes <= self.size:
+            buf = self.free.pop()
+            self.acquired += 1
+            self.low = min(self.low, len(self.free))
+        else:
+            # One-off buffer (not returned to the pool)
+            buf = Buffer(nbytes)
+            self.misses += 1
+        buf.buf[:nbytes] = data
+        buf.data = buf.mv[:nbytes]
+        buf.refs = refs
+        return buf
+
+    def status(self):
+        return (
+            f"Buffer pool: {self.count - len(self.free)}/{self.count} x {self.size} bytes in use "
+            f"(max {self.count - self.low}), {self.acquired} acquired, {self.misses} misses, "
+            f"{over_released.value} over-released"
+        )
+
+
+class GCScheduler():
+
+    def __init__(self, idle_ms=20, min_alloc=8192, max_interval_ms=5000, threshold=None):
+        self.name = "GC"
+        # Time (ms) without GPS data, after which it's safe to collect
+        self.idle_ms = idle_ms
+        # Bytes allocated since the last collection before collecting again
+        self.min_alloc = min_alloc
+        # Collect at least this often (ms), even if little has been allocated
+        self.max_interval_ms = max_interval_ms
+        if threshold and hasattr(gc, "threshold"):
+            # Backstop - collect automatically after this many bytes allocated
+            gc.threshold(threshold)
+        self.last_activity = ticks_ms()
+        self.last_collect = ticks_ms()
+        self.alloc_after = mem_alloc()
+        # Allocation rate (bytes/s), smoothed
+        self.alloc_rate = 0
+        self.freed = 0
+        self.pause = registry.histogram("gc.pause_us", PAUSE_BOUNDS)
+        self.collections = registry.counter("gc.collections")
+        registry.gauge("gc.alloc_rate", lambda: self.alloc_rate)
+
+    def activity(self):
+        """Note that data is being processed (called by the GPS reader)."""
+        self.last_activity = ticks_ms()
+
+    def collect(self, now):
+        before = mem_alloc()
+        elapsed = ticks_diff(now, self.last_collect)
+        if elapsed > 0:
+            rate = (before - self.alloc_after) * 1000 // elapsed
+            self.alloc_rate += (rate - self.alloc_rate) // 4
+        start = ticks_us()
+        gc.collect()
+        self.pause.observe(ticks_diff(ticks_us(), start))
+        self.alloc_after = mem_alloc()
+        self.freed += max(0, before - self.alloc_after)
+        self.collections.inc()
+        self.last_collect = now
+
+    async def run(self):
+        poll_ms = max(5, self.idle_ms // 2)
+        while True:
+            await sleep_ms(poll_ms)
+            now = ticks_ms()
+            since = ticks_diff(now, self.last_collect)
+            if ticks_diff(now, self.last_activity) < self.idle_ms and since < self.max_interval_ms * 2:
+                # Mid-epoch (unless data never stops - then collect anyway, occasionally)
+                continue
+            if mem_alloc() - self.alloc_after >= self.min_alloc or since >= self.max_interval_ms:
+                self.collect(now)
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        pause = self.pause
+        return (
+            f"Heap: {mem_free()} bytes free, {mem_alloc()} allocated, allocation rate {self.alloc_rate} B/s\n"
+            f"GC: {pause.count} scheduled collections, {self.freed} bytes freed, "
+            f"pause p50={pause.percentile(50)}us p90={pause.percentile(90)}us max={pause.max}us"
+        )
@@ -0,0 +1,186 @@
+"""Runtime metrics: counters, gauges, histograms and tallies, in a registry with fixed memory.
+
+Subsystems create (or look up) their metrics once, then update them with
+cheap in-place operations. Gauges can instead read a value from an existing
+attribute via a function, which is only called when reporting. The registry
+holds at most `max_metrics` metrics - any more still work, but aren't reported.
+"""
+from array import array
+
+# Default histogram bucket upper bounds (e.g. milliseconds)
+BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Counter():
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def report(self):
+        return str(self.value)
+
+
+class Gauge():
+    """A value set by its owner, or read from fn when reported."""
+
+    def __init__(self, name, fn=None):
+        self.name = name
+        self.fn = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        return self.fn() if self.fn else self.value
+
+    def report(self):
+        return str(self.read())
+
+
+class Histogram():
+    """Count of observations in fixed buckets, with total count, sum and max."""
+
+    def __init__(self, name, bounds=BOUNDS):
+        self.name = name
+        self.bounds = array("I", bounds)
+        # Last bucket counts values above the largest bound
+        self.counts = array("I", [0] * (len(bounds) + 1))
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        i = 0
+        bounds = self.bounds
+        while i < len(bounds) and value > bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the pct percentile (or the max, if above all bounds)."""
+        if not self.count:
+            return 0
+        target = self.count * pct // 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen > target:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = self.sum = self.max = 0
+
+    def report(self):
+        """count/p50/p90/max"""
+        return f"{self.count}/{self.percentile(50)}/{self.percentile(90)}/{self.max}"
+
+
+class Tally():
+    """Counts by key (e.g. sentence type), for up to max_keys keys - any others are counted together as 'other'."""
+
+    def __init__(self, name, max_keys=24):
+        self.name = name
+        self.max_keys = max_keys
+        self.counts = {}
+        self.other = 0
+
+    def inc(self, key, n=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+        elif len(counts) < self.max_keys:
+            counts[key] = n
+        else:
+            self.other += n
+
+    def items(self):
+        """Return (key, count) in key order, with any other keys as 'other'."""
+        items = sorted((k.decode() if isinstance(k, bytes) else str(k), v) for k, v in self.counts.items())
+        if self.other:
+            items.append(("other", self.other))
+        return items
+
+    def report(self):
+        return " ".join(f"{k}:{v}" for k, v in self.items())
+
+
+class Registry():
+
+    def __init__(self, max_metrics=64):
+        self.max_metrics = max_metrics
+        # { name: metric }
+        self.metrics = {}
+        # Metrics created after the registry was full
+        self.rejected = 0
+
+    def add(self, cls, name, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = cls(name, *args)
+            if len(self.metrics) < self.max_metrics:
+                self.metrics[name] = metric
+            else:
+                self.rejected += 1
+        return metric
+
+    def counter(self, name):
+        return self.add(Counter, name)
+
+    def gauge(self, name, fn=None):
+        gauge = self.add(Gauge, name)
+        if fn:
+            # Re-registering (e.g. a recreated object) replaces the function
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, bounds=BOUNDS):
+        return self.add(Histogram, name, bounds)
+
+    def tally(self, name, max_keys=24):
+        return self.add(Tally, name, max_keys)
+
+    def items(self, prefix=""):
+        """Return (name, value) for each metric (with names starting with prefix), in name order."""
+        items = []
+        for name in sorted(self.metrics):
+            if name.startswith(prefix):
+                try:
+                    items.append((name, self.metrics[name].report()))
+                except Exception as e:
+                    # A gauge's owner may be in a bad state - report, rather than fail
+                    items.append((name, repr(e)))
+        return items
+
+    def fields(self):
+        """Return name=value fields for all metrics (one per key for tallies), e.g. for $PSTAT sentences."""
+        fields = []
+        for name, value in self.items():
+            metric = self.metrics[name]
+            if isinstance(metric, Tally):
+                fields.extend(f"{name}.{k}={v}" for k, v in metric.items())
+            else:
+                fields.append(f"{name}={value}")
+        return fields
+
+    def report(self, prefix=""):
+        """Return a report of all metrics (for the remote shell)."""
+        lines = [f"{name}: {value}" for name, value in self.items(prefix)]
+        if self.rejected:
+            lines.append(f"({self.rejected} metrics not registered - registry full)")
+        return "\n".join(lines) or "No metrics."
+
+
+# Shared by all subsystems
+registry = Registry()
@@ -0,0 +1,132 @@
+"""Event loop lag monitor, attributing stalls to the task which was running.
+
+The monitor task sleeps for `interval_ms` at a time, and measures (with
+`ticks_us`) how late it wakes up - the scheduling lag every other task sees.
+
+Tasks created with `Monitor.create_task` are wrapped in a `Tagged` coroutine,
+which times each step (from resume to the next await) of the task. A step
+which doesn't yield for a long time is a blocking call, so when a stall is
+seen the longest step since the last wake up identifies the culprit.
+"""
+import asyncio
+from compat import sleep_ms, ticks_diff, ticks_ms, ticks_us
+from devices import LOG_WARNING, Logger
+from metrics import registry
+
+log = Logger.getLogger().log
+
+# Number of recent stalls kept for reporting
+RECENT = 8
+
+
+class Tagged():
+    """Coroutine wrapper which times each step of the wrapped coroutine."""
+
+    def __init__(self, monitor, tag, coro):
+        self.monitor = monitor
+        self.tag = tag
+        self.coro = coro
+
+    def send(self, value):
+        start = ticks_us()
+        try:
+            return self.coro.send(value)
+        finally:
+            self.monitor.step(self.tag, ticks_diff(ticks_us(), start))
+
+    def throw(self, *args):
+        start = ticks_us()
+        try:
+            return self.coro.throw(*args)
+        finally:
+            self.monitor.step(self.tag, ticks_diff(ticks_us(), start))
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+
+class Monitor():
+
+    def __init__(self, interval_ms=100, stall_ms=50):
+        self.name = "Loop"
+        self.interval_ms = interval_ms
+        # Lag (ms) counted as a stall
+        self.stall_ms = stall_ms
+        self.lag = registry.histogram("loop.lag_ms")
+        self.stalls = registry.counter("loop.stalls")
+        # { tag: [steps, total us, max us, long steps] }
+        self.tasks = {}
+        # Longest step since the monitor last woke
+        self.window_tag = None
+        self.window_us = 0
+        # Recent stalls: (ticks_ms, lag ms, tag, step ms)
+        self.recent = []
+        self.last_log = None
+
+    def create_task(self, coro, tag):
+        """Create a task whose steps are timed, and attributed to tag."""
+        self.tasks.setdefault(tag, [0, 0, 0, 0])
+        return asyncio.create_task(Tagged(self, tag, coro))
+
+    def step(self, tag, elapsed_us):
+        stats = self.tasks[tag]
+        stats[0] += 1
+        stats[1] += elapsed_us
+        if elapsed_us > stats[2]:
+            stats[2] = elapsed_us
+        if elapsed_us > self.stall_ms * 1000:
+            stats[3] += 1
+        if elapsed_us > self.window_us:
+            self.window_us = elapsed_us
+            self.window_tag = tag
+
+    async def run(self):
+        interval_us = self.interval_ms * 1000
+        while True:
+            self.window_tag = None
+            self.window_us = 0
+            start = ticks_us()
+            await sleep_ms(self.interval_ms)
+            lag_ms = max(0, ticks_diff(ticks_us(), start) - interval_us) // 1000
+            self.lag.observe(lag_ms)
+            if lag_ms >= self.stall_ms:
+                self.stalled(lag_ms)
+
+    def stalled(self, lag_ms):
+        self.stalls.inc()
+        # A step which took most of the lag is the cause - otherwise an untagged task, IRQ or GC
+        if self.window_us // 1000 >= lag_ms // 2:
+            tag, step_ms = self.window_tag, self.window_us // 1000
+        else:
+            tag, step_ms = "untagged", None
+        self.recent.append((ticks_ms(), lag_ms, tag, step_ms))
+        if len(self.recent) > RECENT:
+            self.recent.pop(0)
+        now = ticks_ms()
+        # Rate limit logging, as the log is no help if it causes stalls too
+        if self.last_log is None or ticks_diff(now, self.last_log) > 10000:
+            self.last_log = now
+            log("[%s] Event loop stalled for %dms (%s)", self.name, lag_ms, tag, level=LOG_WARNING)
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        lag = self.lag
+        lines = [
+            f"Loop lag: p50={lag.percentile(50)}ms p90={lag.percentile(90)}ms p99={lag.percentile(99)}ms "
+            f"max={lag.max}ms, {self.stalls.value} stalls (>={self.stall_ms}ms) in {lag.count} samples"
+        ]
+        for tag in sorted(self.tasks):
+            steps, total, longest, slow = self.tasks[tag]
+            lines.append(f"  {tag}: {steps} steps, avg {total // steps if steps else 0}us, max {longest // 1000}ms, {slow} long")
+        for at, lag_ms, tag, step_ms in self.recent:
+            lines.append(f"  stall at {at}: {lag_ms}ms, {tag}" + (f" ({step_ms}ms step)" if step_ms is not None else ""))
+        return "\n".join(lines)
@@ -1,9 +1,13 @@
 import asyncio
 import aioespnow
+import json
 import network
-import sys
 import time
-from devices import Logger
+from binascii import hexlify, unhexlify
+from compat import print_exception, sleep_ms, ticks_diff, ticks_ms, wait_for_ms
+from devices import LOG_WARNING, Logger
+from metrics import registry
+from resolver import resolver
 try:
     from debug import DEBUG
 except ImportError:
@@ -11,14 +15,47 @@ except ImportError:
 
 log = Logger.getLogger().log
 
+# File used to persist the last AP BSSID for fast reassociation
+WIFI_CACHE_FILE = "wifi_cache.json"
+
 class Net():
 
     def __init__(self, txpower=None):
-        self._buffer = b""
+        # ESP-Now has a 250 byte max message size - data is collected into full messages
+        # FIXME: Ideally we can switch to 1024 if this PR is accepted:
+        # https://github.com/micropython/micropython/pull/16737
+        self._buffer = bytearray(250)
+        self._buffered = 0
+        # Total bytes copied into the buffer, and latency tracing of sent data (see latency.Probe)
+        self._copied = 0
+        self.espnow_probe = None
         self.espnow = None
         self.espnow_peers = []
         self.wifi_connected = False
         self.espnow_connected = False
+        self.ssid = None
+        self.key = None
+        # Cached AP details: {"ssid": str, "bssid": hex str}
+        self.ap_cache = {}
+        # Whether the current connection attempt uses the cached BSSID
+        self.cached_connect = False
+        # Set when connected without the cache, to cache the AP (see wifi_supervisor)
+        self.refresh_cache = False
+        # Called (with no args) when the wifi link is (re)established
+        self.link_callbacks = []
+        # Link statistics
+        self.connect_started = None
+        self.down_since = None
+        self.downtime_ms = 0
+        self.reconnects = 0
+        self.last_connect_ms = None
+        self.max_connect_ms = 0
+        self.espnow_tx_bytes = registry.counter("espnow.tx_bytes")
+        self.espnow_tx_errors = registry.counter("espnow.tx_errors")
+        self.espnow_rx_bytes = registry.counter("espnow.rx_bytes")
+        self.espnow_rx_dropped = registry.counter("espnow.rx_dropped")
+        registry.gauge("wifi.connected", lambda: int(self.wifi_connected))
+        registry.gauge("wifi.reconnects", lambda: self.reconnects)
         # Get a handle to wifi interfaces
         self.wlan = network.WLAN(network.WLAN.IF_STA)
         self.wlan.active(True)
@@ -28,12 +65,13 @@ class Net():
         # Chek if wifi has been set up already (e.g. in boot.py)
         if self.wlan.isconnected():
             self.wifi_connected = True
+            resolver.dns_server = self.wlan.ifconfig()[3]
 
 
     def enable_espnow(self, peers=""):
         # Disable power management
         self.wlan.config(pm=network.WLAN.PM_NONE)
-        log(f"ESP-Now MAC address: {self.wlan.config('mac')}")
+        log("ESP-Now MAC address: %s", self.wlan.config('mac'))
         self.espnow_peers = peers
         self.esp = aioespnow.AIOESPNow()
         self.esp.active(False)
@@ -46,24 +84,136 @@ class Net():
             mac.encode("utf-8") if isinstance(mac, str) else mac
             self.esp.add_peer(mac)
         self.espnow_connected = True
-        log(f"ESP-Now active. Peers: {self.espnow_peers}")
+        log("ESP-Now active. Peers: %s", self.espnow_peers)
 
     def enable_wifi(self, ssid, key):
-        """Connect to wifi if not already connected."""
-        if self.wifi_connected == False or ssid != self.wlan.config('ssid'):
-            self.wlan.disconnect()
-            self.wlan.connect(ssid, key)
-            log("Wifi connecting...(allowing up to 20 seconds to complete)")
-            for i in range(20):
-                time.sleep(1)
-                if self.wlan.isconnected():
-                    self.wifi_connected = True
-                    break
-            if not self.wlan.isconnected():
-                log("WLAN Connection failed.")
-
-        if self.wifi_connected:
-            log(f"WLAN connected, SSID: {self.wlan.config('ssid')}, IP: {self.wlan.ifconfig()[0]}, mac: {self.wlan.config('mac')}, channel: {self.wlan.config("channel")}")
+        """Start connecting to wifi (if not already connected) - see wifi_supervisor."""
+        self.ssid = ssid
+        self.key = key
+        if self.wifi_connected and ssid == self.wlan.config('ssid'):
+            self.link_up()
+            return
+        self.wifi_connected = False
+        self.load_ap_cache()
+        # Without a cached AP, this is a normal connection - the AP is cached once connected
+        self.start_connect()
+
+    def load_ap_cache(self):
+        try:
+            with open(WIFI_CACHE_FILE) as f:
+                self.ap_cache = json.load(f)
+        except (OSError, ValueError):
+            self.ap_cache = {}
+
+    def save_ap_cache(self):
+        try:
+            with open(WIFI_CACHE_FILE, "w") as f:
+                json.dump(self.ap_cache, f)
+        except OSError as e:
+            log("Unable to save wifi cache: %s", e, level=LOG_WARNING)
+
+    def scan_ap(self):
+        """Find the strongest AP for the SSID, and cache its BSSID (blocks while scanning)."""
+        try:
+            aps = [ap for ap in self.wlan.scan() if ap[0].decode() == self.ssid]
+        except OSError:
+            aps = []
+        if aps:
+            # Strongest signal first
+            aps.sort(key=lambda ap: -ap[3])
+            self.cache_ap(aps[0][1])
+
+    def cache_ap(self, bssid):
+        self.ap_cache = {"ssid": self.ssid, "bssid": hexlify(bssid).decode()}
+        self.save_ap_cache()
+
+    def drop_ap_cache(self):
+        """Forget the cached AP (e.g. it has been replaced), so later connects don't wait for it."""
+        if self.ap_cache:
+            self.ap_cache = {}
+            self.save_ap_cache()
+
+    def start_connect(self, use_cache=True):
+        """Begin (non-blocking) connection, using the cached BSSID for fast reassociation."""
+        self.connect_started = ticks_ms()
+        self.wlan.disconnect()
+        self.cached_connect = use_cache and self.ap_cache.get("ssid") == self.ssid
+        if self.cached_connect:
+            log("Wifi connecting to %s (BSSID: %s)...", self.ssid, self.ap_cache['bssid'])
+            self.wlan.connect(self.ssid, self.key, bssid=unhexlify(self.ap_cache["bssid"]))
+        else:
+            log("Wifi connecting to %s...", self.ssid)
+            self.wlan.connect(self.ssid, self.key)
+
+    def link_up(self):
+        """Handle wifi link (re)established."""
+        self.wifi_connected = True
+        now = ticks_ms()
+        if self.connect_started is not None:
+            self.last_connect_ms = ticks_diff(now, self.connect_started)
+            self.max_connect_ms = max(self.max_connect_ms, self.last_connect_ms)
+            self.connect_started = None
+        if self.down_since is not None:
+            self.downtime_ms += ticks_diff(now, self.down_since)
+            self.down_since = None
+            self.reconnects += 1
+        # Use the network's DNS server for non-blocking lookups
+        resolver.dns_server = self.wlan.ifconfig()[3]
+        if not self.cached_connect and self.ap_cache.get("ssid") != self.ssid:
+            # Cache the AP connected to, for fast reassociation (a stale AP was dropped on timeout)
+            try:
+                self.cache_ap(self.wlan.config('bssid'))
+            except (ValueError, OSError):
+                # BSSID not available from this port - find it with a scan, in the background
+                self.refresh_cache = True
+        log("WLAN connected, SSID: %s, IP: %s, mac: %s, channel: %s, took: %sms", self.wlan.config('ssid'), self.wlan.ifconfig()[0], self.wlan.config('mac'), self.wlan.config('channel'), self.last_connect_ms)
+        for callback in self.link_callbacks:
+            callback()
+
+    async def wifi_supervisor(self):
+        """Monitor the wifi link in the background, reconnecting when it drops."""
+        # Time (ms) to wait for a connection before retrying (without the cached BSSID)
+        connect_timeout = 10000
+        while True:
+            connected = self.wlan.isconnected()
+            if connected and not self.wifi_connected:
+                self.link_up()
+            elif connected and self.refresh_cache:
+                # Once per new AP (not at every boot) - the scan blocks for a second or two
+                self.refresh_cache = False
+                self.scan_ap()
+            elif not connected and self.wifi_connected:
+                log("WLAN connection lost. Reconnecting...")
+                self.wifi_connected = False
+                self.down_since = ticks_ms()
+                self.start_connect()
+            elif not connected and self.ssid:
+                if self.connect_started is None:
+                    self.start_connect()
+                elif ticks_diff(ticks_ms(), self.connect_started) > connect_timeout:
+                    log("WLAN connection timed out. Retrying...")
+                    if self.cached_connect:
+                        # AP may have changed - forget it, and retry without the cached BSSID
+                        self.drop_ap_cache()
+                    self.start_connect(use_cache=False)
+            # Poll quickly while disconnected
+            await sleep_ms(250 if not connected else 1000)
+
+    async def wait_connected(self, timeout_ms):
+        """Wait (up to timeout_ms) for the wifi link to come up."""
+        start = ticks_ms()
+        while not self.wifi_connected and ticks_diff(ticks_ms(), start) < timeout_ms:
+            await sleep_ms(100)
+        return self.wifi_connected
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        state = "connected" if self.wifi_connected else "disconnected"
+        return (
+            f"Wifi: {state}, SSID: {self.ssid}, cached AP: {self.ap_cache}\n"
+            f"Reconnects: {self.reconnects}, downtime: {self.downtime_ms}ms, "
+            f"connect time: {self.last_connect_ms}ms last, {self.max_connect_ms}ms max"
+        )
 
     async def espnow_broadcast(self):
         """Regularly announce presence to other peers via broadcast."""
@@ -91,48 +241,55 @@ class Net():
         except OSError:
             pass
 
-    async def espnow_sendall(self, msg):
-        """Send to all peers. Split into max 250 byte chunks."""
-        # ESP-Now has a 250 byte max message size
-        # FIXME: Ideally we can switch to 1024 if this PR is accepted:
-        # https://github.com/micropython/micropython/pull/16737
-        chunk_size = 250
-
-        data = self._buffer + msg
-
-        # Push short messages to buffer
-        if len(data) < chunk_size:
-            self._buffer = data
-            return
-        i = 0
-        while i + chunk_size < len(data):
-            try:
-                chunk = data[i:i+chunk_size]
-                await self.esp.asend(chunk)
-            except OSError as e:
-                pass
-            i += chunk_size
+    async def espnow_sendall(self, msg, stamp=None):
+        """Send to all peers, in full (250 byte) messages.
 
-        # Push leftover bytes to buffer
-        if i < len(data):
-            self._buffer = data[i:]
+        Data is copied into a preallocated buffer, which is sent each time it fills.
+        If stamp (ingest time) is set, the latency until msg is sent is traced.
+        """
+        buf = self._buffer
+        size = len(buf)
+        probe = self.espnow_probe
+        if stamp is not None and probe:
+            probe.queued(self._copied + len(msg), stamp)
+        msg = memoryview(msg)
+        pos = 0
+        while pos < len(msg):
+            count = min(len(msg) - pos, size - self._buffered)
+            buf[self._buffered:self._buffered + count] = msg[pos:pos + count]
+            self._buffered += count
+            self._copied += count
+            pos += count
+            if self._buffered == size:
+                try:
+                    await self.esp.asend(buf)
+                    self.espnow_tx_bytes.inc(size)
+                    if probe:
+                        probe.sent(self._copied)
+                except OSError as e:
+                    self.espnow_tx_errors.inc()
+                    if probe:
+                        probe.dropped(self._copied)
+                self._buffered = 0
 
     async def espnow_recv(self, timeout=200, discover_peers=False):
         """Wrapper around read to handle errors."""
         try:
             # A sub-1Hz timeout is sensible for most GPS devices
-            data = await asyncio.wait_for_ms(self.esp.airecv(), timeout)
+            data = await wait_for_ms(self.esp.airecv(), timeout)
             if data:
                 # Check if data is from a known peer
                 if data[0] not in self.espnow_peers:
                     # If the message is a 'discovery broadcast' add to peers list
                     if discover_peers and data[0] != self.wlan.config('mac') and data[1] == b"ESP32-GPS":
-                        log(f"ESP-Now discovered peer: {data[0]}")
+                        log("ESP-Now discovered peer: %s", data[0])
                         self.espnow_peers.append(data[0])
                         self.esp.add_peer(data[0])
                     else:
                         # Drop message
+                        self.espnow_rx_dropped.inc()
                         return
+                self.espnow_rx_bytes.inc(len(data[1]))
                 return data[1]
         except asyncio.TimeoutError:
             return None
@@ -141,11 +298,10 @@ class Net():
             self.esp.active(False)
             self.esp.active(True)
         except Exception as e:
-            sys.print_exception(e)
+            print_exception(e)
 
 
-    @staticmethod
-    def reset():
+    def reset(self):
         """Reset network interfaces."""
         self.wlan.active(False)
         time.sleep(0.5)
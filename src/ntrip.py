@@ -1,11 +1,17 @@
 """Provide simple NTRIP Client, Server and Caster functionality."""
 
 import asyncio
-import gc
-import sys
-import time
+from array import array
 from collections import deque
-from devices import Logger
+from math import cos, radians, sqrt
+from random import random
+from compat import print_exception, sleep_ms, ticks_diff, ticks_ms, ticks_us
+from devices import LOG_WARNING, Logger, nmea_checksum
+from latency import observe
+from memory import BufferPool
+from metrics import registry
+from resolver import resolver
+from rtcm import PREAMBLE, STATIC_TYPES, Framer, is_msm, iter_frames, msg_type, msm_epoch
 try:
     from debug import DEBUG
 except ImportError:
@@ -50,85 +56,601 @@ class Base():
         # (in usual operation, queue never grows to more than 2 with clients reading from caster)
         self.queue = deque([], 10)
         self.event = asyncio.Event()
+        # Reconnect backoff (seconds) - doubles on each failed attempt, with jitter
+        self.backoff_min = 1
+        self.backoff_max = 60
+        self.attempts = 0
+        self.errors = 0
+        # Set when the network link comes back up, to cut short any backoff
+        self.link_event = asyncio.Event()
 
-    def build_headers(self, method, mount=None):
-        mount = mount or self.mount
+    def link_up(self):
+        """Network link (re)established - reset backoff and retry immediately."""
+        self.attempts = 0
+        self.link_event.set()
+
+    def build_headers(self, method, mount=None, credb64=None):
+        mount = self.mount if mount is None else mount
+        credb64 = credb64 or self.credb64
         return (
             f"{method} /{mount} HTTP/1.1\r\n"
             "Ntrip-Version: Ntrip/2.0\r\n"
             f"User-Agent: {self.useragent}\r\n"
-            f"Authorization: Basic {self.credb64}\r\n"
+            f"Authorization: Basic {credb64}\r\n"
             "Connection: keep-alive\r\n"
             "\r\n"
         ).encode()
 
+    async def open_caster(self, host, port, request_headers):
+        """Make a single connection attempt, returning (reader, writer, connect time in ms)."""
+        start = ticks_ms()
+        addr = await resolver.resolve(host, port)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(addr, port), 10)
+        try:
+            writer.write(request_headers)
+            await writer.drain()
+            headers = await asyncio.wait_for(reader.read(1024), 10)
+            headers = headers.split(b"\r\n")
+            for line in headers:
+                if line.endswith(b"200 OK"):
+                    break
+            else:
+                # Not valid login
+                raise ValueError(headers)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+            raise
+        return reader, writer, ticks_diff(ticks_ms(), start)
+
+    async def backoff(self):
+        """Wait before reconnecting - exponential backoff with jitter."""
+        delay = min(self.backoff_max, self.backoff_min * (1 << min(self.attempts, 16)))
+        self.attempts += 1
+        self.link_event.clear()
+        try:
+            await asyncio.wait_for(self.link_event.wait(), delay * (0.5 + random() / 2))
+        except asyncio.TimeoutError:
+            pass
+
     async def caster_connect(self):
         while True:
             try:
-                log(f"[{self.name}] Connecting to {self.host}:{self.port}...")
-                self.reader, self.writer = await asyncio.wait_for(
-                    asyncio.open_connection(self.host, self.port),
-                    10
-                )
-                self.writer.write(self.request_headers)
-                await self.writer.drain()
-                headers = await self.reader.read(1024)
-                headers = headers.split(b"\r\n")
-                for line in headers:
-                    if line.endswith(b"200 OK"):
-                        break
-                else:
-                    # Not valid login
-                    raise ValueError(headers)
+                log("[%s] Connecting to %s:%s...", self.name, self.host, self.port)
+                self.reader, self.writer, _ = await self.open_caster(self.host, self.port, self.request_headers)
+                self.attempts = 0
                 break
             except (OSError, ValueError, asyncio.TimeoutError) as err:
-                log(f"[{self.name}] Connection error: {err}")
-                try:
-                    self.writer.close()
-                    await self.writer.wait_closed()
-                except (AttributeError, OSError):
-                    pass
-                # Wait before trying to reconnect
-                await asyncio.sleep(3)
+                log("[%s] Connection error: %s", self.name, err, level=LOG_WARNING)
+                self.writer = None
+                self.errors += 1
+                await self.backoff()
+
+
+class Candidate():
+    """A caster/mount the Client can connect to, scored on connect time and correction age."""
+
+    # Score penalty (ms) per consecutive connection failure
+    FAILURE_PENALTY = 10000
+
+    def __init__(self, host, port=2101, mount="ESP32", credentials="c:c"):
+        self.host = host
+        self.port = port
+        self.mount = mount
+        self.credb64 = b64encode(credentials.encode('ascii')).decode().strip()
+        self.connect_ms = None
+        # Smoothed time between correction frames
+        self.age_ms = None
+        self.failures = 0
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}/{self.mount}"
+
+    def connected(self, connect_ms):
+        self.connect_ms = connect_ms if self.connect_ms is None else (self.connect_ms * 3 + connect_ms) // 4
+        self.failures = 0
+
+    def update_age(self, age_ms):
+        self.age_ms = age_ms if self.age_ms is None else (self.age_ms * 7 + age_ms) // 8
+
+    def score(self):
+        """Lower is better. Untested candidates rank behind working ones."""
+        return (self.connect_ms or 1000) + (self.age_ms or 1000) + self.failures * self.FAILURE_PENALTY
+
+async def readinto(reader, view):
+    """Read up to len(view) bytes from a stream into view (without allocating, where supported), returning bytes read."""
+    if hasattr(reader, "readinto"):
+        return await reader.readinto(view) or 0
+    # CPython streams have no readinto
+    data = await reader.read(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+async def read_into(reader, framer, size):
+    """Read up to size bytes from a stream directly into a Framer buffer, returning bytes read."""
+    nbytes = await readinto(reader, framer.writable(size))
+    framer.commit(nbytes)
+    return nbytes
+
+
+# Approximate length of 1 degree of latitude (km)
+KM_PER_DEGREE = 111.195
+
+
+def parse_gga(data):
+    """Find a GGA sentence in data, returning (sentence, lat, lon), or None if no fix."""
+    idx = data.find(b"GGA,")
+    if idx < 3 or data[idx - 3] != ord("$"):
+        return None
+    start = idx - 3
+    end = data.find(b"\r\n", start)
+    if end < 0:
+        return None
+    sentence = bytes(data[start:end + 2])
+    parts = sentence.split(b",", 7)
+    try:
+        if parts[6] in (b"", b"0"):
+            # No fix
+            return None
+        lat = int(parts[2][:2]) + float(parts[2][2:]) / 60
+        lon = int(parts[4][:3]) + float(parts[4][3:]) / 60
+    except (IndexError, ValueError):
+        return None
+    if parts[3] == b"S":
+        lat = -lat
+    if parts[5] == b"W":
+        lon = -lon
+    return sentence, lat, lon
+
+
+def distance_km(lat1, lon1, lat2, lon2, cos_lat=None):
+    """Equirectangular distance approximation - accurate enough for comparing nearby mounts."""
+    if cos_lat is None:
+        cos_lat = cos(radians(lat1))
+    dx = (lon2 - lon1) * cos_lat
+    dy = lat2 - lat1
+    return sqrt(dx * dx + dy * dy) * KM_PER_DEGREE
+
 
 class Client(Base):
 
+    # Limits for adaptive read size
+    MIN_READ = 64
+    MAX_READ = 1024
+
     def __init__(self, *args, **kwargs):
         """Defaults to centipede NTRIP service"""
         super().__init__(*args, **kwargs)
         self.name = "Client"
         self.request_headers = self.build_headers(method="GET")
+        self.framer = Framer()
+        self.read_size = 128
+        # GGA upload: False (never), True (always) or "auto" (if mount requires NMEA in sourcetable)
+        self.send_gga = False
+        self.gga_interval = 10
+        self.gga = None
+        self.position = None
+        # Nearest mount selection
+        self.nearest_mount = False
+        self.recheck_km = 10
+        self.checked_position = None
+        self.pending_mount = None
+        # Sourcetable cache: names packed into one bytearray, with offsets and coordinates in arrays
+        self.mount_names = bytearray()
+        self.mount_offsets = array("I", [0])
+        self.mount_coords = array("f")
+        self.mount_nmea = bytearray()
+        # Failover: candidates in order of preference, starting with the configured caster
+        self.candidates = [Candidate(self.host, self.port, self.mount)]
+        self.candidates[0].credb64 = self.credb64
+        self.active = self.candidates[0]
+        # Seconds without complete correction frames before failing over
+        self.stall_timeout = 10
+        # Smoothed correction age (ms) above which the stream is considered degraded
+        self.max_age_ms = 5000
+        # Switch to standby if its score is better than the active stream by this much (ms)
+        self.switch_margin_ms = 1000
+        self.last_frame = None
+        # Latency tracing (see latency.Tracer) - from reading corrections to writing them to the GPS
+        self.tracer = None
+        self.latency = None
+        # Correction age watchdog - age (ms) sampled once a second, for percentiles
+        self.stalled = False
+        self.age_samples = array("I", [0] * 120)
+        self.age_index = 0
+        self.age_count = 0
+        self.reconnects = 0
+        self.read_errors = 0
+        self.bytes_in = registry.counter("ntrip.client.bytes_in")
+        registry.gauge("ntrip.client.frames", lambda: self.framer.frames)
+        registry.gauge("ntrip.client.age_ms", self.correction_age)
+        registry.gauge("ntrip.client.reconnects", lambda: self.reconnects)
+        self.watchdog_task = None
+        # Optional warm standby connection to the next best candidate
+        self.standby_enabled = False
+        self.standby = None
+        self.standby_task = None
+
+    def add_candidate(self, host, port=2101, mount="ESP32", credentials="c:c"):
+        """Add a fallback caster/mount."""
+        self.candidates.append(Candidate(host, port, mount, credentials))
+
+    def activate(self, candidate):
+        """Make candidate the active caster/mount."""
+        self.active = candidate
+        self.host = candidate.host
+        self.port = candidate.port
+        self.mount = candidate.mount
+        self.credb64 = candidate.credb64
+        self.request_headers = self.build_headers(method="GET")
+
+    async def caster_connect(self):
+        """Connect to the best scoring candidate, backing off after each failed round."""
+        while True:
+            for candidate in sorted(self.candidates, key=Candidate.score):
+                if self.standby and candidate is self.standby[0]:
+                    # Already connected
+                    await self.promote_standby()
+                    return
+                self.activate(candidate)
+                try:
+                    log("[%s] Connecting to %s...", self.name, candidate)
+                    self.reader, self.writer, connect_ms = await self.open_caster(self.host, self.port, self.request_headers)
+                except (OSError, ValueError, asyncio.TimeoutError) as err:
+                    log("[%s] Connection error: %s", self.name, err, level=LOG_WARNING)
+                    self.reader = self.writer = None
+                    candidate.failures += 1
+                    continue
+                candidate.connected(connect_ms)
+                self.attempts = 0
+                self.last_frame = ticks_ms()
+                return
+            await self.backoff()
+
+    async def failover(self, reason):
+        """Abandon the active stream, switching to standby (if connected) or the next best candidate."""
+        log("[%s] %s: %s. Failing over...", self.name, self.active, reason)
+        self.active.failures += 1
+        self.reconnects += 1
+        if self.standby:
+            await self.promote_standby()
+        else:
+            await self.reconnect()
+
+    async def promote_standby(self):
+        """Make the standby connection the active stream."""
+        candidate, reader, writer = self.standby
+        self.standby = None
+        # Stop the standby reader before taking over its stream
+        self.standby_task.cancel()
+        try:
+            await self.standby_task
+        except asyncio.CancelledError:
+            pass
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (AttributeError, OSError):
+            pass
+        log("[%s] Switching to standby: %s", self.name, candidate)
+        self.activate(candidate)
+        self.reader, self.writer = reader, writer
+        self.framer.reset()
+        self.last_frame = ticks_ms()
+        self.standby_task = asyncio.create_task(self.standby_loop())
+
+    async def standby_loop(self):
+        """Keep a warm connection to the next best candidate, tracking its correction age."""
+        framer = Framer(1400, check_crc=False)
+        while True:
+            others = [c for c in sorted(self.candidates, key=Candidate.score) if c is not self.active]
+            if not others:
+                return
+            candidate = others[0]
+            try:
+                reader, writer, connect_ms = await self.open_caster(
+                    candidate.host, candidate.port,
+                    self.build_headers(method="GET", mount=candidate.mount, credb64=candidate.credb64)
+                )
+            except (OSError, ValueError, asyncio.TimeoutError) as err:
+                if DEBUG:
+                    log("[%s] Standby connection error: %s", self.name, err, level=LOG_WARNING)
+                candidate.failures += 1
+                await asyncio.sleep(self.backoff_max)
+                continue
+            candidate.connected(connect_ms)
+            conn = (candidate, reader, writer)
+            self.standby = conn
+            framer.reset()
+            last_frame = ticks_ms()
+            try:
+                while True:
+                    nbytes = await asyncio.wait_for(read_into(reader, framer, 256), self.stall_timeout)
+                    if not nbytes:
+                        raise OSError("Stream closed")
+                    if framer.pop_frames():
+                        now = ticks_ms()
+                        candidate.update_age(ticks_diff(now, last_frame))
+                        last_frame = now
+            except (OSError, asyncio.TimeoutError):
+                candidate.failures += 1
+            if self.standby is conn:
+                # Not promoted - close and try again
+                self.standby = None
+                try:
+                    writer.close()
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+                await asyncio.sleep(self.backoff_min)
+
+    async def check_active(self):
+        """Fail over if the active stream has degraded, or standby is scoring better."""
+        if self.active.age_ms and self.active.age_ms > self.max_age_ms and len(self.candidates) > 1:
+            await self.failover(f"correction age {self.active.age_ms}ms")
+        elif self.standby and self.standby[0].score() + self.switch_margin_ms < self.active.score():
+            await self.promote_standby()
+
+    async def fetch_sourcetable(self):
+        """Fetch and parse the caster sourcetable into compact arrays (once it has mount coordinates)."""
+        if self.mount_coords:
+            return
+        # Sourcetable is fetched from the primary caster
+        primary = self.candidates[0]
+        log("[%s] Fetching sourcetable from %s:%s...", self.name, primary.host, primary.port)
+        try:
+            addr = await resolver.resolve(primary.host, primary.port)
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(addr, primary.port), 10)
+        except (OSError, asyncio.TimeoutError) as e:
+            log("[%s] Sourcetable fetch error: %s", self.name, e, level=LOG_WARNING)
+            return
+        try:
+            writer.write(self.build_headers(method="GET", mount="", credb64=primary.credb64))
+            await writer.drain()
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if not line or line.startswith(b"ENDSOURCETABLE"):
+                    break
+                if line.startswith(b"STR;"):
+                    self.add_mount(line)
+        except (OSError, asyncio.TimeoutError) as e:
+            log("[%s] Sourcetable read error: %s", self.name, e, level=LOG_WARNING)
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+        log("[%s] Sourcetable: %s mounts", self.name, len(self.mount_nmea))
+
+    def add_mount(self, line):
+        """Add a STR sourcetable line to the mount cache."""
+        fields = line.split(b";", 12)
+        try:
+            lat = float(fields[9])
+            lon = float(fields[10])
+        except (IndexError, ValueError):
+            return
+        self.mount_names.extend(fields[1])
+        self.mount_offsets.append(len(self.mount_names))
+        self.mount_coords.append(lat)
+        self.mount_coords.append(lon)
+        self.mount_nmea.append(fields[11] == b"1")
+
+    def mount_name(self, idx):
+        return bytes(self.mount_names[self.mount_offsets[idx]:self.mount_offsets[idx + 1]]).decode()
+
+    def mount_index(self, mount):
+        mount = mount.encode()
+        for i in range(len(self.mount_nmea)):
+            if self.mount_names[self.mount_offsets[i]:self.mount_offsets[i + 1]] == mount:
+                return i
+        return None
+
+    def find_nearest(self, lat, lon):
+        """Return (index, distance_km) of the nearest mount in the cache."""
+        coords = self.mount_coords
+        cos_lat = cos(radians(lat))
+        best = None
+        best_dist = 0
+        for i in range(len(self.mount_nmea)):
+            dist = distance_km(lat, lon, coords[2 * i], coords[2 * i + 1], cos_lat)
+            if best is None or dist < best_dist:
+                best, best_dist = i, dist
+        return best, best_dist
+
+    def gga_required(self):
+        if self.send_gga != "auto":
+            return self.send_gga
+        idx = self.mount_index(self.mount)
+        return idx is not None and bool(self.mount_nmea[idx])
+
+    def update_position(self, data):
+        """Update position from GPS data containing a GGA sentence, and check for a nearer mount."""
+        gga = parse_gga(data)
+        if not gga:
+            return
+        self.gga, lat, lon = gga
+        self.position = (lat, lon)
+        if not self.nearest_mount or not self.mount_coords:
+            return
+        # Only re-check mounts after moving recheck_km from the last check
+        if self.checked_position and distance_km(*self.checked_position, lat, lon) < self.recheck_km:
+            return
+        self.checked_position = (lat, lon)
+        idx, dist = self.find_nearest(lat, lon)
+        if idx is None:
+            return
+        mount = self.mount_name(idx)
+        if mount != self.candidates[0].mount:
+            log("[%s] Nearest mount: %s (%.1f km)", self.name, mount, dist)
+            self.pending_mount = mount
+
+    async def reconnect(self):
+        """Close the current connection (if any) and connect again."""
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (AttributeError, OSError) as e:
+            if DEBUG:
+                print_exception(e)
+        self.framer.reset()
+        if (self.nearest_mount or self.send_gga == "auto") and not self.mount_coords:
+            # No usable sourcetable (fetch failed, or no mount coordinates) - retry once per reconnect
+            await self.fetch_sourcetable()
+            self.checked_position = None
+        await self.caster_connect()
+
+    async def send_gga_loop(self):
+        """Periodically send the latest GGA sentence to the caster (e.g. for VRS mounts)."""
+        while True:
+            await asyncio.sleep(self.gga_interval)
+            if self.gga and self.writer and self.gga_required():
+                try:
+                    self.writer.write(self.gga)
+                    await self.writer.drain()
+                except OSError as e:
+                    if DEBUG:
+                        print_exception(e)
+
+    async def read_into_framer(self):
+        """Read from the caster directly into the framer buffer, returning bytes read."""
+        nbytes = await read_into(self.reader, self.framer, self.read_size)
+        # Adapt read size to the incoming data rate
+        if nbytes >= self.read_size:
+            self.read_size = min(self.read_size * 2, self.MAX_READ)
+        elif nbytes < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, self.MIN_READ)
+        return nbytes
 
     async def iter_data(self):
-        """Read data from caster and yield as requested."""
+        """Read data from caster and yield whole RTCM frames.
+
+        Frames are yielded as a memoryview into the framer buffer, which is only
+        valid until the next iteration - it must be consumed (e.g. written to the
+        GPS UART) before requesting more data.
+        """
         while True:
+            if self.pending_mount:
+                # Switch the primary caster to a nearer mount
+                primary = self.candidates[0]
+                primary.mount, self.pending_mount = self.pending_mount, None
+                primary.age_ms = None
+                if self.active is primary:
+                    self.activate(primary)
+                    await self.reconnect()
             if self.reader:
                 try:
-                    data = await self.reader.read(128)
-                    if data:
-                        yield data
-                    else:
-                        # Stream closed
-                        log(f"[{self.name}] Connection error. Reconnecting...")
-                        try:
-                            self.writer.close()
-                            await self.writer.wait_closed()
-                        except OSError as e:
-                            if DEBUG:
-                                sys.print_exception(e)
-                            pass
-                        await asyncio.sleep(1)
-                        await self.caster_connect()
+                    nbytes = await self.read_into_framer()
                 except (OSError, asyncio.IncompleteReadError):
-                    # Would block / timeout
-                    await asyncio.sleep_ms(100)
-                    continue
+                    nbytes = None
+                    self.read_errors += 1
+                if self.stalled:
+                    # Watchdog closed the connection
+                    self.stalled = False
+                    await self.failover(f"no corrections for {self.correction_age()}ms")
+                elif nbytes is None:
+                    # Would block / timeout - the watchdog reconnects if this persists
+                    await sleep_ms(100)
+                elif not nbytes:
+                    # Stream closed
+                    await self.failover("stream closed")
+                else:
+                    self.bytes_in.inc(nbytes)
+                    stamp = self.tracer.stamp(ticks_us()) if self.tracer else None
+                    frames = self.framer.pop_frames()
+                    if frames:
+                        now = ticks_ms()
+                        self.active.update_age(ticks_diff(now, self.last_frame))
+                        self.last_frame = now
+                        yield frames
+                        if stamp is not None:
+                            # Frames have been consumed (written to the GPS)
+                            observe(self.latency, stamp)
+                        await self.check_active()
             else:
                 # Reader not ready yet...
                 await asyncio.sleep(1)
 
+    def link_up(self):
+        """Network link (re)established - reconnect now if corrections have stopped."""
+        super().link_up()
+        age = self.correction_age()
+        if self.writer and age is not None and age > 2000 and not self.stalled:
+            # The old connection is likely dead - don't wait for the watchdog to notice
+            log("[%s] Link up with correction age %sms - reconnecting.", self.name, age)
+            self.stalled = True
+            try:
+                self.writer.close()
+            except OSError:
+                pass
+
+    def correction_age(self):
+        """Time (ms) since the last complete RTCM frame arrived."""
+        if self.last_frame is None:
+            return None
+        return ticks_diff(ticks_ms(), self.last_frame)
+
+    def age_percentiles(self, pcts=(50, 90, 99)):
+        """Return correction age percentiles (ms) over the recent sample window."""
+        samples = sorted(self.age_samples[:self.age_count])
+        if not samples:
+            return [None] * len(pcts)
+        return [samples[min(len(samples) - 1, len(samples) * pct // 100)] for pct in pcts]
+
+    async def watchdog(self):
+        """Sample correction age, forcing a reconnect if no complete frames arrive for stall_timeout."""
+        while True:
+            await asyncio.sleep(1)
+            age = self.correction_age()
+            if not self.writer or age is None:
+                continue
+            self.age_samples[self.age_index] = age
+            self.age_index = (self.age_index + 1) % len(self.age_samples)
+            self.age_count = min(self.age_count + 1, len(self.age_samples))
+            if age > self.stall_timeout * 1000 and not self.stalled:
+                log("[%s] Correction age %sms - forcing reconnect.", self.name, age)
+                self.stalled = True
+                try:
+                    # Closing the connection wakes up the blocked read in iter_data
+                    self.writer.close()
+                except OSError:
+                    pass
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        p50, p90, p99 = self.age_percentiles()
+        return (
+            f"Active: {self.active} (standby: {self.standby[0] if self.standby else None})\n"
+            f"Correction age: {self.correction_age()}ms (p50={p50} p90={p90} p99={p99} max={max(self.age_samples[:self.age_count], default=None)})\n"
+            f"Frames: {self.framer.frames}, CRC errors: {self.framer.crc_errors}, read errors: {self.read_errors}, reconnects: {self.reconnects}\n"
+            "Candidates: " + ", ".join(f"{c} score={c.score()}" for c in self.candidates)
+        )
+
+    def status_nmea(self):
+        """Return a $PCORR proprietary NMEA status sentence: age, p50, p90, reconnects, mount."""
+        age = self.correction_age()
+        p50, p90 = self.age_percentiles((50, 90))
+        body = f"PCORR,{'' if age is None else age},{'' if p50 is None else p50},{'' if p90 is None else p90},{self.reconnects},{self.mount}"
+        return f"${body}*{nmea_checksum(body)}\r\n".encode()
+
     async def run(self):
+        self.watchdog_task = asyncio.create_task(self.watchdog())
+        if self.nearest_mount or self.send_gga == "auto":
+            await self.fetch_sourcetable()
+            if self.nearest_mount and self.position:
+                idx, _ = self.find_nearest(*self.position)
+                if idx is not None:
+                    self.candidates[0].mount = self.mount_name(idx)
+                    self.checked_position = self.position
         await self.caster_connect()
+        if self.standby_enabled and len(self.candidates) > 1:
+            self.standby_task = asyncio.create_task(self.standby_loop())
+        if self.send_gga:
+            await self.send_gga_loop()
 
 
 class Server(Base):
@@ -137,46 +659,215 @@ class Server(Base):
         super().__init__(*args, **kwargs)
         self.name = "Server"
         self.request_headers = self.build_headers(method="POST", mount=self.mount)
+        # Outbound RTCM frames (as pooled Buffers), bounded by max_pending_bytes (kept while reconnecting)
+        self.pending = []
+        self.pending_bytes = 0
+        self.max_pending_bytes = 8192
+        # Number (and bytes) of frames at the start of pending being written - never dropped
+        # by enqueue, and not counted towards max_pending_bytes
+        self.inflight = 0
+        self.inflight_bytes = 0
+        # Frames are coalesced into a single TCP write of up to one segment
+        self.out = bytearray(1460)
+        self.out_mv = memoryview(self.out)
+        # Time (ms) to wait for more frames before sending
+        self.coalesce_ms = 20
+        self.data_event = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.send_task = None
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.writes = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.started = None
+        # Histogram of latency from GPS ingest to sending traced frames (see latency.Tracer)
+        self.latency = None
 
-    async def send_data(self, data):
-        """Send data to the caster."""
-        if self.writer:
-            try:
-                self.writer.write(data)
-                await self.writer.drain()
-            except OSError:
-                log(f"[{self.name}] Data send error. Closing connection...")
+    def enqueue(self, frame):
+        """Add a frame (Buffer) to the outbound queue, dropping the oldest non-static frames if full.
+
+        Frames being written by send_loop are never dropped.
+        """
+        self.pending.append(frame)
+        self.pending_bytes += len(frame.data)
+        while self.pending_bytes - self.inflight_bytes > self.max_pending_bytes:
+            for i in range(self.inflight, len(self.pending)):
+                if msg_type(self.pending[i].data) not in STATIC_TYPES:
+                    break
+            else:
+                i = self.inflight
+            frame = self.pending.pop(i)
+            self.pending_bytes -= len(frame.data)
+            frame.release()
+            self.dropped += 1
+
+    def prune(self):
+        """Drop stale frames before replaying - keep the latest static messages and the latest epoch."""
+        latest_epoch = None
+        for frame in self.pending:
+            if is_msm(msg_type(frame.data)):
+                latest_epoch = msm_epoch(frame.data)
+        static = {}
+        epoch = []
+        for frame in self.pending:
+            mtype = msg_type(frame.data)
+            if mtype in STATIC_TYPES:
+                if mtype in static:
+                    static[mtype].release()
+                static[mtype] = frame
+            elif is_msm(mtype) and msm_epoch(frame.data) == latest_epoch:
+                epoch.append(frame)
+            else:
+                frame.release()
+        kept = list(static.values()) + epoch
+        self.dropped += len(self.pending) - len(kept)
+        self.pending = kept
+        self.pending_bytes = sum(len(frame.data) for frame in kept)
+
+    def close(self):
+        """Close the connection, and signal run to reconnect."""
+        try:
+            self.writer.close()
+        except (AttributeError, OSError):
+            pass
+        self.writer = None
+        self.disconnected.set()
+
+    async def send_loop(self):
+        """Send queued frames to the caster, coalescing them into as few writes as possible."""
+        while True:
+            await self.data_event.wait()
+            self.data_event.clear()
+            if self.coalesce_ms:
+                await sleep_ms(self.coalesce_ms)
+            while self.pending and self.writer:
+                size = 0
+                count = 0
+                for frame in self.pending:
+                    data = frame.data
+                    if size + len(data) > len(self.out):
+                        break
+                    self.out[size:size + len(data)] = data
+                    size += len(data)
+                    count += 1
+                # Frames stay queued while being written (so enqueue can't drop them while draining)
+                self.inflight = count
+                self.inflight_bytes = size
                 try:
-                    self.writer.close()
-                    await self.writer.wait_closed()
+                    self.writer.write(self.out_mv[:size])
+                    await self.writer.drain()
                 except OSError:
-                    # Ignore send failures
-                    pass
+                    log("[%s] Data send error. Closing connection...", self.name, level=LOG_WARNING)
+                    self.errors += 1
+                    self.close()
+                    break
                 finally:
-                    self.writer = None
+                    self.inflight = self.inflight_bytes = 0
+                # Only remove frames once sent, so they can be replayed after reconnecting
+                for frame in self.pending[:count]:
+                    if frame.stamp is not None and self.latency:
+                        observe(self.latency, frame.stamp)
+                    frame.release()
+                del self.pending[:count]
+                self.pending_bytes -= size
+                self.sent_frames += count
+                self.sent_bytes += size
+                self.writes += 1
+
+    def status(self):
+        """Return a one-line status report (for the remote shell)."""
+        elapsed = ticks_diff(ticks_ms(), self.started) if self.started else 0
+        rate = self.sent_bytes * 1000 // elapsed if elapsed else 0
+        return (
+            f"{self.name} {self.host}:{self.port}/{self.mount}: {'connected' if self.writer else 'disconnected'}, "
+            f"{rate} B/s, sent {self.sent_frames} frames ({self.sent_bytes} bytes, {self.writes} writes), "
+            f"queued {len(self.pending)}, dropped {self.dropped}, replayed {self.replayed}, errors {self.errors}"
+        )
 
     async def run(self):
+        self.started = ticks_ms()
+        self.send_task = asyncio.create_task(self.send_loop())
         while True:
+            self.disconnected.clear()
             await self.caster_connect()
-            while self.writer:
-                # Long sleep while connection established (equivalent to reconnect timeout)
-                await asyncio.sleep(3)
+            if self.pending:
+                self.prune()
+                log("[%s] Replaying %s buffered frames.", self.name, len(self.pending))
+                self.replayed += len(self.pending)
+                self.data_event.set()
+            # Reconnect when send_loop reports the connection closed
+            await self.disconnected.wait()
+
+
+class Uplink():
+    """Share each RTCM frame from the GPS between one or more Servers (upload targets).
+
+    Each Server has its own connection, send task and queue, so a slow or
+    unreachable caster doesn't delay the others.
+    """
+
+    def __init__(self, servers, pool=None):
+        self.servers = servers
+        # Frames are copied into pooled buffers (shared by all targets)
+        self.pool = pool or BufferPool(0)
+        # Optional per message type rate limiting (see shaper.Shaper)
+        self.shaper = None
+        # Optional MSM7 -> MSM4 conversion (see transcode.MSM4Transcoder)
+        self.transcoder = None
+        registry.gauge("ntrip.server.sent_bytes", lambda: sum(s.sent_bytes for s in self.servers))
+        registry.gauge("ntrip.server.queued_bytes", lambda: sum(s.pending_bytes for s in self.servers))
+        registry.gauge("ntrip.server.dropped", lambda: sum(s.dropped for s in self.servers))
+
+    async def send_data(self, frame, stamp=None):
+        """Queue a whole RTCM frame (as passed to gps_data) for all targets.
+
+        NMEA sentences are ignored. The frame carries stamp (its ingest time,
+        if traced) to the targets' queues.
+        """
+        if frame[0] != PREAMBLE:
+            return
+        if self.shaper and not self.shaper.allow(frame):
+            return
+        if self.transcoder:
+            frame = self.transcoder.convert(frame)
+        # One copy of each frame, referenced from every target's queue
+        frame = self.pool.copy(frame, len(self.servers))
+        frame.stamp = stamp
+        for server in self.servers:
+            server.enqueue(frame)
+            server.data_event.set()
+
+    def status(self):
+        status = [server.status() for server in self.servers]
+        if self.shaper:
+            status.append(self.shaper.status())
+        if self.transcoder:
+            status.append(self.transcoder.status())
+        return "\n".join(status)
 
 
 class Caster():
 
-    def __init__(self, bind_address="0.0.0.0", bind_port=2101, sourcetable="", cli_creds="c:c", srv_creds="c:c"):
+    def __init__(self, bind_address="0.0.0.0", bind_port=2101, sourcetable="", cli_creds="c:c", srv_creds="c:c", backlog=5):
         self.name = "Caster"
         self.bind_address = bind_address
         self.bind_port = bind_port
+        # Pending connection queue - raise when hosting many clients (e.g. on a Linux host)
+        self.backlog = backlog
         self.shutdown_event = asyncio.Event()
-        self.sourcetable = sourcetable.replace("\n", "\r\n").encode() or "STR;ESP32;ESP32_GPS;RTCM 3.3;;2;GPS;;GB;51.476;0.00;0;0;;none;B;;9600;\r\n"
+        self.sourcetable = sourcetable.replace("\n", "\r\n").encode() or b"STR;ESP32;ESP32_GPS;RTCM 3.3;;2;GPS;;GB;51.476;0.00;0;0;;none;B;;9600;\r\n"
         self.cli_credb64 =  b64encode(cli_creds.encode('ascii')).decode().strip()
         self.srv_credb64 =  b64encode(srv_creds.encode('ascii')).decode().strip()
-        # { MNT: { clients: {(r, w)}, servers: {(r, w)}}}
+        # { MNT: { clients: {(r, w)}, servers: {(r, w)}, msm4: {(r, w)}}}
         self.allowed_mounts = set()
         self.mounts = {}
         self.server_tasks = {}
+        # Optional MSM7 -> MSM4 conversion (see transcode.MSM4Transcoder) for clients of <MOUNT>_MSM4
+        self.transcoder = None
+        # Latency tracing (see latency.Tracer) - from reading server data to each client write
+        self.tracer = None
+        self.latency = None
 
     def get_allowed_mounts(self):
         """Populate allowed_mounts dict with all mountpoints in SOURCETABLE."""
@@ -232,15 +923,25 @@ class Caster():
     async def drop_connection(self, mount, writer, conn_type="client"):
         """Close stale connections and remove from the list."""
 
-        conn_dict = self.mounts[mount]["servers"] if conn_type == "server" else self.mounts[mount]["clients"]
+        if mount not in self.mounts:
+            # Mount already removed (e.g. server dropped) - just close the connection
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return
+        conns = self.mounts[mount]
 
         addr = writer.get_extra_info('peername')
         title = conn_type[0].upper() + conn_type[1:]
-        log(f"[{self.name}] {title} disconnected: {addr}")
-        try:
-            conn_dict.pop(writer)
-        except KeyError:
-            pass
+        log("[%s] %s disconnected: %s", self.name, title, addr)
+        if conn_type == "server":
+            conns["servers"].pop(writer, None)
+        else:
+            # Client of the mount, or of its MSM4 stream
+            conns["clients"].pop(writer, None)
+            conns["msm4"].pop(writer, None)
         if conn_type == "server":
             # cancel asyncio background server task
             task = self.server_tasks.pop(mount, None)
@@ -255,10 +956,10 @@ class Caster():
             await writer.wait_closed()
         except OSError as e:
             if DEBUG:
-                sys.print_exception(e)
+                print_exception(e)
         if conn_type == "server":
             # Remove all associated clients and delete mount
-            for client in self.mounts[mount]["clients"]:
+            for client in list(conns["clients"]) + list(conns["msm4"]):
                 try:
                     client.write("Mountpoint unavailable. Please try again later.\r\n".encode())
                     client.close()
@@ -266,23 +967,25 @@ class Caster():
                 except OSError as e:
                     # Client already gone
                     if DEBUG:
-                        sys.print_exception(e)
+                        print_exception(e)
             del self.mounts[mount]
 
     async def probe_connections(self):
-        """Probe clients and servers
-        evry N seconds to check still connected."""
+        """Probe servers every N seconds to check still connected.
+
+        Clients are watched by their own connection handler (see handle_connection).
+        """
 
         # Seconds to sleep between probe attempts
         probe_cycle = 5
 
         while True:
-            # Sleep if no servers and no clients
-            if not any(d.get("clients") or d.get("servers") for d in self.mounts.values()):
+            # Sleep if no servers
+            if not any(d.get("servers") for d in self.mounts.values()):
                 await asyncio.sleep(probe_cycle)
                 continue
 
-            for mount, conns in self.mounts.items():
+            for mount, conns in list(self.mounts.items()):
                 for s_writer, s_reader in list(conns["servers"].items()):
                     try:
                         s_writer.write(b"")
@@ -294,76 +997,92 @@ class Caster():
                             await s_writer.wait_closed()
                         except OSError as e:
                             if DEBUG:
-                                sys.print_exception(e)
+                                print_exception(e)
                     except OSError as e:
                         if DEBUG:
-                            sys.print_exception(e)
-                for c_writer, c_reader in list(conns["clients"].items()):
-                    try:
-                        probe = await c_reader.read(128)
-                        if not probe:
-                            await self.drop_connection(mount, c_writer)
-                            try:
-                                c_writer.close()
-                                await c_writer.wait_closed()
-                            except OSError as e:
-                                if DEBUG:
-                                    sys.print_exception(e)
-                    except OSError:
-                        await self.drop_connection(mount, c_writer)
-                        try:
-                            c_writer.close()
-                            await c_writer.wait_closed()
-                        except OSError as e:
-                            if DEBUG:
-                                sys.print_exception(e)
+                            print_exception(e)
 
-            gc.collect()
             await asyncio.sleep(probe_cycle)
 
     async def server_loop(self, mount, conns, s_writer, s_reader):
         """Loop reading from server and writing to client(s)"""
+        # Max msg length for RTCM is 1023 - read into a buffer allocated once per connection
+        buf = bytearray(1024)
+        mv = memoryview(buf)
+        # Frames RTCM for MSM4 clients (created when the first subscribes)
+        framer = None
         try:
             while True:
                 if mount not in self.mounts:
                     # No server associated with this mount any more.
                     if DEBUG:
-                        log(f"No server providing data for mount {mount} - exiting task.")
+                        log("No server providing data for mount %s - exiting task.", mount)
                     # Delete from the list of running tasks
                     self.server_tasks.pop(mount, None)
                     break
                 try:
-                    # Max msg length for RTCM is 1023
-                    data = await asyncio.wait_for(s_reader.read(1024), 1)
-                    if not data:
+                    nbytes = await asyncio.wait_for(readinto(s_reader, mv), 1)
+                    if not nbytes:
                         # Empty data = server disconnect
                         raise OSError
+                    data = mv[:nbytes]
+                    stamp = self.tracer.stamp(ticks_us()) if self.tracer else None
                 except asyncio.TimeoutError:
                     # Avoid blocking on server reads
                     continue
                 except OSError as e:
                     await self.drop_connection(mount, s_writer, conn_type="server")
                     break
+                # Queue data for every client before draining, so one slow client
+                # doesn't hold back delivery to the rest.
+                clients = list(conns["clients"])
+                msm4 = list(conns["msm4"])
                 cli_remove = []
-                for c_writer, _ in conns["clients"].items():
+                for c_writer in clients:
                     try:
                         c_writer.write(data)
-                        await c_writer.drain()
                     except OSError:
                         # Flag client for removal at end of loop
                         cli_remove.append(c_writer)
-                        # Don't send more messages
-                        break
+                if msm4:
+                    if framer is None:
+                        framer = Framer()
+                    framer.feed(data)
+                    frames = framer.pop_frames()
+                    if frames:
+                        for frame in iter_frames(frames):
+                            # Converted frame is only valid until the next convert (write copies it)
+                            frame = self.transcoder.convert(frame)
+                            for c_writer in msm4:
+                                if c_writer in cli_remove:
+                                    continue
+                                try:
+                                    c_writer.write(frame)
+                                except OSError:
+                                    cli_remove.append(c_writer)
+                    clients += msm4
+                elif framer:
+                    # Drop any partial frame, so the next MSM4 client starts cleanly
+                    framer.reset()
+                for c_writer in clients:
+                    if c_writer in cli_remove:
+                        continue
+                    try:
+                        await c_writer.drain()
+                        if stamp is not None:
+                            observe(self.latency, stamp)
+                    except OSError:
+                        cli_remove.append(c_writer)
                 for c_writer in cli_remove:
                     await self.drop_connection(mount, c_writer)
 
                 # Yield control
-                await asyncio.sleep_ms(0)
+                await sleep_ms(0)
         except asyncio.CancelledError:
             await self.drop_connection(mount, s_writer, conn_type="server")
         except Exception as e:
             if DEBUG:
-                sys.print_exception(e)
+                print_exception(e)
             await self.drop_connection(mount, s_writer, conn_type="server")
 
     async def handle_data(self):
@@ -372,15 +1091,15 @@ class Caster():
                 for s_writer, s_reader in list(conns["servers"].items()):
                     if mount not in self.server_tasks:
                         if DEBUG:
-                            log(f"Starting task for mount: {mount}")
+                            log("Starting task for mount: %s", mount)
                         task = asyncio.create_task(self.server_loop(mount, conns, s_writer, s_reader))
                         self.server_tasks[mount] = task
-            await asyncio.sleep_ms(100)
+            await sleep_ms(100)
 
 
     async def handle_connection(self, reader, writer):
         addr = writer.get_extra_info('peername')
-        log(f"[{self.name}] Connection from: {addr}")
+        log("[%s] Connection from: %s", self.name, addr)
         try:
             req = await reader.read(1024)
             req = req.decode()
@@ -401,7 +1120,7 @@ class Caster():
             method, mount, _ = req.split(None,2)
             if mount == "/":
                 # Send SOURCETABLE to client, then close
-                log(f"[{self.name}] Client requested Sourcetable")
+                log("[%s] Client requested Sourcetable", self.name)
                 await self.send_headers(writer, status="sourcetable", client_ver=client_ver)
                 try:
                     writer.write(self.sourcetable)
@@ -418,6 +1137,12 @@ class Caster():
                 # Client downloading RTCM data
                 if not password == self.cli_credb64:
                     raise AuthError
+                clients = "clients"
+                if mount not in self.mounts and self.transcoder and mount.endswith("_MSM4"):
+                    # The base mount's data, converted from MSM7 to MSM4
+                    base = mount[:-5]
+                    if base in self.mounts or base in self.allowed_mounts:
+                        mount, clients = base, "msm4"
                 if mount not in self.mounts:
                     # No Server is supplying data for that mountpoint
                     status = "503"
@@ -426,9 +1151,17 @@ class Caster():
                         status = "404"
                     await self.send_headers(writer, status=status, client_ver=client_ver)
                     return
-                log(f"[{self.name}] Client subscribed: {addr}")
+                log("[%s] Client subscribed: %s", self.name, addr)
                 await self.send_headers(writer, content_type="gnss/data", client_ver=client_ver)
-                self.mounts[mount]["clients"][writer] = reader
+                self.mounts[mount][clients][writer] = reader
+                # Watch for client disconnect (discarding anything sent, e.g. GGA)
+                try:
+                    while await reader.read(128):
+                        pass
+                except OSError:
+                    pass
+                if writer in self.mounts.get(mount, {}).get(clients, {}):
+                    await self.drop_connection(mount, writer)
                 return
             elif method == "POST":
                 # Server uploading RTCM data
@@ -442,20 +1175,21 @@ class Caster():
                     # Another server is supplying this mountpoint
                     await self.send_headers(writer, status="409")
                     return
-                log(f"[{self.name}] Server subscribed: {addr}")
+                log("[%s] Server subscribed: %s", self.name, addr)
                 await self.send_headers(writer)
-                self.mounts[mount] = {"servers": {writer: reader}, "clients": {}}
+                self.mounts[mount] = {"servers": {writer: reader}, "clients": {}, "msm4": {}}
         except AuthError:
             writer.write("HTTP/1.1 401 Invalid Username or Password\r\n\r\n".encode())
             writer.close()
             await writer.wait_closed()
-        except OSError:
+        except (OSError, ValueError):
+            # Connection error, or malformed request
             try:
                 writer.close()
                 await writer.wait_closed()
             except OSError:
                 pass
-        asyncio.sleep(0)
+        await asyncio.sleep(0)
 
 
     async def run(self):
@@ -465,8 +1199,8 @@ class Caster():
         self.tasks.append(asyncio.create_task(self.handle_data()))
         self.tasks.append(asyncio.create_task(self.probe_connections()))
 
-        log(f"[{self.name}] Listening on {self.bind_address}:{self.bind_port}")
-        server = await asyncio.start_server(self.handle_connection, self.bind_address, self.bind_port)
+        log("[%s] Listening on %s:%s", self.name, self.bind_address, self.bind_port)
+        server = await asyncio.start_server(self.handle_connection, self.bind_address, self.bind_port, backlog=self.backlog)
 
         # Wait for shutdown signal
         await self.shutdown_event.wait()
@@ -0,0 +1,357 @@
+"""Record the raw GPS stream (NMEA and RTCM) to flash, for post-processing (PPK) and fault finding.
+
+Data is collected in a few preallocated RAM blocks, and each full block is
+written to flash with a single `write` (a block is one flash sector), in the
+background. Files rotate by size and age, and the oldest are deleted first
+to stay within the size limit (and leave free space on the filesystem).
+
+Each data file (NNNNNN.raw) has an index (NNNNNN.idx) of 8 byte entries -
+(time, file offset) for the start of each block - so a time window can be
+extracted without scanning the data. Index entries are batched, and written
+when the batch fills, the file rotates, or the oldest entry is `flush_interval`
+old - so at most that much recent data is left unindexed after a power loss.
+"""
+import asyncio
+import os
+import struct
+import time
+from compat import print_exception, ticks_diff, ticks_ms
+from devices import LOG_ERROR, Logger
+from metrics import registry
+try:
+    from debug import DEBUG
+except ImportError:
+    DEBUG=False
+
+log = Logger.getLogger().log
+
+INDEX_ENTRY = "<II"
+INDEX_LEN = 8
+# Index entries are written in batches, to avoid small flash writes
+INDEX_BATCH = 16
+READ_SIZE = 1024
+
+
+def fmt_time(secs):
+    t = time.localtime(secs)
+    return f"{t[0]:04d}-{t[1]:02d}-{t[2]:02d}T{t[3]:02d}:{t[4]:02d}:{t[5]:02d}"
+
+
+def parse_time(value):
+    """Parse YYYY-MM-DDTHH:MM[:SS] (as shown by RECORD LIST) to seconds."""
+    date, _, clock = value.partition("T")
+    year, month, day = (int(v) for v in date.split("-"))
+    hms = [int(v) for v in clock.split(":")] if clock else []
+    hms += [0] * (3 - len(hms))
+    return int(time.mktime((year, month, day, hms[0], hms[1], hms[2], 0, 0, -1)))
+
+
+class Extract():
+    """Iterator of (bytes) chunks of recorded data, for streaming by the remote shell.
+
+    A class rather than a generator: on MicroPython a coroutine is a generator,
+    so the shell awaits anything with `send` - see Shell.exec_command.
+    """
+
+    def __init__(self, recorder, ranges):
+        self.recorder = recorder
+        self.ranges = ranges
+        self.header = f"RECORD {sum(e - s for _, s, e in ranges)} bytes\n".encode()
+        self.buf = bytearray(READ_SIZE)
+        self.mv = memoryview(self.buf)
+        self.f = None
+        self.pos = 0
+        self.stop = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.header:
+            header, self.header = self.header, None
+            return header
+        while True:
+            if self.f is None:
+                if not self.ranges:
+                    raise StopIteration
+                seq, self.pos, self.stop = self.ranges.pop(0)
+                self.f = open(self.recorder.filename(seq), "rb")
+                self.f.seek(self.pos)
+            if self.pos < self.stop:
+                count = self.f.readinto(self.mv[:min(READ_SIZE, self.stop - self.pos)])
+                if count:
+                    self.pos += count
+                    return bytes(self.mv[:count])
+            # End of this range (or file truncated)
+            self.close()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+class Recorder():
+
+    def __init__(self, path="/gnss", block_size=4096, blocks=4, file_size=1048576, file_secs=3600, max_size=8388608, min_free=65536, flush_interval=10):
+        self.name = "Recorder"
+        self.path = path.rstrip("/")
+        self.block_size = block_size
+        self.file_size = file_size
+        self.file_secs = file_secs
+        self.max_size = max_size
+        self.min_free = min_free
+        # Seconds before a partly filled block is written anyway
+        self.flush_interval = flush_interval
+        self.blocks = [bytearray(block_size) for _ in range(blocks)]
+        # Bytes used in each block, and the time its first byte was received
+        self.used = [0] * blocks
+        self.times = [0] * blocks
+        # Block being filled, and the oldest block waiting to be written
+        self.fill = 0
+        self.pending = 0
+        self.full = 0
+        self.event = asyncio.Event()
+        # { seq: size } of files on flash
+        self.files = {}
+        self.seq = 0
+        self.f = None
+        self.file_bytes = 0
+        self.file_started = 0
+        self.index = bytearray(INDEX_LEN * INDEX_BATCH)
+        self.index_len = 0
+        # ticks_ms when the oldest unwritten index entry was added
+        self.index_started = 0
+        self.written = 0
+        self.writes = 0
+        self.dropped = 0
+        self.deleted = 0
+        self.errors = 0
+        self.write_ms_max = 0
+        self.clock_set = False
+        registry.gauge("recorder.written", lambda: self.written)
+        registry.gauge("recorder.buffered", lambda: sum(self.used))
+        registry.gauge("recorder.dropped", lambda: self.dropped)
+        self.write_ms = registry.histogram("recorder.write_ms")
+
+    def filename(self, seq, ext="raw"):
+        return f"{self.path}/{seq:06d}.{ext}"
+
+    def scan(self):
+        """Find existing files (so numbering continues, and old files count towards the size limit)."""
+        try:
+            os.mkdir(self.path)
+        except OSError:
+            # Already exists
+            pass
+        for name in os.listdir(self.path):
+            if name.endswith(".raw") and name[:-4].isdigit():
+                self.files[int(name[:-4])] = os.stat(f"{self.path}/{name}")[6]
+        self.seq = max(self.files, default=0)
+
+    def write(self, data):
+        """Queue data for recording (copied into the current RAM block)."""
+        pos = 0
+        while pos < len(data):
+            i = self.fill
+            used = self.used[i]
+            if used == self.block_size:
+                # Current block is full - move on to the next, unless it is still waiting to be written
+                nxt = (i + 1) % len(self.blocks)
+                if self.full == len(self.blocks):
+                    self.dropped += len(data) - pos
+                    return
+                self.fill = i = nxt
+                used = 0
+            if not used:
+                self.times[i] = int(time.time())
+            count = min(len(data) - pos, self.block_size - used)
+            self.blocks[i][used:used + count] = data[pos:pos + count]
+            self.used[i] = used + count
+            pos += count
+            if used + count == self.block_size:
+                self.full += 1
+                self.event.set()
+
+    def set_clock(self, rmc):
+        """Set the clock from a valid RMC sentence, so the index has real times."""
+        try:
+            fields = rmc.split(b",")
+            if fields[2] != b"A" or len(fields[1]) < 6 or len(fields[9]) != 6:
+                return
+            hms, date = fields[1], fields[9]
+            from machine import RTC
+            RTC().datetime((2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]), 0, int(hms[0:2]), int(hms[2:4]), int(hms[4:6]), 0))
+            self.clock_set = True
+            log("[%s] Clock set from GPS: %s", self.name, fmt_time(time.time()))
+        except (ImportError, IndexError, ValueError, OSError) as e:
+            if DEBUG:
+                print_exception(e)
+
+    def open_next(self, now):
+        self.close_file()
+        self.seq += 1
+        self.f = open(self.filename(self.seq), "wb")
+        # Truncate any stale index from an earlier file with the same number
+        open(self.filename(self.seq, "idx"), "wb").close()
+        self.files[self.seq] = 0
+        self.file_bytes = 0
+        self.file_started = now
+
+    def close_file(self):
+        if self.f:
+            self.write_index()
+            self.f.close()
+            self.f = None
+
+    def write_index(self):
+        if self.index_len:
+            with open(self.filename(self.seq, "idx"), "ab") as f:
+                f.write(memoryview(self.index)[:self.index_len])
+            self.index_len = 0
+
+    def free_space(self):
+        try:
+            st = os.statvfs(self.path)
+            return st[0] * st[3]
+        except (AttributeError, OSError):
+            return self.min_free
+
+    def make_room(self, size):
+        """Delete the oldest files until within the size limit, with enough free space for size more bytes."""
+        while len(self.files) > 1 and (
+            sum(self.files.values()) + size > self.max_size or self.free_space() - size < self.min_free
+        ):
+            oldest = min(self.files)
+            for ext in ("raw", "idx"):
+                try:
+                    os.remove(self.filename(oldest, ext))
+                except OSError:
+                    pass
+            self.deleted += 1
+            log("[%s] Deleted oldest file %s (%s bytes)", self.name, self.filename(oldest), self.files.pop(oldest))
+
+    def write_block(self, i):
+        """Write the used part of RAM block i to the current file (rotating first if needed)."""
+        size = self.used[i]
+        stamp = self.times[i]
+        if self.f is None or self.file_bytes + size > self.file_size or stamp - self.file_started >= self.file_secs:
+            self.open_next(stamp)
+        self.make_room(size)
+        start = ticks_ms()
+        if not self.index_len:
+            self.index_started = start
+        struct.pack_into(INDEX_ENTRY, self.index, self.index_len, stamp, self.file_bytes)
+        self.index_len += INDEX_LEN
+        self.f.write(memoryview(self.blocks[i])[:size])
+        self.f.flush()
+        if self.index_len == len(self.index) or ticks_diff(start, self.index_started) >= self.flush_interval * 1000:
+            self.write_index()
+        elapsed = ticks_diff(ticks_ms(), start)
+        self.write_ms_max = max(self.write_ms_max, elapsed)
+        self.write_ms.observe(elapsed)
+        self.file_bytes += size
+        self.files[self.seq] = self.file_bytes
+        self.written += size
+        self.writes += 1
+        self.used[i] = 0
+
+    def flush(self, partial=True):
+        """Write out full blocks, and (if partial) the block being filled."""
+        while self.full:
+            self.write_block(self.pending)
+            self.pending = (self.pending + 1) % len(self.blocks)
+            self.full -= 1
+        if not self.used[self.fill]:
+            # All blocks written - fill from the next one to be written
+            self.fill = self.pending
+        elif partial:
+            # The block being filled is the only one left (fill == pending), and is reused from the start
+            self.write_block(self.fill)
+        if partial and self.f:
+            self.write_index()
+
+    def close(self):
+        try:
+            self.flush()
+        except OSError as e:
+            print_exception(e)
+        self.close_file()
+
+    async def run(self):
+        self.scan()
+        log("[%s] Recording to %s (%s existing files)", self.name, self.path, len(self.files))
+        while True:
+            try:
+                await asyncio.wait_for(self.event.wait(), self.flush_interval)
+                self.event.clear()
+                self.flush(partial=False)
+            except asyncio.TimeoutError:
+                # No full block for a while - write what there is
+                self.flush()
+            except OSError as e:
+                self.errors += 1
+                log("[%s] Write error: %s", self.name, e, level=LOG_ERROR)
+                if DEBUG:
+                    print_exception(e)
+                # Don't retry the same block forever
+                await asyncio.sleep(self.flush_interval)
+
+    def read_index(self, seq):
+        try:
+            with open(self.filename(seq, "idx"), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        entries = [struct.unpack_from(INDEX_ENTRY, data, i) for i in range(0, len(data) - INDEX_LEN + 1, INDEX_LEN)]
+        if seq == self.seq:
+            # Entries not yet written
+            entries += [struct.unpack_from(INDEX_ENTRY, self.index, i) for i in range(0, self.index_len, INDEX_LEN)]
+        return entries
+
+    def list(self):
+        """Return a listing of files, with the time range each covers."""
+        lines = []
+        for seq in sorted(self.files):
+            entries = self.read_index(seq)
+            span = f"{fmt_time(entries[0][0])} - {fmt_time(entries[-1][0])}" if entries else "no index"
+            lines.append(f"{self.filename(seq)}: {self.files[seq]} bytes, {span}")
+        return "\n".join(lines) or "No recordings."
+
+    def ranges(self, start, end):
+        """Return (seq, start offset, end offset) of the data recorded between start and end (seconds)."""
+        ranges = []
+        seqs = sorted(self.files)
+        for n, seq in enumerate(seqs):
+            entries = self.read_index(seq)
+            # The last block runs until the next file starts (or now)
+            following = self.read_index(seqs[n + 1]) if n + 1 < len(seqs) else None
+            entries.append((following[0][0] if following else time.time(), self.files[seq]))
+            first = last = None
+            # Block i covers from its time until the next block's time
+            for i in range(len(entries) - 1):
+                if entries[i][0] > end:
+                    break
+                if entries[i + 1][0] < start:
+                    continue
+                if first is None:
+                    first = entries[i][1]
+                last = entries[i + 1][1]
+            if first is not None and last > first:
+                ranges.append((seq, first, last))
+        return ranges
+
+    def extract(self, start, end):
+        """Return an iterator of the raw data between start and end, preceded by a header line with its length."""
+        # Include data still in RAM
+        self.flush()
+        return Extract(self, self.ranges(start, end))
+
+    def status(self):
+        """Return a status report (for the remote shell)."""
+        return (
+            f"Recorder: {self.path}, {len(self.files)} files, {sum(self.files.values())}/{self.max_size} bytes, "
+            f"current {self.filename(self.seq) if self.f else 'none'}\n"
+            f"Written: {self.written} bytes in {self.writes} writes (max {self.write_ms_max}ms), "
+            f"buffered: {sum(self.used)} bytes, dropped: {self.dropped} bytes, deleted: {self.deleted} files, errors: {self.errors}"
+        )
@@ -0,0 +1,176 @@
+"""Cache DNS lookups, so (re)connecting doesn't block the event loop on getaddrinfo.
+
+On MicroPython `socket.getaddrinfo` blocks the whole event loop until the DNS
+server answers. Where the DNS server address is known (set from the wifi config),
+lookups are instead made with a non-blocking UDP query. Resolved addresses are
+cached for `ttl` seconds, refreshed in the background once expired, and the
+last-known-good address is used if a refresh fails.
+"""
+import asyncio
+import socket
+import struct
+from compat import print_exception, sleep_ms, ticks_diff, ticks_ms
+from devices import LOG_WARNING, Logger
+try:
+    from debug import DEBUG
+except ImportError:
+    DEBUG=False
+
+log = Logger.getLogger().log
+
+
+def is_ip(host):
+    parts = host.split(".")
+    return len(parts) == 4 and all(p.isdigit() for p in parts)
+
+
+def build_query(qid, host):
+    """Build a DNS query for the A record of host."""
+    query = bytearray(struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0))
+    for label in host.split("."):
+        query.append(len(label))
+        query.extend(label.encode())
+    # Root label, QTYPE=A, QCLASS=IN
+    query.extend(b"\x00\x00\x01\x00\x01")
+    return query
+
+
+def _skip_name(data, i):
+    while data[i]:
+        if data[i] & 0xC0:
+            # Compression pointer - always ends the name
+            return i + 2
+        i += data[i] + 1
+    return i + 1
+
+
+def parse_response(qid, data):
+    """Return the first A record address from a DNS response, or None."""
+    rid, flags, qdcount, ancount = struct.unpack_from("!HHHH", data, 0)
+    if rid != qid or flags & 0x000F:
+        return None
+    i = 12
+    for _ in range(qdcount):
+        i = _skip_name(data, i) + 4
+    for _ in range(ancount):
+        i = _skip_name(data, i)
+        rtype, _, _, rdlen = struct.unpack_from("!HHIH", data, i)
+        i += 10
+        if i + rdlen > len(data):
+            # Truncated
+            return None
+        if rtype == 1 and rdlen == 4:
+            return "%d.%d.%d.%d" % tuple(data[i:i + 4])
+        i += rdlen
+    return None
+
+
+class Resolver():
+
+    def __init__(self, ttl=300, timeout_ms=3000):
+        self.ttl = ttl
+        self.timeout_ms = timeout_ms
+        # DNS server address - if not set, fall back to (blocking) getaddrinfo
+        self.dns_server = None
+        # { host: (address, resolved ticks_ms) }
+        self.cache = {}
+        self.refreshing = set()
+        self.qid = 0
+        self.lookups = 0
+        self.failures = 0
+        # Time (ms) the event loop was blocked by lookups
+        self.blocked_last_ms = 0
+        self.blocked_max_ms = 0
+        self.blocked_total_ms = 0
+
+    async def resolve(self, host, port):
+        """Return an IP address for host, from the cache where possible."""
+        if is_ip(host):
+            return host
+        entry = self.cache.get(host)
+        if entry:
+            if ticks_diff(ticks_ms(), entry[1]) > self.ttl * 1000 and host not in self.refreshing:
+                # Expired - use the cached address now, and refresh in the background
+                self.refreshing.add(host)
+                asyncio.create_task(self.refresh(host, port))
+            return entry[0]
+        await self.refresh(host, port)
+        if host not in self.cache:
+            raise OSError(f"Unable to resolve {host}")
+        return self.cache[host][0]
+
+    async def refresh(self, host, port):
+        """Look up host and update the cache, keeping the last-known-good address on failure."""
+        try:
+            addr = await self.lookup(host, port)
+            if addr:
+                self.cache[host] = (addr, ticks_ms())
+            else:
+                raise OSError("No address")
+        except (OSError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            log("[DNS] Lookup failed for %s: %s%s", host, e, " - using last known address." if host in self.cache else "", level=LOG_WARNING)
+        finally:
+            self.refreshing.discard(host)
+
+    async def lookup(self, host, port):
+        self.lookups += 1
+        loop = asyncio.get_event_loop()
+        if hasattr(loop, "getaddrinfo"):
+            # CPython - resolve in a thread
+            info = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            return info[0][-1][0]
+        if self.dns_server:
+            return await self.query(host)
+        # No DNS server known - blocking lookup
+        start = ticks_ms()
+        try:
+            info = socket.getaddrinfo(host, port)
+        finally:
+            self.record_blocked(ticks_diff(ticks_ms(), start))
+        return info[0][-1][0]
+
+    async def query(self, host):
+        """Resolve host with a non-blocking UDP DNS query."""
+        self.qid = (self.qid + 1) & 0xFFFF
+        query = build_query(self.qid, host)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            start = ticks_ms()
+            # Send twice (at the start, and half way through the timeout) in case of packet loss
+            sends = 0
+            while ticks_diff(ticks_ms(), start) < self.timeout_ms:
+                if sends == 0 or (sends == 1 and ticks_diff(ticks_ms(), start) > self.timeout_ms // 2):
+                    sock.sendto(query, (self.dns_server, 53))
+                    sends += 1
+                try:
+                    addr = parse_response(self.qid, sock.recv(512))
+                    if addr:
+                        return addr
+                except OSError:
+                    # EAGAIN - no response yet
+                    pass
+                except (IndexError, ValueError) as e:
+                    # Malformed response
+                    if DEBUG:
+                        print_exception(e)
+                await sleep_ms(20)
+            raise asyncio.TimeoutError
+        finally:
+            sock.close()
+
+    def record_blocked(self, elapsed_ms):
+        self.blocked_last_ms = elapsed_ms
+        self.blocked_max_ms = max(self.blocked_max_ms, elapsed_ms)
+        self.blocked_total_ms += elapsed_ms
+
+    def status(self):
+        return (
+            f"DNS: {len(self.cache)} cached, {self.lookups} lookups, {self.failures} failures, "
+            f"loop blocked {self.blocked_last_ms}ms last, {self.blocked_max_ms}ms max, {self.blocked_total_ms}ms total"
+        )
+
+
+# Shared by all connections
+resolver = Resolver()
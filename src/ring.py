@@ -0,0 +1,52 @@
+"""Fixed size byte ring buffer, for passing data from an IRQ (or thread) to an async task."""
+
+
+class Ring():
+    """Single producer, single consumer byte ring buffer.
+
+    The producer only moves `head` and the consumer only moves `tail`, so `write`
+    can be called from an IRQ handler while a task calls `readinto`. Data which
+    doesn't fit is dropped (and counted) rather than overwriting unread data.
+    """
+
+    def __init__(self, size=2048):
+        # One byte is always left free, to tell a full buffer from an empty one
+        self.size = size + 1
+        self.buf = bytearray(self.size)
+        self.mv = memoryview(self.buf)
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.overflow_bytes = 0
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
+
+    def free(self):
+        return self.size - 1 - len(self)
+
+    def write(self, data):
+        """Append data, returning the number of bytes written (all or nothing)."""
+        count = len(data)
+        if count > self.free():
+            self.overflows += 1
+            self.overflow_bytes += count
+            return 0
+        head = self.head
+        first = min(count, self.size - head)
+        self.buf[head:head + first] = data[:first]
+        if first < count:
+            self.buf[:count - first] = data[first:]
+        self.head = (head + count) % self.size
+        return count
+
+    def readinto(self, buf):
+        """Move up to len(buf) bytes into buf, returning the number of bytes read."""
+        count = min(len(buf), len(self))
+        tail = self.tail
+        first = min(count, self.size - tail)
+        buf[:first] = self.mv[tail:tail + first]
+        if first < count:
+            buf[first:count] = self.mv[:count - first]
+        self.tail = (tail + count) % self.size
+        return count
@@ -0,0 +1,211 @@
+"""RTCM 3 frame helpers: CRC-24Q and a stream framer (optionally also NMEA) using a preallocated buffer."""
+from array import array
+
+PREAMBLE = 0xD3
+# Header (preamble + 6 reserved bits + 10 bit length) and CRC sizes
+HEADER_LEN = 3
+CRC_LEN = 3
+# Maximum frame length: header + 1023 byte payload + CRC
+MAX_FRAME_LEN = HEADER_LEN + 1023 + CRC_LEN
+# Longest NMEA sentence accepted (standard max is 82, but proprietary sentences can be longer)
+MAX_NMEA_LEN = 256
+
+
+def _crc24q_table():
+    table = array("I", [0] * 256)
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table[i] = crc & 0xFFFFFF
+    return table
+
+_CRC_TABLE = _crc24q_table()
+
+
+def crc24q(buf, start=0, end=None):
+    """Calculate the CRC-24Q of buf[start:end]."""
+    if end is None:
+        end = len(buf)
+    crc = 0
+    table = _CRC_TABLE
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ buf[i]]
+    return crc
+
+
+def msg_type(frame, offset=0):
+    """Return the RTCM message number of the frame starting at offset."""
+    return (frame[offset + 3] << 4) | (frame[offset + 4] >> 4)
+
+
+# Station/antenna description messages - the latest of each is kept when replaying buffered data
+STATIC_TYPES = (1005, 1006, 1007, 1008, 1013, 1033, 1230)
+
+
+def is_msm(mtype):
+    """True if the message number is an MSM observation message (MSM1-7, any constellation)."""
+    return 1071 <= mtype <= 1137 and 1 <= mtype % 10 <= 7
+
+
+def msm_epoch(frame, offset=0):
+    """Return the 30 bit epoch time field of an MSM frame."""
+    i = offset + HEADER_LEN + 3
+    return ((frame[i] << 24 | frame[i + 1] << 16 | frame[i + 2] << 8 | frame[i + 3]) >> 2) & 0x3FFFFFFF
+
+
+def msm_multiple(frame, offset=0):
+    """True if more MSM frames follow for the same epoch (the multiple message bit)."""
+    return bool(frame[offset + HEADER_LEN + 6] & 0x02)
+
+
+def iter_frames(frames):
+    """Iterate over a buffer of whole frames (as returned by Framer.pop_frames), yielding each frame."""
+    i = 0
+    while i < len(frames):
+        total = HEADER_LEN + (((frames[i + 1] & 0x03) << 8) | frames[i + 2]) + CRC_LEN
+        yield frames[i:i + total]
+        i += total
+
+
+class Framer():
+    """Reassemble whole RTCM frames from a byte stream.
+
+    Data is read directly into a fixed buffer (see `writable` and `commit`) so no
+    new objects are allocated per read. `pop_frames` returns a memoryview over
+    all complete frames received so far, which is only valid until the next call
+    to `writable` or `feed`.
+
+    For a mixed stream (e.g. GPS output), `pop` instead returns one message at a
+    time - either an NMEA sentence or an RTCM frame.
+    """
+
+    def __init__(self, size=2048, check_crc=True):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.check_crc = check_crc
+        # Unconsumed data is held in buf[start:end]
+        self.start = 0
+        self.end = 0
+        self.frames = 0
+        self.crc_errors = 0
+        self.discarded = 0
+
+    def reset(self):
+        """Drop any partial frame (e.g. after reconnecting)."""
+        self.start = self.end = 0
+
+    def writable(self, size):
+        """Return a memoryview of up to `size` free bytes to read data into."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start and self.end + size > len(self.buf):
+            # Move partial frame to the start of the buffer
+            remain = self.end - self.start
+            if remain <= self.start:
+                self.buf[:remain] = self.mv[self.start:self.end]
+            else:
+                # Regions overlap - copy via a temporary
+                self.buf[:remain] = bytes(self.mv[self.start:self.end])
+            self.start, self.end = 0, remain
+        if self.end == len(self.buf):
+            # Buffer full without a valid frame - discard and resync
+            self.discarded += self.end - self.start
+            self.start = self.end = 0
+        return self.mv[self.end:min(len(self.buf), self.end + size)]
+
+    def commit(self, nbytes):
+        """Mark nbytes (read into the view from `writable`) as received."""
+        self.end += nbytes
+
+    def feed(self, data):
+        """Copy data into the buffer (for sources without readinto)."""
+        pos = 0
+        while pos < len(data):
+            view = self.writable(len(data) - pos)
+            view[:] = data[pos:pos + len(view)]
+            self.commit(len(view))
+            pos += len(view)
+
+    def pop_frames(self):
+        """Return a memoryview of all complete frames at the head of the buffer, or None."""
+        buf = self.buf
+        first = None
+        i = self.start
+        end = self.end
+        while i < end:
+            if buf[i] != PREAMBLE or (i + 1 < end and buf[i + 1] & 0xFC):
+                if first is not None:
+                    break
+                # Not a frame start - skip byte to resync
+                i += 1
+                self.start = i
+                self.discarded += 1
+                continue
+            if end - i < HEADER_LEN:
+                break
+            length = ((buf[i + 1] & 0x03) << 8) | buf[i + 2]
+            total = HEADER_LEN + length + CRC_LEN
+            if end - i < total:
+                break
+            if self.check_crc:
+                crc_at = i + HEADER_LEN + length
+                if crc24q(buf, i, crc_at) != (buf[crc_at] << 16) | (buf[crc_at + 1] << 8) | buf[crc_at + 2]:
+                    self.crc_errors += 1
+                    if first is not None:
+                        break
+                    i += 1
+                    self.start = i
+                    self.discarded += 1
+                    continue
+            if first is None:
+                first = i
+            i += total
+            self.frames += 1
+        if first is None:
+            return None
+        self.start = i
+        return self.mv[first:i]
+
+    def pop(self):
+        """Return a memoryview of the next complete NMEA sentence or RTCM frame, or None.
+
+        Any other data is discarded.
+        """
+        buf = self.buf
+        end = self.end
+        while self.start < end:
+            i = self.start
+            if buf[i] == 36:  # $
+                # NMEA sentence - ends at newline
+                limit = min(end, i + MAX_NMEA_LEN)
+                for j in range(i + 1, limit):
+                    if buf[j] == 10:
+                        self.start = j + 1
+                        return self.mv[i:j + 1]
+                    if buf[j] == 36 or buf[j] == PREAMBLE:
+                        # Truncated sentence
+                        break
+                else:
+                    if limit == end and end - i < MAX_NMEA_LEN:
+                        # Wait for the rest of the sentence
+                        return None
+            elif buf[i] == PREAMBLE and (i + 1 == end or not buf[i + 1] & 0xFC):
+                if end - i < HEADER_LEN:
+                    return None
+                length = ((buf[i + 1] & 0x03) << 8) | buf[i + 2]
+                total = HEADER_LEN + length + CRC_LEN
+                if end - i < total:
+                    return None
+                crc_at = i + HEADER_LEN + length
+                if not self.check_crc or crc24q(buf, i, crc_at) == (buf[crc_at] << 16) | (buf[crc_at + 1] << 8) | buf[crc_at + 2]:
+                    self.start = i + total
+                    self.frames += 1
+                    return self.mv[i:i + total]
+                self.crc_errors += 1
+            # Not a valid message start - skip byte to resync
+            self.start = i + 1
+            self.discarded += 1
+        return None
@@ -0,0 +1,105 @@
+"""RTCM bandwidth shaping: forward each message type at most once per configured interval.
+
+Intended for constrained links (ESP-Now, cellular NTRIP uplinks), where e.g.
+station messages (1005, 1033) are only needed every 10s, and MSM observations
+at 1Hz rather than the GPS output rate.
+
+MSM messages are shaped by epoch, so that all constellations' observations for
+an epoch are forwarded (or dropped) together. An epoch's MSM messages are
+consecutive, with the multiple message bit set in all but the last. Each
+epoch is timed by the MSM epoch time field (rather than arrival time), so
+decimation is exact - e.g. 10Hz MSM shaped to 1Hz forwards every 10th epoch.
+
+Other messages are timed by arrival (with SLACK_MS allowed for jitter).
+NMEA (and anything else not RTCM) is always forwarded.
+"""
+from compat import ticks_diff, ticks_ms
+from metrics import registry
+from rtcm import HEADER_LEN, PREAMBLE, is_msm, msg_type, msm_epoch, msm_multiple
+
+# Arrival jitter (ms) allowed for messages timed by arrival
+SLACK_MS = 100
+# Epoch time wraps weekly (GLONASS: daily)
+WEEK_MS = 604800000
+DAY_MS = 86400000
+
+
+def epoch_ms(frame, mtype):
+    """Return an MSM frame's epoch time (ms), and the time at which it wraps."""
+    epoch = msm_epoch(frame)
+    if 1081 <= mtype <= 1087:
+        # GLONASS: 3 bit day of week, 27 bit time of day
+        return epoch & 0x7FFFFFF, DAY_MS
+    return epoch, WEEK_MS
+
+
+class Shaper():
+
+    def __init__(self, name, intervals):
+        self.name = name
+        # { message type: interval (ms) } - "MSM" sets the interval for MSM epochs
+        self.intervals = {}
+        self.msm_interval = 0
+        for mtype, secs in intervals.items():
+            if mtype == "MSM":
+                self.msm_interval = int(secs * 1000)
+            else:
+                self.intervals[int(mtype)] = int(secs * 1000)
+        # { message type: ticks_ms when last forwarded }
+        self.last = {}
+        # { first message type of an epoch: epoch time last forwarded }
+        self.last_epoch = {}
+        # Decision for the current MSM epoch, and its first message type
+        self.group = None
+        self.group_type = None
+        self.passed_bytes = 0
+        self.saved_bytes = registry.counter(f"shape.{name}.saved_bytes")
+        self.saved = registry.tally(f"shape.{name}.saved")
+
+    def allow(self, frame):
+        """Return True if the message should be forwarded."""
+        if len(frame) < HEADER_LEN + 7 or frame[0] != PREAMBLE:
+            return True
+        mtype = msg_type(frame)
+        if is_msm(mtype):
+            allowed = self.allow_msm(frame, mtype)
+        elif (interval := self.intervals.get(mtype)):
+            now = ticks_ms()
+            last = self.last.get(mtype)
+            allowed = last is None or ticks_diff(now, last) + SLACK_MS >= interval
+            if allowed:
+                self.last[mtype] = now
+        else:
+            allowed = True
+        if allowed:
+            self.passed_bytes += len(frame)
+        else:
+            self.saved_bytes.inc(len(frame))
+            self.saved.inc(mtype, len(frame))
+        return allowed
+
+    def allow_msm(self, frame, mtype):
+        if not self.msm_interval:
+            return True
+        if self.group is None or mtype == self.group_type:
+            # First message of an epoch (a repeated type means the last epoch's final message was lost)
+            epoch, wrap = epoch_ms(frame, mtype)
+            last = self.last_epoch.get(mtype)
+            self.group = last is None or (epoch - last) % wrap >= self.msm_interval
+            if self.group:
+                self.last_epoch[mtype] = epoch
+            self.group_type = mtype
+        allowed = self.group
+        if not msm_multiple(frame):
+            # Last message of the epoch
+            self.group = self.group_type = None
+        return allowed
+
+    def status(self):
+        """Return a one-line status report (for the remote shell)."""
+        saved = self.saved_bytes.value
+        total = self.passed_bytes + saved
+        return (
+            f"Shaper {self.name}: {self.passed_bytes} bytes forwarded, {saved} bytes saved "
+            f"({100 * saved // total if total else 0}%)"
+        )
@@ -1,5 +1,5 @@
 import asyncio
-from devices import Logger
+from devices import LOG_WARNING, Logger
 try:
     from debug import DEBUG
 except ImportError:
@@ -20,18 +20,18 @@ class Shell():
 
     async def handle_connection(self, reader, writer):
         addr = writer.get_extra_info('peername')
-        log(f"[{self.name}] Connection from: {addr}")
+        log("[%s] Connection from: %s", self.name, addr)
         writer.write(b">>> ESP32-GPS Remote Shell <<<\n")
         if self.password:
             writer.write(b">>> Enter password: ")
             try:
                 req = await reader.read(1024)
                 if req == b"":
-                    log(f"[{self.name}] Client {addr} disconnected.")
+                    log("[%s] Client %s disconnected.", self.name, addr)
                     writer.close()
                     return
                 elif req.strip().decode() != self.password:
-                    log(f"[{self.name}] Invalid password.")
+                    log("[%s] Invalid password.", self.name, level=LOG_WARNING)
                     writer.write(b"Invalid password! Closing connection...\n")
                     writer.close()
                     return
@@ -43,7 +43,7 @@ class Shell():
                 req = await reader.read(1024)
                 req = req.decode().strip()
                 if req == "":
-                    log(f"[{self.name}] Client {addr} disconnected.")
+                    log("[%s] Client %s disconnected.", self.name, addr)
                     writer.close()
                     return
                 cmd = req
@@ -53,8 +53,17 @@ class Shell():
                 except ValueError:
                     # No options provided
                     pass
-                resp = self.exec_command(cmd, opts)
-                if resp:
+                resp = await self.exec_command(cmd, opts)
+                if hasattr(resp, "__next__"):
+                    # Iterator - stream (bytes) chunks, rather than building the whole response in memory
+                    try:
+                        for chunk in resp:
+                            writer.write(chunk)
+                            await writer.drain()
+                    finally:
+                        if hasattr(resp, "close"):
+                            resp.close()
+                elif resp:
                     if not isinstance(resp, bytes):
                         resp = resp.encode()
                     if not resp.endswith(b"\n"):
@@ -65,11 +74,16 @@ class Shell():
                 return
             await asyncio.sleep(0.1)
 
-    def exec_command(self, cmd, opts):
+    async def exec_command(self, cmd, opts):
         if DEBUG:
-            log(f"Shell command: {repr(cmd)} {opts}")
+            log("Shell command: %r %s", cmd, opts)
         if cmd in self.callbacks:
-            return self.callbacks[cmd](opts)
+            resp = self.callbacks[cmd](opts)
+            if hasattr(resp, "send"):
+                # Async callback (a coroutine is a generator on MicroPython, so
+                # streamed responses must be iterators without send, e.g. recorder.Extract)
+                resp = await resp
+            return resp
         else:
             return("Invalid command.")
 
@@ -81,7 +95,7 @@ class Shell():
         pass
 
     async def run(self):
-        log(f"[{self.name}] Listening on {self.bind_address}:{self.bind_port}")
+        log("[%s] Listening on %s:%s", self.name, self.bind_address, self.bind_port)
         server = await asyncio.start_server(self.handle_connection, self.bind_address, self.bind_port)
 
         # Wait for shutdown signal
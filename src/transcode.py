@@ -0,0 +1,215 @@
+"""Convert RTCM MSM7 observation messages to MSM4, for low bandwidth correction links.
+
+MSM4 carries the same observations (pseudorange, phase range, lock time,
+half-cycle ambiguity and CNR for each signal) at the standard resolution, and
+drops the Doppler (phase range rate) and extended satellite info - typically
+saving 35-40% of the size. RTK rovers don't need the extra precision.
+
+The header (epoch, satellite/signal/cell masks) is copied bit for bit with the
+message number changed (e.g. 1077 -> 1074), and each field is rescaled:
+
+    DF405 fine pseudorange (2^-29 ms, 20 bits)  -> DF400 (2^-24 ms, 15 bits)
+    DF406 fine phase range (2^-31 ms, 24 bits)  -> DF401 (2^-29 ms, 22 bits)
+    DF407 lock time indicator (10 bits)         -> DF402 (4 bits)
+    DF408 CNR (2^-4 dB-Hz, 10 bits)             -> DF403 (1 dB-Hz, 6 bits)
+
+Fields are read and written at most 16 bits at a time, so values stay small
+integers on MicroPython. Frames are built in a preallocated buffer, with a new
+CRC-24Q.
+"""
+from metrics import registry
+from rtcm import CRC_LEN, HEADER_LEN, MAX_FRAME_LEN, PREAMBLE, crc24q, is_msm, msg_type
+
+# Bit offsets (in the payload) of the MSM header's satellite, signal and cell masks
+SAT_MASK = 73
+SIG_MASK = 137
+CELL_MASK = 169
+
+
+def get_bits(buf, pos, n):
+    """Return the n bit (n <= 16) unsigned value at bit position pos of buf."""
+    i = pos >> 3
+    value = (buf[i] << 16) | (buf[i + 1] << 8) | buf[i + 2]
+    return (value >> (24 - (pos & 7) - n)) & ((1 << n) - 1)
+
+
+def get_long(buf, pos, n):
+    """Return the n bit (n <= 30) unsigned value at bit position pos of buf."""
+    if n <= 16:
+        return get_bits(buf, pos, n)
+    return (get_bits(buf, pos, n - 16) << 16) | get_bits(buf, pos + n - 16, 16)
+
+
+def get_signed(buf, pos, n):
+    value = get_long(buf, pos, n)
+    return value - (1 << n) if value & (1 << (n - 1)) else value
+
+
+def put_bits(buf, pos, n, value):
+    """OR the n bit (n <= 16) value into buf (which must be zeroed) at bit position pos."""
+    i = pos >> 3
+    value = (value & ((1 << n) - 1)) << (24 - (pos & 7) - n)
+    buf[i] |= value >> 16
+    buf[i + 1] |= (value >> 8) & 0xFF
+    buf[i + 2] |= value & 0xFF
+
+
+def put_long(buf, pos, n, value):
+    if n <= 16:
+        put_bits(buf, pos, n, value)
+    else:
+        put_bits(buf, pos, n - 16, value >> 16)
+        put_bits(buf, pos + n - 16, 16, value)
+
+
+def count_bits(buf, pos, n):
+    """Return the number of set bits in the n bit field at bit position pos."""
+    count = 0
+    while n > 0:
+        chunk = min(n, 16)
+        value = get_bits(buf, pos, chunk)
+        while value:
+            value &= value - 1
+            count += 1
+        pos += chunk
+        n -= chunk
+    return count
+
+
+def _lock_table():
+    """DF402 lock time indicator for each DF407 extended lock time indicator."""
+    table = bytearray(1024)
+    for ext in range(1024):
+        if ext < 64:
+            ms = ext
+        else:
+            # Resolution doubles every 32 values (704 and above: the maximum, 67108864ms)
+            k = min((ext - 64) // 32 + 1, 21)
+            ms = (min(ext, 704) - 32 * k) << k
+        # DF402: 0 is < 32ms, then 32ms << (indicator - 1), up to 15
+        indicator = 0
+        limit = 32
+        while ms >= limit and indicator < 15:
+            indicator += 1
+            limit <<= 1
+        table[ext] = indicator
+    return table
+
+_LOCK_TABLE = _lock_table()
+
+
+class MSM4Transcoder():
+
+    def __init__(self, name):
+        self.name = name
+        # Output frame (with spare bytes, as put_bits writes 3 bytes at a time)
+        self.out = bytearray(MAX_FRAME_LEN + 3)
+        self.mv = memoryview(self.out)
+        self.zero = memoryview(bytes(len(self.out)))
+        self.converted = registry.counter(f"transcode.{name}.frames")
+        self.saved = registry.counter(f"transcode.{name}.saved_bytes")
+        self.errors = 0
+
+    def convert(self, frame):
+        """Return an MSM7 frame converted to MSM4 - or any other frame unchanged.
+
+        The converted frame is a memoryview, valid until the next call.
+        """
+        if len(frame) < HEADER_LEN + 25 + CRC_LEN or frame[0] != PREAMBLE:
+            return frame
+        mtype = msg_type(frame)
+        if not is_msm(mtype) or mtype % 10 != 7:
+            return frame
+        # Bit positions below are from the start of the frame
+        base = HEADER_LEN * 8
+        nsat = count_bits(frame, base + SAT_MASK, 64)
+        nsig = count_bits(frame, base + SIG_MASK, 32)
+        ncells = nsat * nsig
+        length = ((frame[1] & 0x03) << 8) | frame[2]
+        if ncells > 64 or CELL_MASK + ncells > length * 8:
+            self.errors += 1
+            return frame
+        ncell = count_bits(frame, base + CELL_MASK, ncells)
+        header = CELL_MASK + ncells
+        if header + 36 * nsat + 80 * ncell > length * 8:
+            # Truncated (or not really MSM7)
+            self.errors += 1
+            return frame
+        bits = header + 18 * nsat + 48 * ncell
+        out_len = (bits + 7) >> 3
+        out = self.out
+        self.mv[:HEADER_LEN + out_len + 2] = self.zero[:HEADER_LEN + out_len + 2]
+
+        # Header - message number, then the rest copied unchanged
+        put_bits(out, base, 12, mtype - 3)
+        pos = 12
+        while pos < header:
+            n = min(16, header - pos)
+            put_bits(out, base + pos, n, get_bits(frame, base + pos, n))
+            pos += n
+
+        # Satellite data: rough range (integer ms) and rough range (mod 1ms) - skipping extended info
+        src = base + header
+        dst = base + header
+        for i in range(nsat):
+            put_bits(out, dst + 8 * i, 8, get_bits(frame, src + 8 * i, 8))
+        src += 12 * nsat
+        dst += 8 * nsat
+        for i in range(nsat):
+            put_bits(out, dst + 10 * i, 10, get_bits(frame, src + 10 * i, 10))
+        # Skip the rough phase range rates
+        src += 24 * nsat
+        dst += 10 * nsat
+
+        # Signal data
+        for i in range(ncell):
+            # Fine pseudorange
+            value = get_signed(frame, src + 20 * i, 20)
+            if value == -0x80000:
+                value = -0x4000
+            else:
+                value = max(-0x3FFF, min(0x3FFF, (value + 16) >> 5))
+            put_bits(out, dst + 15 * i, 15, value)
+        src += 20 * ncell
+        dst += 15 * ncell
+        for i in range(ncell):
+            # Fine phase range
+            value = get_signed(frame, src + 24 * i, 24)
+            if value == -0x800000:
+                value = -0x200000
+            else:
+                value = max(-0x1FFFFF, min(0x1FFFFF, (value + 2) >> 2))
+            put_long(out, dst + 22 * i, 22, value)
+        src += 24 * ncell
+        dst += 22 * ncell
+        for i in range(ncell):
+            put_bits(out, dst + 4 * i, 4, _LOCK_TABLE[get_bits(frame, src + 10 * i, 10)])
+        src += 10 * ncell
+        dst += 4 * ncell
+        for i in range(ncell):
+            # Half-cycle ambiguity
+            put_bits(out, dst + i, 1, get_bits(frame, src + i, 1))
+        src += ncell
+        dst += ncell
+        for i in range(ncell):
+            # CNR
+            put_bits(out, dst + 6 * i, 6, min(63, (get_bits(frame, src + 10 * i, 10) + 8) >> 4))
+
+        out[0] = PREAMBLE
+        out[1] = out_len >> 8
+        out[2] = out_len & 0xFF
+        end = HEADER_LEN + out_len
+        crc = crc24q(out, 0, end)
+        out[end] = crc >> 16
+        out[end + 1] = (crc >> 8) & 0xFF
+        out[end + 2] = crc & 0xFF
+        self.converted.inc()
+        self.saved.inc(len(frame) - end - CRC_LEN)
+        return self.mv[:end + CRC_LEN]
+
+    def status(self):
+        """Return a one-line status report (for the remote shell)."""
+        return (
+            f"MSM4 transcoder {self.name}: {self.converted.value} MSM7 frames converted, "
+            f"{self.saved.value} bytes saved, {self.errors} errors"
+        )
@@ -0,0 +1,9 @@
+"""Run src/ modules on the host, against the stand-ins in tools/sim (see tools/sim/harness.py)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools", "sim"))
+
+import harness  # noqa: E402
+harness.setup_paths()
+harness.install_config({"CRASH_RESET": False})
@@ -0,0 +1,66 @@
+import asyncio
+import tracemalloc
+
+import harness
+from blue import Blue, Peer
+
+
+def drain(peer, size):
+    data = bytes(peer.mv[peer.start:peer.start + size])
+    peer.sent(size, 0)
+    return data
+
+
+def test_queue_compacts_overlapping_data_in_place():
+    peer = Peer(64)
+    lines = b"".join(b"%02d\n" % n for n in range(16))
+    peer.queue(b"A" * 9 + b"\n" + lines, 0)
+    assert drain(peer, 10) == b"A" * 9 + b"\n"
+    # 48 bytes left at offset 10 - compacting moves them over themselves
+    peer.queue(b"tail56789\n", 0)
+    assert peer.start == 0
+    assert bytes(peer.mv[peer.start:peer.end]) == lines + b"tail56789\n"
+    assert peer.dropped == 0
+
+
+def test_queue_compaction_does_not_copy_queue():
+    peer = Peer(2048)
+    line = b"$GPGGA,0123456789012345678901234567890123456789\n"
+    while peer.queued() + len(line) <= 2048:
+        peer.queue(line, 0)
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(50):
+            drain(peer, len(line))
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            # Compacts nearly 2KB of queued data
+            peer.queue(line, 0)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    # Small objects only (e.g. memoryview slices) - not a copy of the queue
+    assert peak < 1024
+
+
+def test_rx_forwards_rtcm_frames_and_nmea_sentences():
+    """Data written by a central reaches the GPS as whole messages, with anything else discarded."""
+    async def main():
+        blue = Blue()
+        received = []
+        blue.write_callback = lambda msg: received.append(bytes(msg))
+        frame = harness.rtcm_frame(b"\x3e\xd0" + bytes(20))
+        command = harness.nmea("PQTMCFGMSGRATE,W,GGA,1")
+        # Noise, a whole frame, a sentence split across writes, and a truncated sentence
+        data = b"xx" + frame + command + b"$PQTM" + frame
+        task = asyncio.create_task(blue.rx_loop())
+        for i in range(0, len(data), 20):
+            blue.rx_ring.write(data[i:i + 20])
+            blue.rx_event.set()
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        assert received == [frame, command, frame]
+        assert blue.rx_framer.frames == 2 and blue.rx_sentences == 1
+    asyncio.run(main())
@@ -0,0 +1,13 @@
+import harness
+from broadcast import Broadcast
+
+
+def test_rtcm_mode_sends_frames_only():
+    """In rtcm mode, whole RTCM frames from gps_data are queued and NMEA sentences skipped."""
+    broadcast = Broadcast(mode="rtcm", size=1024)
+    frame = harness.rtcm_frame(b"\x3e\xd0" + bytes(20))
+    broadcast.write(harness.nmea("GPGGA,,,,,,0,,,,,,,,"))
+    broadcast.write(memoryview(frame))
+    broadcast.write(frame)
+    assert broadcast.total == 2 * len(frame)
+    assert bytes(broadcast.buf[:broadcast.total]) == frame * 2
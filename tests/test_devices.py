@@ -0,0 +1,76 @@
+import asyncio
+import sys
+
+from devices import GPS, Logger
+
+
+def run_commands(cmds, prefix, responses):
+    """Send cmds, passing each response to the GPS once the commands it follows have been written."""
+    async def main():
+        gps = GPS()
+        task = asyncio.create_task(gps.send_commands(cmds, prefix, 500))
+        # Commands written when each response arrived
+        written = []
+        for after, sentence in responses:
+            for _ in range(100):
+                if len(gps.uart.writes) >= after or task.done():
+                    break
+                await asyncio.sleep(0.01)
+            written.append(len(gps.uart.writes))
+            gps.check_response(sentence)
+        return await task, written
+    return asyncio.run(main())
+
+
+def test_generic_prefix_matches_each_commands_own_response():
+    cmds = ["PQTMCFGUART,W,460800", "PAIR864,0,0,460800"]
+    resps, _ = run_commands(cmds, "$P", [
+        # Periodic proprietary sentence - not a response
+        (2, b"$PQTMEPE,2,1.0,1.0,1.0,1.4,1.7*6B\r\n"),
+        (2, b"$PAIR001,864,0*3A\r\n"),
+        (2, b"$PQTMCFGUART,OK*70\r\n"),
+    ])
+    assert resps == [b"$PQTMCFGUART,OK*70\r\n", b"$PAIR001,864,0*3A\r\n"]
+
+
+def test_custom_prefix_sends_one_command_at_a_time():
+    cmds = ["CMDA,1", "CMDB,2"]
+    resps, written = run_commands(cmds, "$GNTXT", [
+        (1, b"$GNTXT,A\r\n"),
+        (2, b"$GNTXT,B\r\n"),
+    ])
+    assert resps == [b"$GNTXT,A\r\n", b"$GNTXT,B\r\n"]
+    # The second command is only sent after the first response
+    assert written == [1, 2]
+
+
+class ListHandler():
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, msg):
+        self.lines.append(msg)
+
+
+def test_log_rate_zero_is_unlimited():
+    async def main():
+        handler = ListHandler()
+        Logger.setHandler(handler)
+        task = asyncio.create_task(Logger.drain(0))
+        try:
+            await asyncio.sleep(0)
+            for n in range(10):
+                Logger.getLogger().log("message %d", n)
+            for _ in range(100):
+                if len(handler.lines) == 10:
+                    break
+                await asyncio.sleep(0)
+            # Still draining (not failed, falling back to writing directly)
+            assert not task.done() and Logger.draining
+        finally:
+            task.cancel()
+            await asyncio.sleep(0)
+            Logger.setHandler(sys.stdout)
+        assert handler.lines == [f"message {n}\n" for n in range(10)]
+    asyncio.run(main())
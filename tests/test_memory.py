@@ -0,0 +1,27 @@
+import memory
+from memory import BufferPool
+
+
+def test_shared_buffer_returns_to_pool_once():
+    pool = BufferPool(2, 16)
+    buf = pool.copy(b"frame", refs=2)
+    buf.release()
+    assert len(pool.free) == 1
+    buf.release()
+    assert len(pool.free) == 2
+
+
+def test_over_release_is_counted():
+    pool = BufferPool(2, 16)
+    before = memory.over_released.value
+    buf = pool.copy(b"frame")
+    buf.release()
+    buf.release()
+    assert memory.over_released.value == before + 1
+    assert buf.refs == 0
+    assert pool.free.count(buf) == 1
+    # The next two copies get different buffers
+    first = pool.copy(b"one")
+    second = pool.copy(b"two")
+    assert first is not second
+    assert bytes(first.data) == b"one"
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import network
+import net
+from net import Net
+
+
+class CountingWLAN(network.WLAN):
+    scans = 0
+
+    def scan(self):
+        CountingWLAN.scans += 1
+        return super().scan()
+
+
+def supervise(wifi, seconds):
+    async def main():
+        task = asyncio.create_task(wifi.wifi_supervisor())
+        await asyncio.sleep(seconds)
+        task.cancel()
+    asyncio.run(main())
+
+
+def make_net(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(network, "WLAN", CountingWLAN)
+    CountingWLAN.scans = 0
+    network.WLAN.link_up = True
+    return Net()
+
+
+def test_first_connect_doesnt_scan_at_startup(monkeypatch, tmp_path):
+    wifi = make_net(monkeypatch, tmp_path)
+    wifi.enable_wifi("sim", "key")
+    assert CountingWLAN.scans == 0
+    supervise(wifi, 1.5)
+    assert wifi.wifi_connected
+    # AP cached from a single background scan, once connected
+    assert CountingWLAN.scans == 1
+    with open(net.WIFI_CACHE_FILE) as f:
+        assert json.load(f) == {"ssid": "sim", "bssid": "0200000000aa"}
+
+
+def test_stale_cached_ap_is_dropped(monkeypatch, tmp_path):
+    wifi = make_net(monkeypatch, tmp_path)
+    with open(net.WIFI_CACHE_FILE, "w") as f:
+        json.dump({"ssid": "sim", "bssid": "0200000000bb"}, f)
+    wifi.enable_wifi("sim", "key")
+    assert wifi.cached_connect
+    # The cached AP doesn't answer
+    wifi.connect_started -= 20000
+    network.WLAN.link_up = False
+    supervise(wifi, 0.5)
+    assert not wifi.cached_connect
+    with open(net.WIFI_CACHE_FILE) as f:
+        assert json.load(f) == {}
+    network.WLAN.link_up = True
+    supervise(wifi, 1.5)
+    assert wifi.wifi_connected
+    assert wifi.ap_cache == {"ssid": "sim", "bssid": "0200000000aa"}
@@ -0,0 +1,108 @@
+import asyncio
+
+import harness
+import memory
+from memory import BufferPool
+from ntrip import Client, Server, Uplink
+
+
+class SlowWriter():
+    """Stream writer whose drain waits until released."""
+
+    def __init__(self):
+        self.written = []
+        self.release = asyncio.Event()
+        self.draining = asyncio.Event()
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    async def drain(self):
+        self.draining.set()
+        await self.release.wait()
+
+    def close(self):
+        pass
+
+
+def test_enqueue_keeps_frames_being_written():
+    """Frames dropped for space while send_loop is draining must not be ones being written."""
+    async def main():
+        pool = BufferPool(32, 512)
+        over_released = memory.over_released.value
+        server = Server("127.0.0.1")
+        server.coalesce_ms = 0
+        server.writer = writer = SlowWriter()
+        frames = [harness.rtcm_frame(bytes([n]) * 100) for n in range(12)]
+        server.max_pending_bytes = 4 * len(frames[0])
+        for frame in frames[:4]:
+            server.enqueue(pool.copy(frame))
+        task = asyncio.create_task(server.send_loop())
+        server.data_event.set()
+        await writer.draining.wait()
+        # Overflow the queue while the first 4 frames are being written
+        for frame in frames[4:]:
+            server.enqueue(pool.copy(frame))
+        writer.release.set()
+        await asyncio.sleep(0.01)
+        server.data_event.set()
+        await asyncio.sleep(0.01)
+        task.cancel()
+        sent = b"".join(writer.written)
+        # The frames being written, then the newest that fitted in the queue
+        assert sent == b"".join(frames[:4] + frames[-4:])
+        assert server.sent_frames == 8
+        assert server.dropped == 4
+        assert server.pending == [] and server.pending_bytes == 0
+        assert len(pool.free) == pool.count
+        # Every frame released exactly once
+        assert memory.over_released.value == over_released
+    asyncio.run(main())
+
+
+def test_uplink_queues_rtcm_frames_only():
+    """gps_data passes whole messages - RTCM frames are queued for every server, NMEA ignored."""
+    async def main():
+        servers = [Server("127.0.0.1"), Server("127.0.0.2")]
+        uplink = Uplink(servers, BufferPool(4, 512))
+        frame = harness.rtcm_frame(b"\x3e\xd0" + bytes(20))
+        await uplink.send_data(harness.nmea("GPGGA,,,,,,0,,,,,,,,"))
+        await uplink.send_data(memoryview(frame))
+        for server in servers:
+            assert [bytes(f.data) for f in server.pending] == [frame]
+            assert server.data_event.is_set()
+    asyncio.run(main())
+
+
+def test_sourcetable_without_coords_fetched_once_per_reconnect(monkeypatch):
+    async def main():
+        client = Client("caster.example.com")
+        client.nearest_mount = True
+        client.recheck_km = 1
+        fetches = []
+
+        async def fetch_sourcetable():
+            fetches.append(client.mount_coords)
+            if len(fetches) == 2:
+                client.add_mount(b"STR;NEAR;NEAR;RTCM 3.3;;2;GPS;;GB;51.50;-0.12;0;0;;none;B;;9600;")
+
+        async def caster_connect():
+            pass
+
+        monkeypatch.setattr(client, "fetch_sourcetable", fetch_sourcetable)
+        monkeypatch.setattr(client, "caster_connect", caster_connect)
+        # Fetched at startup (by run) - with no mount coordinates
+        await client.fetch_sourcetable()
+        # Moving between GGA updates doesn't fetch it again
+        for lat in ("5130.000", "5140.000", "5150.000"):
+            client.update_position(harness.nmea(f"GPGGA,120000.00,{lat},N,00007.200,W,4,12,0.8,10.0,M,47.0,M,1.0,0000"))
+        assert len(fetches) == 1 and client.pending_mount is None
+        # Until the next reconnect - which finds the mount, for the next position update
+        await client.reconnect()
+        assert len(fetches) == 2
+        client.update_position(harness.nmea("GPGGA,120000.00,5130.000,N,00007.200,W,4,12,0.8,10.0,M,47.0,M,1.0,0000"))
+        assert client.pending_mount == "NEAR"
+        # With usable coordinates, reconnecting doesn't fetch it again
+        await client.reconnect()
+        assert len(fetches) == 2
+    asyncio.run(main())
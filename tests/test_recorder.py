@@ -0,0 +1,56 @@
+import time
+
+import recorder
+from recorder import Recorder, parse_time
+
+
+def record(tmp_path, monkeypatch, seconds, **kwargs):
+    """Record one 256 byte block per second (4 blocks per file), as run() writes full blocks."""
+    now = [1700000000]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    monkeypatch.setattr(recorder, "ticks_ms", lambda: (now[0] - 1700000000) * 1000)
+    rec = Recorder(str(tmp_path), block_size=256, blocks=4, file_size=1024, **kwargs)
+    rec.scan()
+    for n in range(seconds):
+        now[0] = 1700000000 + n
+        rec.write(bytes([n]) * 256)
+        rec.flush(partial=False)
+    return rec, now
+
+
+def test_index_and_rotation(tmp_path, monkeypatch):
+    rec, _ = record(tmp_path, monkeypatch, 10)
+    rec.close()
+    assert rec.files == {1: 1024, 2: 1024, 3: 512}
+    assert rec.read_index(2) == [(1700000004 + i, 256 * i) for i in range(4)]
+    # Files are found again, and numbering continues
+    again = Recorder(str(tmp_path))
+    again.scan()
+    assert again.files == rec.files and again.seq == 3
+
+
+def test_index_written_while_recording(tmp_path, monkeypatch):
+    """With a steady stream (full blocks only), the index is still written every flush_interval."""
+    rec, _ = record(tmp_path, monkeypatch, 3, flush_interval=2)
+    with open(rec.filename(1, "idx"), "rb") as f:
+        assert len(f.read()) == 3 * 8
+    assert rec.index_len == 0
+
+
+def test_ranges_and_extract(tmp_path, monkeypatch):
+    rec, now = record(tmp_path, monkeypatch, 10)
+    now[0] += 1
+    # Blocks 5..7 (and block 4, which runs until block 5's time)
+    assert rec.ranges(1700000005, 1700000007) == [(2, 0, 1024)]
+    # Blocks 6..8 - spanning files, including the current file's unwritten index entries
+    assert rec.ranges(1700000007, 1700000008) == [(2, 512, 1024), (3, 0, 256)]
+    assert rec.ranges(1600000000, 1600000001) == []
+    chunks = list(rec.extract(1700000005, 1700000009))
+    assert chunks[0] == b"RECORD 1536 bytes\n"
+    assert b"".join(chunks[1:]) == b"".join(bytes([n]) * 256 for n in range(4, 10))
+
+
+def test_parse_time():
+    secs = parse_time("2026-10-19T12:30")
+    assert time.localtime(secs)[:6] == (2026, 10, 19, 12, 30, 0)
+    assert parse_time("2026-10-19T12:30:15") == secs + 15
@@ -0,0 +1,68 @@
+import asyncio
+import struct
+
+import pytest
+
+import resolver
+from resolver import Resolver, build_query, parse_response
+
+
+def response(qid, host, answers, rcode=0):
+    """DNS response to build_query(qid, host), with (type, rdata) answers named by pointer to the question."""
+    data = bytearray(build_query(qid, host))
+    struct.pack_into("!HHHH", data, 0, qid, 0x8180 | rcode, 1, len(answers))
+    for rtype, rdata in answers:
+        data += struct.pack("!HHHIH", 0xC00C, rtype, 1, 60, len(rdata)) + rdata
+    return bytes(data)
+
+
+def test_parse_response_skips_to_first_a_record():
+    cname = b"\x03www\x07example\x03com\x00"
+    data = response(7, "caster.example.com", [(5, cname), (1, bytes([192, 0, 2, 10])), (1, bytes([192, 0, 2, 11]))])
+    assert parse_response(7, data) == "192.0.2.10"
+
+
+def test_parse_response_rejects_other_responses():
+    a = [(1, bytes([192, 0, 2, 10]))]
+    # Another query's response, an error (NXDOMAIN), or no A record
+    assert parse_response(8, response(7, "caster.example.com", a)) is None
+    assert parse_response(7, response(7, "caster.example.com", a, rcode=3)) is None
+    assert parse_response(7, response(7, "caster.example.com", [])) is None
+
+
+def test_parse_response_truncated():
+    data = response(7, "caster.example.com", [(1, bytes([192, 0, 2, 10]))])
+    # Truncated responses are either ignored, or raise an error query treats as malformed
+    for end in range(12, len(data)):
+        try:
+            assert parse_response(7, data[:end]) is None
+        except (IndexError, ValueError, struct.error):
+            pass
+
+
+def test_cache_refresh_keeps_last_known_address(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(resolver, "ticks_ms", lambda: now[0])
+    answers = ["192.0.2.1", None, "192.0.2.2"]
+
+    async def lookup(host, port):
+        return answers.pop(0)
+
+    async def main():
+        r = Resolver(ttl=10)
+        monkeypatch.setattr(r, "lookup", lookup)
+        assert await r.resolve("caster.example.com", 2101) == "192.0.2.1"
+        assert await r.resolve("192.0.2.9", 2101) == "192.0.2.9"
+        # Expired - the cached address is used while refreshing (which fails)
+        now[0] = 11000
+        assert await r.resolve("caster.example.com", 2101) == "192.0.2.1"
+        await asyncio.sleep(0)
+        assert r.failures == 1 and not r.refreshing
+        # The next refresh succeeds
+        assert await r.resolve("caster.example.com", 2101) == "192.0.2.1"
+        await asyncio.sleep(0)
+        assert await r.resolve("caster.example.com", 2101) == "192.0.2.2"
+        with pytest.raises(OSError):
+            answers.append(None)
+            await r.resolve("other.example.com", 2101)
+    asyncio.run(main())
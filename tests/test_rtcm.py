@@ -0,0 +1,55 @@
+import harness
+from rtcm import Framer, iter_frames, msg_type
+
+
+def frame(mtype, size=20):
+    """Frame with a 12 bit message type, followed by size zero bytes."""
+    return harness.rtcm_frame((mtype << 4).to_bytes(2, "big") + bytes(size))
+
+
+def test_pop_frames_reassembles_split_frames():
+    framer = Framer(256)
+    frames = [frame(1005), frame(1077, 40), frame(1230, 60)]
+    data = b"".join(frames)
+    popped = []
+    for i in range(0, len(data), 7):
+        framer.feed(data[i:i + 7])
+        if (view := framer.pop_frames()) is not None:
+            popped.extend(bytes(f) for f in iter_frames(view))
+    assert popped == frames
+    assert framer.frames == 3 and framer.discarded == 0
+    assert [msg_type(f) for f in popped] == [1005, 1077, 1230]
+
+
+def test_pop_frames_resyncs_after_noise_and_crc_error():
+    framer = Framer(256)
+    good = frame(1005)
+    bad = bytearray(good)
+    bad[5] ^= 0xFF
+    framer.feed(b"noise" + bytes(bad) + good)
+    assert bytes(framer.pop_frames()) == good
+    assert framer.crc_errors == 1
+    # The noise, then the bad frame one byte at a time (while looking for a preamble)
+    assert framer.discarded == 5 + len(bad)
+
+
+def test_pop_splits_mixed_stream():
+    framer = Framer(256)
+    gga = harness.nmea("GPGGA,,,,,,0,,,,,,,,")
+    rtcm = frame(1005)
+    framer.feed(gga + rtcm + b"junk" + gga[:10])
+    assert bytes(framer.pop()) == gga
+    assert bytes(framer.pop()) == rtcm
+    # Junk is skipped, and the partial sentence waits for the rest
+    assert framer.pop() is None
+    framer.feed(gga[10:])
+    assert bytes(framer.pop()) == gga
+    assert framer.discarded == 4
+
+
+def test_pop_drops_truncated_sentence():
+    framer = Framer(256)
+    gga = harness.nmea("GPGGA,,,,,,0,,,,,,,,")
+    framer.feed(gga[:12] + gga)
+    assert bytes(framer.pop()) == gga
+    assert framer.discarded == 12
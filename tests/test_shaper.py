@@ -0,0 +1,53 @@
+import random
+
+import harness
+import shaper
+from shaper import Shaper
+
+
+def epoch(ms, rand, types=harness.MSM7_TYPES):
+    """One epoch's MSM7 frames, with the multiple message bit set on all but the last."""
+    return [harness.rtcm_msm7(mtype, 1, ms, 4, 1, rand, multiple=i < len(types) - 1) for i, mtype in enumerate(types)]
+
+
+def test_msm_epochs_forwarded_or_dropped_together():
+    """10Hz MSM shaped to 1Hz forwards every 10th epoch, with all its constellations."""
+    rand = random.Random(1)
+    s = Shaper("test_epochs", {"MSM": 1})
+    passed = []
+    dropped = 0
+    for n in range(30):
+        frames = epoch(1000 + n * 100, rand)
+        allowed = [s.allow(memoryview(f)) for f in frames]
+        # An epoch is never split
+        assert len(set(allowed)) == 1
+        if allowed[0]:
+            passed.append(n)
+        else:
+            dropped += sum(len(f) for f in frames)
+    assert passed == [0, 10, 20]
+    assert s.saved_bytes.value == dropped
+
+
+def test_epoch_after_lost_final_message():
+    """A repeated first message type starts a new epoch, even if the last one's final message was lost."""
+    rand = random.Random(1)
+    s = Shaper("test_lost", {"MSM": 1})
+    assert all(s.allow(f) for f in epoch(1000, rand)[:-1])
+    assert not any(s.allow(f) for f in epoch(1500, rand))
+    assert all(s.allow(f) for f in epoch(2000, rand))
+
+
+def test_arrival_interval_and_passthrough(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(shaper, "ticks_ms", lambda: now[0])
+    s = Shaper("test_arrival", {1005: 10})
+    gga = harness.nmea("GPGGA,,,,,,0,,,,,,,,")
+    allowed = []
+    for n in range(25):
+        now[0] = n * 1000
+        allowed.append(s.allow(harness.rtcm_1005(1, n)))
+        # NMEA, and message types without an interval, are always forwarded
+        assert s.allow(gga)
+        assert s.allow(harness.rtcm_msm7(1077, 1, n * 1000, 4, 1, random.Random(n), multiple=False))
+    assert [n for n, ok in enumerate(allowed) if ok] == [0, 10, 20]
@@ -0,0 +1,75 @@
+import asyncio
+import socket
+
+from main import ESP32GPS
+from recorder import Recorder
+from shell import Shell
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def command(port, cmd, size=None):
+    """Send a shell command, and return the response (size bytes, or up to the next prompt)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    # Banner line, then the prompt
+    await reader.readline()
+    await reader.readuntil(b"> ")
+    writer.write(cmd.encode() + b"\n")
+    await writer.drain()
+    if size is None:
+        resp = await reader.readuntil(b"> ")
+    else:
+        resp = await reader.readexactly(size)
+    writer.close()
+    await writer.wait_closed()
+    # Let the shell see the disconnect
+    await asyncio.sleep(0.2)
+    return resp
+
+
+def run_shell(app, fn):
+    async def main():
+        port = free_port()
+        app.setup_shell_callbacks()
+        shell = Shell(callbacks=app.shell_callbacks, bind_address="127.0.0.1", bind_port=port)
+        task = asyncio.create_task(shell.run())
+        await asyncio.sleep(0.1)
+        try:
+            return await fn(port)
+        finally:
+            shell.shutdown_event.set()
+            await task
+    return asyncio.run(main())
+
+
+def test_record_get_streams_recording(tmp_path):
+    app = ESP32GPS()
+    app.recorder = Recorder(str(tmp_path), block_size=1024, blocks=8)
+    app.recorder.scan()
+    data = bytes(range(256)) * 20
+    app.recorder.write(data)
+
+    async def get(port):
+        header = f"RECORD {len(data)} bytes\n".encode()
+        return await command(port, "RECORD GET 2000-01-01T00:00 2100-01-01T00:00", len(header) + len(data))
+
+    resp = run_shell(app, get)
+    assert resp == f"RECORD {len(data)} bytes\n".encode() + data
+
+
+def test_async_callback_awaited():
+    app = ESP32GPS()
+
+    async def cb(opts):
+        await asyncio.sleep(0)
+        return f"async {opts}"
+
+    async def call(port):
+        app.shell_callbacks["ASYNC"] = cb
+        return await command(port, "ASYNC x")
+
+    assert run_shell(app, call).startswith(b"async x\n")
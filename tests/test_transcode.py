@@ -0,0 +1,61 @@
+import random
+
+import harness
+from rtcm import Framer, msg_type
+from transcode import MSM4Transcoder
+
+
+class EdgeRandom(random.Random):
+    """Random fields which are often extreme values (0, all ones, or the most negative - invalid - value)."""
+
+    def getrandbits(self, n):
+        choice = super().getrandbits(2)
+        if choice == 0:
+            return 0
+        if choice == 1:
+            return (1 << n) - 1
+        if choice == 2:
+            return 1 << (n - 1)
+        return super().getrandbits(n)
+
+
+def check(frame, transcoder):
+    out = bytes(transcoder.convert(frame))
+    assert msg_type(out) == msg_type(frame) - 3
+    assert out == harness.msm4_reference(frame)
+    # Valid frame (length and CRC)
+    framer = Framer(len(out) + 1)
+    framer.feed(out)
+    assert bytes(framer.pop_frames()) == out
+    return out
+
+
+def test_msm7_matches_reference():
+    transcoder = MSM4Transcoder("test_reference")
+    rand = random.Random(1)
+    for mtype in harness.MSM7_TYPES:
+        for sats, sigs in ((1, 1), (10, 2), (16, 4), (32, 2)):
+            frame = harness.rtcm_msm7(mtype, 1, 1000, sats, sigs, rand)
+            assert len(check(frame, transcoder)) < len(frame)
+    assert transcoder.errors == 0
+
+
+def test_extreme_field_values_match_reference():
+    transcoder = MSM4Transcoder("test_extremes")
+    rand = EdgeRandom(2)
+    for n in range(200):
+        check(harness.rtcm_msm7(1077, 1, n, 8, 2, rand), transcoder)
+    assert transcoder.errors == 0
+
+
+def test_other_frames_unchanged():
+    transcoder = MSM4Transcoder("test_other")
+    station = harness.rtcm_1005(1, 0)
+    msm4 = harness.rtcm_msm7(1074, 1, 0, 4, 1, random.Random(1))
+    gga = harness.nmea("GPGGA,,,,,,0,,,,,,,,")
+    for frame in (station, msm4, gga):
+        assert transcoder.convert(frame) is frame
+    # Too many cells for an MSM message (64 max)
+    frame = harness.rtcm_msm7(1077, 1, 0, 33, 2, random.Random(1))
+    assert transcoder.convert(frame) is frame
+    assert transcoder.errors == 1
@@ -0,0 +1,124 @@
+"""Benchmark BLE output throughput on a host, against the stubbed bluetooth module in tools/sim.
+
+A producer emulates the GPS UART reader, queueing NMEA sentences to `Blue.send`
+each epoch, while the stub BLE stack accepts a limited number of notifications
+per connection interval. Reports sentences delivered per second, and how long
+the producer (i.e. the event loop) was held up by sending.
+
+`--legacy` runs the previous approach for comparison: one notify per sentence,
+blocking with time.sleep on ENOMEM.
+
+Usage: python3 tools/bench_ble.py --mtu 185 --rate 10 --sentences 12 --connections 3 --slow 1
+"""
+import argparse
+import asyncio
+import errno
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "tools", "sim"), os.path.join(ROOT, "src")]
+
+from blue import Blue  # noqa: E402
+from devices import nmea_checksum  # noqa: E402
+
+
+class LegacyBlue(Blue):
+    """The original blocking send: write the whole line, then notify each connection."""
+
+    def send(self, data):
+        self.ble.gatts_write(self.handle_tx, data)
+        for conn in self.connections:
+            while True:
+                try:
+                    self.ble.gatts_notify(conn, self.handle_tx)
+                    break
+                except OSError as e:
+                    if e.errno == errno.ENOMEM:
+                        time.sleep(0.005)
+                    else:
+                        raise
+
+
+def sentences(count):
+    """Build a representative epoch of NMEA sentences."""
+    bodies = [
+        "GNGGA,123519.00,5637.2000,N,00356.4000,W,4,12,0.8,102.3,M,51.2,M,1.0,0000",
+        "GNRMC,123519.00,A,5637.2000,N,00356.4000,W,0.02,0.00,191026,,,R,V",
+        "GNGSA,A,3,02,05,12,15,18,20,25,29,,,,,1.2,0.8,0.9,1",
+        "GPGSV,3,1,11,02,45,123,42,05,33,301,40,12,12,045,35,15,67,210,44,1",
+    ]
+    return [f"${b}*{nmea_checksum(b)}\r\n".encode() for b in (bodies * count)[:count]]
+
+
+async def run(args):
+    cls = LegacyBlue if args.legacy else Blue
+    blue = cls(name="BENCH", tx_size=args.buffer, max_connections=args.connections)
+    ble = blue.ble
+    ble.interval_ms = args.interval
+    ble.per_interval = args.per_interval
+    ble.record = True
+    for conn in range(args.connections):
+        ble.sim_connect(conn, mtu=args.mtu)
+        if conn < args.slow:
+            # Congested central - one notification per interval
+            ble.conns[conn].per_interval = 1
+    if not args.legacy:
+        sender = asyncio.create_task(blue.send_loop())
+
+    epoch = sentences(args.sentences)
+    period = 1 / args.rate
+    offered = 0
+    max_send = 0.0
+    max_lag = 0.0
+    start = time.perf_counter()
+    next_epoch = start
+    while time.perf_counter() - start < args.duration:
+        lag = time.perf_counter() - next_epoch
+        max_lag = max(max_lag, lag)
+        for line in epoch:
+            t = time.perf_counter()
+            blue.send(line)
+            max_send = max(max_send, time.perf_counter() - t)
+            offered += 1
+            # UART reader yields between reads
+            await asyncio.sleep(0)
+        next_epoch += period
+        await asyncio.sleep(max(0, next_epoch - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    if not args.legacy:
+        sender.cancel()
+
+    print(f"Mode: {'legacy' if args.legacy else 'queued'}, MTU: {args.mtu}, connections: {args.connections} ({args.slow} slow)")
+    print(f"Offered: {offered / elapsed:.0f} sentences/s ({args.sentences} per epoch at {args.rate}Hz)")
+    for num, conn in sorted(ble.conns.items()):
+        # Count whole sentences delivered (truncated notifications lose their line ending)
+        delivered = sum(p.count(b"\n") for p in conn.received)
+        print(
+            f"  conn {num}{' (slow)' if num < args.slow else ''}: delivered {delivered / elapsed:.0f} sentences/s, "
+            f"{conn.notifies} notifications ({conn.bytes / elapsed / 1024:.1f} KiB/s), truncated: {conn.truncated}"
+        )
+        if not args.legacy:
+            print(f"    {blue.connections[num].status()}")
+    print(f"Max send() time: {max_send * 1000:.2f}ms, max producer lag: {max_lag * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--mtu", type=int, default=185, help="Negotiated MTU")
+    parser.add_argument("--connections", type=int, default=1, help="Number of connected centrals")
+    parser.add_argument("--slow", type=int, default=0, help="Number of centrals which are slow to read")
+    parser.add_argument("--rate", type=float, default=10, help="Epochs per second")
+    parser.add_argument("--sentences", type=int, default=12, help="NMEA sentences per epoch")
+    parser.add_argument("--interval", type=float, default=15, help="BLE connection interval (ms)")
+    parser.add_argument("--per-interval", type=int, default=4, help="Notifications sent per connection interval")
+    parser.add_argument("--buffer", type=int, default=2048, help="BLE output queue size per connection (bytes)")
+    parser.add_argument("--duration", type=float, default=5, help="Benchmark duration (seconds)")
+    parser.add_argument("--legacy", action="store_true", help="Benchmark the previous blocking send")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
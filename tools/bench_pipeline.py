@@ -0,0 +1,298 @@
+"""End-to-end benchmark of the full ESP32GPS pipeline on a host (CPython), using the stand-ins in tools/sim.
+
+GPS data (a capture file, or generated NMEA/RTCM) is replayed through the
+simulated GPS UART at real baud timing, and `main.ESP32GPS` forwards it to
+serial, BLE, ESP-Now (to a simulated receiver over a lossy medium) and an NTRIP
+server, which uploads to the in-process NTRIP Caster. A local NTRIP client
+reads the mount back from the Caster.
+
+Each message is matched in every output stream, and the time it left that
+output is compared with the time its last byte arrived at the GPS UART.
+Reports per-output throughput, delivery and latency percentiles, and Python
+allocations (GC collections, and with --trace-alloc the top allocation sites in src/).
+
+--stall blocks the event loop periodically (as slow fan-out would), to compare
+reading the GPS UART from the event loop with the ingest thread (--ingest-thread).
+
+--msm4 converts MSM7 to MSM4 for ESP-Now and the NTRIP server, and expects the
+converted frames in those outputs.
+
+Usage: python3 tools/bench_pipeline.py --baud 115200 --rate 1 --duration 20 --espnow-loss 0.05
+"""
+import argparse
+import asyncio
+import base64
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools", "sim"))
+
+import harness  # noqa: E402
+harness.setup_paths()
+
+import aioespnow  # noqa: E402
+import machine  # noqa: E402
+
+# MAC address of the simulated ESP-Now receiver
+PEER = b"\x02\x00\x00\x00\x00\x02"
+CREDS = "c:c"
+# Bytes of an output stream to search for each message
+SEARCH_WINDOW = 65536
+
+
+class NullHandler():
+
+    def write(self, msg):
+        pass
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Stream():
+    """An output's data, as received: (time, bytes) chunks."""
+
+    def __init__(self, name, accepts, convert=None):
+        self.name = name
+        # Function returning True for messages this output should receive
+        self.accepts = accepts
+        # Function returning a message as this output should receive it (e.g. MSM4)
+        self.convert = convert
+        self.chunks = []
+
+    def match(self, msgs, arrival, start, end):
+        """Find each message in the stream, and return (expected, delivered, latencies in ms)."""
+        data = b"".join(c for _, c in self.chunks)
+        # Offset of the end of each chunk, to look up the time a byte was sent
+        ends = []
+        total = 0
+        for _, chunk in self.chunks:
+            total += len(chunk)
+            ends.append(total)
+        expected = delivered = 0
+        latencies = []
+        pos = chunk = 0
+        for offset, msg in msgs:
+            if not self.accepts(msg):
+                continue
+            if self.convert:
+                msg = self.convert(msg)
+            at = arrival(offset - 1)
+            # Messages are only unique within a window, so don't search too far ahead
+            found = data.find(msg, pos, pos + SEARCH_WINDOW)
+            if found >= 0:
+                pos = found + len(msg)
+                while ends[chunk] < pos:
+                    chunk += 1
+            if not start <= at <= end:
+                continue
+            expected += 1
+            if found >= 0:
+                delivered += 1
+                latencies.append((self.chunks[chunk][0] - at) * 1000)
+        return expected, delivered, latencies
+
+
+async def espnow_receiver(stream):
+    esp = aioespnow.AIOESPNow(mac=PEER)
+    esp.active(True)
+    esp.config(rxbuf=2800)
+    while True:
+        _, msg = await esp.airecv()
+        stream.chunks.append((time.perf_counter(), msg))
+
+
+async def ntrip_client(port, stream):
+    """Read the mount back from the Caster (retrying until the server has connected)."""
+    auth = base64.b64encode(CREDS.encode()).decode()
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                f"GET /ESP32 HTTP/1.1\r\nNtrip-Version: Ntrip/2.0\r\nUser-Agent: NTRIP bench/1.0\r\n"
+                f"Authorization: Basic {auth}\r\n\r\n".encode()
+            )
+            await writer.drain()
+            if b"200 OK" in await reader.readuntil(b"\r\n\r\n"):
+                break
+            writer.close()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.5)
+    while (data := await reader.read(4096)):
+        stream.chunks.append((time.perf_counter(), data))
+
+
+def config(args):
+    return {
+        "ENABLE_GPS": True,
+        "GPS_BAUD_RATE": args.baud,
+        "ENABLE_SERIAL_CLIENT": True,
+        "ENABLE_BLUETOOTH": True,
+        "WIFI_SSID": "sim",
+        "WIFI_PSK": "sim",
+        "ESPNOW_MODE": "sender",
+        "ESPNOW_PEERS": [PEER],
+        "NTRIP_MODE": "caster,server",
+        "NTRIP_CASTER": "127.0.0.1",
+        "NTRIP_PORT": args.port,
+        "NTRIP_CASTER_BIND_ADDRESS": "127.0.0.1",
+        "NTRIP_CASTER_BIND_PORT": args.port,
+        "NTRIP_MOUNT": "ESP32",
+        "CRASH_RESET": False,
+        "GPS_INGEST_THREAD": args.ingest_thread,
+        "RTCM_MSM4_ESPNOW": args.msm4,
+        "RTCM_MSM4_NTRIP": args.msm4,
+    }
+
+
+async def stall_loop(ms, every):
+    """Block the event loop for ms every `every` seconds."""
+    while True:
+        await asyncio.sleep(every)
+        time.sleep(ms / 1000)
+
+
+def ignore_cancelled(loop, context):
+    """Don't report connection handlers cancelled at shutdown (CPython only)."""
+    if not isinstance(context.get("exception"), asyncio.CancelledError):
+        loop.default_exception_handler(context)
+
+
+async def run(args, capture):
+    asyncio.get_running_loop().set_exception_handler(ignore_cancelled)
+    harness.install_config(config(args))
+    aioespnow.Medium.loss = args.espnow_loss
+    machine.UART.captures[1] = capture
+    capture = b"".join(data for _, data in capture)
+    from devices import Logger
+    from main import ESP32GPS
+    if not args.verbose:
+        Logger.setHandler(NullHandler())
+
+    is_rtcm = lambda msg: msg[0] == 0xD3  # noqa: E731
+    convert = None
+    if args.msm4:
+        from transcode import MSM4Transcoder
+        transcoder = MSM4Transcoder("expected")
+        convert = lambda msg: bytes(transcoder.convert(msg))  # noqa: E731
+    streams = {
+        "Serial": Stream("Serial", lambda msg: True),
+        "BLE": Stream("BLE", lambda msg: True),
+        "ESP-Now": Stream("ESP-Now", lambda msg: True, convert),
+        "NTRIP": Stream("NTRIP", is_rtcm, convert),
+    }
+    tasks = [
+        asyncio.create_task(espnow_receiver(streams["ESP-Now"])),
+        asyncio.create_task(ntrip_client(args.port, streams["NTRIP"])),
+    ]
+    if args.stall:
+        tasks.append(asyncio.create_task(stall_loop(args.stall, args.stall_every)))
+    gc_counts = [0, 0, 0]
+    gc_pause = [0.0, 0.0]
+
+    def gc_callback(phase, info):
+        if phase == "start":
+            gc_pause[1] = time.perf_counter()
+        else:
+            gc_counts[info["generation"]] += 1
+            gc_pause[0] += time.perf_counter() - gc_pause[1]
+    gc.callbacks.append(gc_callback)
+
+    app = ESP32GPS()
+    app_task = asyncio.create_task(app.run())
+    # Connect a BLE client once Bluetooth is up
+    while not app.blue:
+        await asyncio.sleep(0.01)
+    app.blue.ble.record = True
+    app.blue.ble.sim_connect(1, mtu=args.mtu)
+    uart = machine.UART.instances[1]
+    duration = uart.arrival_time(len(capture) - 1) - uart.arrival_time(0)
+    # Let everything drain before stopping
+    await asyncio.sleep(max(0, uart.arrival_time(len(capture) - 1) - time.perf_counter()) + 2)
+    gc.callbacks.remove(gc_callback)
+
+    streams["Serial"].chunks = list(machine.UART.instances[2].writes)
+    conn = app.blue.ble.conns[1]
+    streams["BLE"].chunks = list(zip(conn.received_at, conn.received))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    app.shutdown_event.set()
+    await app_task
+    await app.shutdown()
+
+    msgs = harness.split_messages(capture)
+    # Measure from warmup (Caster/Server/Client connected) to the end of the capture
+    start = uart.arrival_time(0) + args.warmup
+    end = uart.arrival_time(len(capture) - 1)
+    print(f"Capture: {len(capture)} bytes, {len(msgs)} messages over {duration:.1f}s at {args.baud} baud ({len(capture) / duration / 1024:.1f} KiB/s)")
+    print(f"GPS UART: {uart.overflows} bytes lost to rx buffer overflow, rx buffer found full {app.gps.rx_full} times")
+    if app.gps.ring is not None:
+        print(f"Ingest thread: ring max {app.gps.ring_max}/{len(app.gps.ring.buf) - 1} bytes, found full {app.gps.ring_full} times")
+    print(f"Measured {end - start:.1f}s after {args.warmup}s warmup")
+    print(f"{'Output':<8} {'KiB/s':>7} {'Delivered':>15} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for stream in streams.values():
+        expected, delivered, latencies = stream.match(msgs, uart.arrival_time, start, end)
+        nbytes = sum(len(c) for t, c in stream.chunks if start <= t)
+        print(
+            f"{stream.name:<8} {nbytes / (end - start) / 1024:>7.1f} {delivered:>7}/{expected:<7} "
+            f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 90):>8.1f} "
+            f"{percentile(latencies, 99):>8.1f} {max(latencies, default=0):>8.1f}"
+        )
+    print(f"ESP-Now medium: {aioespnow.Medium.sent} sent, {aioespnow.Medium.lost} lost, {aioespnow.Medium.overflows} receiver overflows")
+    print(f"GC: {gc_counts[0]}/{gc_counts[1]}/{gc_counts[2]} collections (gen 0/1/2), {gc_pause[0] * 1000:.1f}ms total")
+    if args.trace_alloc:
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, os.path.join(harness.SRC, "*"))])
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Allocations: {current / 1024:.0f} KiB current, {peak / 1024:.0f} KiB peak (all Python)")
+        print("Top allocation sites in src/ (retained):")
+        for stat in snapshot.statistics("lineno")[:args.trace_alloc]:
+            frame = stat.traceback[0]
+            print(f"  {os.path.relpath(frame.filename, ROOT)}:{frame.lineno}  {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--capture", help="Raw GPS capture file to replay (default: generated NMEA + RTCM MSM7)")
+    parser.add_argument("--baud", type=int, default=115200, help="GPS UART baud rate")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of generated data")
+    parser.add_argument("--rate", type=int, default=1, help="Generated epochs per second")
+    parser.add_argument("--sats", type=int, default=10, help="Satellites per constellation in generated MSM7 frames")
+    parser.add_argument("--warmup", type=float, default=4, help="Seconds to ignore at the start (while NTRIP connects)")
+    parser.add_argument("--mtu", type=int, default=185, help="BLE client MTU")
+    parser.add_argument("--espnow-loss", type=float, default=0.0, help="Fraction of ESP-Now messages lost in transit")
+    parser.add_argument("--port", type=int, default=12102, help="Port for the NTRIP Caster")
+    parser.add_argument("--ingest-thread", action="store_true", help="Read the GPS UART from a separate thread (GPS_INGEST_THREAD)")
+    parser.add_argument("--stall", type=int, default=0, metavar="MS", help="Block the event loop for MS every --stall-every seconds")
+    parser.add_argument("--stall-every", type=float, default=1, help="Seconds between event loop stalls")
+    parser.add_argument("--msm4", action="store_true", help="Convert MSM7 to MSM4 for ESP-Now and NTRIP (RTCM_MSM4_ESPNOW/NTRIP)")
+    parser.add_argument("--trace-alloc", type=int, nargs="?", const=10, default=0, metavar="N",
+                        help="Trace allocations (slower) and show the top N sites in src/")
+    parser.add_argument("--verbose", action="store_true", help="Show log output")
+    args = parser.parse_args()
+    if args.capture:
+        with open(args.capture, "rb") as f:
+            # Sent continuously at the baud rate
+            capture = [(0, f.read())]
+    else:
+        capture = harness.synthetic_capture(args.duration, args.rate, sats=args.sats)
+    if args.trace_alloc:
+        tracemalloc.start()
+    # Run in a scratch directory, as the app writes state files (e.g. wifi cache)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args, capture))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark MSM7 -> MSM4 conversion (src/transcode.py) on a host, and check its output.
+
+Frames RTCM from a raw capture (e.g. a file written by the recorder from an
+LC29H base station - NMEA and other data is skipped) or generated MSM7 frames,
+converts every MSM7 frame, and reports frames converted per second and bytes
+saved by message type. Each converted frame's CRC is checked (by reframing it),
+and its content compared with a reference conversion (harness.msm4_reference -
+Python long integers, field by field).
+
+Usage: python3 tools/bench_transcode.py --capture /path/to/000001.raw
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools", "sim"))
+
+import harness  # noqa: E402
+harness.setup_paths()
+
+from rtcm import PREAMBLE, Framer, msg_type  # noqa: E402
+from transcode import MSM4Transcoder  # noqa: E402
+
+
+def load(args):
+    if args.capture:
+        with open(args.capture, "rb") as f:
+            return f.read()
+    capture = harness.synthetic_capture(args.duration, args.rate, sats=args.sats)
+    return b"".join(data for _, data in capture)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--capture", help="Raw GPS capture file (default: generated NMEA + RTCM MSM7)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of generated data")
+    parser.add_argument("--rate", type=int, default=1, help="Generated epochs per second")
+    parser.add_argument("--sats", type=int, default=10, help="Satellites per constellation in generated MSM7 frames")
+    parser.add_argument("--repeat", type=int, default=5, help="Times to convert the capture (for timing)")
+    args = parser.parse_args()
+    data = load(args)
+
+    # Frame the capture once (skipping NMEA and anything else)
+    framer = Framer(len(data) + 1)
+    framer.feed(data)
+    frames = []
+    while (msg := framer.pop()) is not None:
+        if msg[0] == PREAMBLE:
+            frames.append(bytes(msg))
+    print(f"Capture: {len(data)} bytes, {len(frames)} RTCM frames ({framer.crc_errors} CRC errors, {framer.discarded} bytes skipped)")
+
+    transcoder = MSM4Transcoder("bench")
+    # { message type: [frames, bytes in, bytes out] }
+    stats = {}
+    mismatches = crc_errors = 0
+    for frame in frames:
+        mtype = msg_type(frame)
+        out = bytes(transcoder.convert(frame))
+        entry = stats.setdefault(mtype, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += len(frame)
+        entry[2] += len(out)
+        if msg_type(out) != mtype:
+            check = Framer(len(out) + 1)
+            check.feed(out)
+            if check.pop_frames() is None:
+                crc_errors += 1
+            if out != harness.msm4_reference(frame):
+                mismatches += 1
+
+    msm7 = [f for f in frames if msg_type(f) % 10 == 7 and 1071 <= msg_type(f) <= 1137]
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for frame in msm7:
+            transcoder.convert(frame)
+    elapsed = time.perf_counter() - start
+    converted = len(msm7) * args.repeat
+
+    print(f"{'Type':<6} {'Frames':>7} {'Bytes in':>10} {'Bytes out':>10} {'Saved':>7}")
+    total_in = total_out = 0
+    for mtype in sorted(stats):
+        count, nin, nout = stats[mtype]
+        total_in += nin
+        total_out += nout
+        print(f"{mtype:<6} {count:>7} {nin:>10} {nout:>10} {100 * (nin - nout) // nin if nin else 0:>6}%")
+    print(f"{'All':<6} {len(frames):>7} {total_in:>10} {total_out:>10} {100 * (total_in - total_out) // total_in if total_in else 0:>6}%")
+    if converted:
+        print(f"Converted {converted} MSM7 frames in {elapsed:.2f}s: {converted / elapsed:.0f} frames/s ({elapsed / converted * 1e6:.0f}us per frame, CPython)")
+    print(f"Check: {crc_errors} CRC errors, {mismatches} frames differing from the reference conversion, {transcoder.errors} frames not converted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Load test for the NTRIP Caster running on a host (CPython, Linux).
+
+Starts src/caster_host.py as a subprocess, then connects N simulated servers and
+M simulated clients on localhost. Each server sends fixed-size RTCM-style frames
+carrying a send timestamp, and each client measures the time taken for the
+Caster to fan the frame out to it.
+
+Reports client throughput, fan-out latency percentiles and Caster memory per client.
+
+Usage: python3 tools/caster_load.py --servers 4 --clients 200 --duration 20
+"""
+import argparse
+import asyncio
+import base64
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREDS = "load:test"
+# RTCM proprietary message type, used for generated frames
+MSG_TYPE = 4095
+
+CONFIG = """
+NTRIP_CASTER_BIND_ADDRESS = "127.0.0.1"
+NTRIP_CASTER_BIND_PORT = {port}
+NTRIP_CASTER_BACKLOG = {backlog}
+NTRIP_CLIENT_CREDENTIALS = "{creds}"
+NTRIP_SERVER_CREDENTIALS = "{creds}"
+NTRIP_SOURCETABLE = \"\"\"
+{sourcetable}
+ENDSOURCETABLE
+\"\"\"
+"""
+
+
+def mount_name(i):
+    return f"LOAD{i}"
+
+
+def build_frame(size, seq):
+    """Build an RTCM-style frame (preamble, length, payload, CRC placeholder) of `size` bytes."""
+    payload_len = size - 6
+    payload = struct.pack(">HIQ", MSG_TYPE << 4, seq, time.perf_counter_ns())
+    payload += bytes(payload_len - len(payload))
+    return b"\xd3" + struct.pack(">H", payload_len) + payload + b"\x00\x00\x00"
+
+
+def headers(method, mount):
+    auth = base64.b64encode(CREDS.encode()).decode()
+    return (
+        f"{method} /{mount} HTTP/1.1\r\n"
+        "Ntrip-Version: Ntrip/2.0\r\n"
+        "User-Agent: NTRIP caster_load/1.0\r\n"
+        f"Authorization: Basic {auth}\r\n"
+        "\r\n"
+    ).encode()
+
+
+def rss_kb(pid):
+    """Resident memory (kB) of a process, from /proc."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def connect(port, method, mount):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(headers(method, mount))
+    await writer.drain()
+    resp = await reader.readuntil(b"\r\n\r\n")
+    if b"200 OK" not in resp:
+        raise ConnectionError(f"{method} /{mount} rejected: {resp!r}")
+    return reader, writer
+
+
+async def server(port, mount, rate, size, stop, stats):
+    _, writer = await connect(port, "POST", mount)
+    seq = 0
+    interval = 1 / rate
+    next_send = time.perf_counter()
+    while not stop.is_set():
+        writer.write(build_frame(size, seq))
+        await writer.drain()
+        stats["sent"] += 1
+        seq += 1
+        next_send += interval
+        await asyncio.sleep(max(0, next_send - time.perf_counter()))
+    writer.close()
+
+
+async def client(port, mount, size, stop, stats, latencies):
+    reader, writer = await connect(port, "GET", mount)
+    stats["connected"] += 1
+    try:
+        while not stop.is_set():
+            frame = await reader.readexactly(size)
+            _, _, sent_ns = struct.unpack_from(">HIQ", frame, 3)
+            latencies.append((time.perf_counter_ns() - sent_ns) / 1e6)
+            stats["bytes"] += size
+    except (asyncio.IncompleteReadError, ConnectionError):
+        if not stop.is_set():
+            stats["dropped"] += 1
+    finally:
+        writer.close()
+
+
+async def wait_listening(port, timeout=10):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Caster did not start listening")
+
+
+async def run(args):
+    sourcetable = "\n".join(
+        f"STR;{mount_name(i)};LOAD;RTCM3.3;;2;GPS;NONE;GBR;0.0;0.0;0;0;LOAD;none;B;N;9600;LOAD"
+        for i in range(args.servers)
+    )
+    conf = tempfile.NamedTemporaryFile("w", suffix=".py", delete=False)
+    conf.write(CONFIG.format(port=args.port, backlog=args.clients + args.servers, creds=CREDS, sourcetable=sourcetable))
+    conf.close()
+    caster = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "src", "caster_host.py"), "-c", conf.name],
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+    )
+    stop = asyncio.Event()
+    stats = {"sent": 0, "bytes": 0, "connected": 0, "dropped": 0}
+    latencies = []
+    try:
+        await wait_listening(args.port)
+        # Servers must be subscribed before clients can request their mounts
+        srv_tasks = [
+            asyncio.create_task(server(args.port, mount_name(i), args.rate, args.size, stop, stats))
+            for i in range(args.servers)
+        ]
+        await asyncio.sleep(1)
+        rss_before = rss_kb(caster.pid)
+        cli_tasks = [
+            asyncio.create_task(client(args.port, mount_name(i % args.servers), args.size, stop, stats, latencies))
+            for i in range(args.clients)
+        ]
+        # Let connections settle before measuring
+        await asyncio.sleep(2)
+        rss_after = rss_kb(caster.pid)
+        latencies.clear()
+        start_bytes, start = stats["bytes"], time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - start
+        recv_bytes = stats["bytes"] - start_bytes
+        stop.set()
+        await asyncio.gather(*srv_tasks, *cli_tasks, return_exceptions=True)
+    finally:
+        caster.terminate()
+        caster.wait()
+        os.unlink(conf.name)
+
+    print(f"Servers: {args.servers}  Clients: {stats['connected']}/{args.clients}  Dropped: {stats['dropped']}")
+    print(f"Frames: {args.size} bytes at {args.rate}/s per server, {elapsed:.1f}s measured")
+    print(f"Throughput: {recv_bytes / elapsed / 1024:.1f} KiB/s, {len(latencies) / elapsed:.0f} frames/s delivered")
+    print(
+        "Fan-out latency (ms): "
+        f"p50={percentile(latencies, 50):.2f} p90={percentile(latencies, 90):.2f} "
+        f"p99={percentile(latencies, 99):.2f} max={max(latencies, default=0):.2f}"
+    )
+    print(f"Caster RSS: {rss_before} kB before clients, {rss_after} kB after ({(rss_after - rss_before) / max(1, args.clients):.1f} kB/client)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--servers", type=int, default=2, help="Number of simulated NTRIP servers (one mount each)")
+    parser.add_argument("--clients", type=int, default=100, help="Number of simulated NTRIP clients")
+    parser.add_argument("--rate", type=float, default=10, help="Frames per second sent by each server")
+    parser.add_argument("--size", type=int, default=200, help="Frame size in bytes")
+    parser.add_argument("--duration", type=float, default=10, help="Measurement duration (seconds)")
+    parser.add_argument("--port", type=int, default=12101, help="Port for the Caster to listen on")
+    parser.add_argument("--verbose", action="store_true", help="Show Caster log output")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Host stand-in for the MicroPython `aioespnow` module, for benchmarks and simulation.
+
+All instances share an in-process `Medium`, which delivers messages between
+them, dropping a random fraction (`Medium.loss`) in transit. Each receiver
+buffers up to `rxbuf` bytes of messages (dropping new messages when full).
+"""
+import asyncio
+import random
+import network
+
+MAX_DATA_LEN = 250
+
+
+class Medium():
+    # Fraction of messages lost in transit
+    loss = 0.0
+    # { mac: AIOESPNow }
+    devices = {}
+    sent = 0
+    lost = 0
+    overflows = 0
+
+    @classmethod
+    def deliver(cls, src, dst, msg):
+        cls.sent += 1
+        if random.random() < cls.loss:
+            cls.lost += 1
+            return
+        if (device := cls.devices.get(dst)) and device._active:
+            device.receive(src, msg)
+
+
+class AIOESPNow():
+
+    def __init__(self, mac=None):
+        # `mac` is only for simulation - defaults to this device's (network.MAC)
+        self.mac = mac or network.MAC
+        self.peers = []
+        self.rxbuf = 526
+        self.queue = []
+        self.queued_bytes = 0
+        self.event = asyncio.Event()
+        self._active = False
+        Medium.devices[self.mac] = self
+
+    def active(self, state=None):
+        if state is not None:
+            self._active = state
+        return self._active
+
+    def config(self, rxbuf=None, **kwargs):
+        if rxbuf:
+            self.rxbuf = rxbuf
+
+    def add_peer(self, mac, *args, **kwargs):
+        if mac not in self.peers:
+            self.peers.append(mac)
+
+    def get_peers(self):
+        return tuple((mac, None, 0, 0, False) for mac in self.peers)
+
+    def send(self, mac, msg=None, sync=True):
+        if msg is None:
+            mac, msg = None, mac
+        if len(msg) > MAX_DATA_LEN:
+            raise ValueError("ESPNow message too long")
+        for peer in ([mac] if mac else self.peers):
+            if peer == b"\xff" * 6:
+                for dst in list(Medium.devices):
+                    if dst != self.mac:
+                        Medium.deliver(self.mac, dst, bytes(msg))
+            else:
+                Medium.deliver(self.mac, peer, bytes(msg))
+        return True
+
+    async def asend(self, mac, msg=None, sync=True):
+        return self.send(mac, msg, sync)
+
+    def receive(self, src, msg):
+        if self.queued_bytes + len(msg) > self.rxbuf:
+            Medium.overflows += 1
+            return
+        self.queue.append((src, msg))
+        self.queued_bytes += len(msg)
+        self.event.set()
+
+    async def airecv(self):
+        while not self.queue:
+            self.event.clear()
+            await self.event.wait()
+        src, msg = self.queue.pop(0)
+        self.queued_bytes -= len(msg)
+        return [src, msg]
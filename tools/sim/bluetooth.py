@@ -0,0 +1,129 @@
+"""Host stand-in for the MicroPython `bluetooth` module, for benchmarks and simulation.
+
+Models the BLE stack's notification queue: each connection can have `queue_len`
+notifications outstanding, `per_interval` of which are sent every connection
+interval. Notifying while the queue is full raises OSError(ENOMEM), as on the
+device. Payloads longer than the connection's MTU (minus the 3 byte ATT header)
+are truncated and counted.
+"""
+import errno
+import time
+
+
+class UUID():
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"UUID({self.value!r})"
+
+
+class Connection():
+
+    def __init__(self):
+        self.mtu = 23
+        self.in_flight = 0
+        self.last_drain = time.perf_counter()
+        self.notifies = 0
+        self.bytes = 0
+        self.truncated = 0
+        # Notifications sent per connection interval (None to use BLE.per_interval)
+        self.per_interval = None
+        # Received payloads, and the time each was sent (if recording)
+        self.received = []
+        self.received_at = []
+
+
+class BLE():
+
+    def __init__(self):
+        self.interval_ms = 15
+        self.per_interval = 4
+        self.queue_len = 12
+        self.record = False
+        self.handler = None
+        self.values = {}
+        self.conns = {}
+        self.mtu = 23
+        self._active = False
+
+    def active(self, state=None):
+        if state is not None:
+            self._active = state
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if "mtu" in kwargs:
+            self.mtu = kwargs["mtu"]
+        elif args == ("mtu",):
+            return self.mtu
+
+    def irq(self, handler):
+        self.handler = handler
+
+    def gatts_register_services(self, services):
+        handles = []
+        handle = 1
+        for _, chars in services:
+            svc = []
+            for _ in chars:
+                svc.append(handle)
+                self.values[handle] = b""
+                handle += 1
+            handles.append(tuple(svc))
+        return tuple(handles)
+
+    def gatts_set_buffer(self, handle, size, append=False):
+        pass
+
+    def gap_advertise(self, interval_us, adv_data=None):
+        pass
+
+    def gap_disconnect(self, conn):
+        if conn in self.conns:
+            self.handler(2, (conn, 0, b"\x00" * 6))
+            del self.conns[conn]
+
+    def gatts_read(self, handle):
+        return self.values[handle]
+
+    def gatts_write(self, handle, data):
+        self.values[handle] = bytes(data)
+
+    def gatts_notify(self, conn, handle, data=None):
+        c = self.conns[conn]
+        now = time.perf_counter()
+        intervals = int((now - c.last_drain) * 1000 / self.interval_ms)
+        if intervals:
+            c.in_flight = max(0, c.in_flight - intervals * (c.per_interval or self.per_interval))
+            c.last_drain += intervals * self.interval_ms / 1000
+        if c.in_flight >= self.queue_len:
+            raise OSError(errno.ENOMEM, "ENOMEM")
+        c.in_flight += 1
+        payload = bytes(self.values[handle] if data is None else data)
+        if len(payload) > c.mtu - 3:
+            c.truncated += 1
+            payload = payload[:c.mtu - 3]
+        c.notifies += 1
+        c.bytes += len(payload)
+        if self.record:
+            c.received.append(payload)
+            c.received_at.append(now)
+
+    # Simulation helpers (not part of the MicroPython API)
+
+    def sim_connect(self, conn, mtu=None):
+        self.conns[conn] = Connection()
+        self.handler(1, (conn, 0, b"\x00" * 6))
+        if mtu:
+            self.conns[conn].mtu = min(mtu, self.mtu)
+            self.handler(21, (conn, self.conns[conn].mtu))
+
+    def sim_disconnect(self, conn):
+        self.handler(2, (conn, 0, b"\x00" * 6))
+        return self.conns.pop(conn)
+
+    def sim_write(self, handle, data):
+        self.values[handle] = bytes(data)
+        self.handler(3, (0, handle))
@@ -0,0 +1,208 @@
+"""Helpers for running src/ modules on a host against the stand-ins in tools/sim.
+
+`setup_paths` puts tools/sim (stand-ins for machine, network, aioespnow,
+bluetooth) and src on sys.path. `install_config` loads config.defaults.py as
+the `config` module, with overrides. `synthetic_capture` generates GPS output
+(NMEA sentences and RTCM frames) to replay through `machine.UART`, and
+`msm4_reference` converts MSM7 frames to check `transcode.MSM4Transcoder` against.
+"""
+import os
+import random
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SIM = os.path.join(ROOT, "tools", "sim")
+SRC = os.path.join(ROOT, "src")
+
+
+def setup_paths():
+    for path in (SRC, SIM):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def install_config(overrides=None):
+    """Load config.defaults.py as the `config` module, updated with overrides."""
+    cfg = types.ModuleType("config")
+    with open(os.path.join(ROOT, "config.defaults.py")) as f:
+        exec(f.read(), cfg.__dict__)
+    cfg.__dict__.update(overrides or {})
+    sys.modules["config"] = cfg
+    return cfg
+
+
+def nmea(body):
+    chk = 0
+    for c in body.encode():
+        chk ^= c
+    return f"${body}*{chk:02X}\r\n".encode()
+
+
+class BitWriter():
+
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def add(self, value, bits):
+        self.value = (self.value << bits) | (value & ((1 << bits) - 1))
+        self.bits += bits
+
+    def bytes(self):
+        pad = -self.bits % 8
+        return (self.value << pad).to_bytes((self.bits + pad) // 8, "big")
+
+
+def rtcm_frame(payload):
+    from rtcm import crc24q
+    frame = bytearray(b"\xd3" + len(payload).to_bytes(2, "big") + payload)
+    return bytes(frame + crc24q(frame).to_bytes(3, "big"))
+
+
+def rtcm_1005(station, epoch):
+    """Station ARP message (ECEF coordinates jittered by epoch, so every frame is unique)."""
+    w = BitWriter()
+    w.add(1005, 12)
+    w.add(station, 12)
+    w.add(0, 6)           # ITRF year
+    w.add(0b1111, 4)      # GPS, GLONASS, Galileo, reference station indicators
+    w.add(34522861234 + epoch, 38)
+    w.add(0, 2)           # single receiver oscillator, reserved
+    w.add(-2541345678, 38)
+    w.add(0, 2)           # quarter cycle indicator
+    w.add(52432101234, 38)
+    return rtcm_frame(w.bytes())
+
+
+def rtcm_msm7(mtype, station, epoch_ms, sats, sigs, rand, multiple=True):
+    """MSM7 observation message with `sats` satellites, each observed on `sigs` signals."""
+    w = BitWriter()
+    w.add(mtype, 12)
+    w.add(station, 12)
+    w.add(epoch_ms, 30)
+    w.add(multiple, 1)    # multiple message bit (more MSM for this epoch follow)
+    w.add(0, 3)           # IODS
+    w.add(0, 7)           # reserved
+    w.add(0, 2)           # clock steering
+    w.add(0, 2)           # external clock
+    w.add(0, 1)           # smoothing
+    w.add(0, 3)           # smoothing interval
+    sat_ids = sorted(rand.sample(range(64), sats))
+    sig_ids = sorted(rand.sample(range(32), sigs))
+    w.add(sum(1 << (63 - s) for s in sat_ids), 64)
+    w.add(sum(1 << (31 - s) for s in sig_ids), 32)
+    # All cells observed
+    w.add((1 << (sats * sigs)) - 1, sats * sigs)
+    # Satellite data: rough range (ms), extended info, rough range (mod 1ms), rate
+    for field_bits in (8, 4, 10, 14):
+        for _ in range(sats):
+            w.add(rand.getrandbits(field_bits), field_bits)
+    # Signal data: fine pseudorange, phase range, lock time, half-cycle, CNR, fine phase range rate
+    for field_bits in (20, 24, 10, 1, 10, 15):
+        for _ in range(sats * sigs):
+            w.add(rand.getrandbits(field_bits), field_bits)
+    return rtcm_frame(w.bytes())
+
+
+def msm4_reference(frame):
+    """Convert an MSM7 frame to MSM4 using long integer bit slicing (independent of transcode.py)."""
+    from rtcm import HEADER_LEN
+    length = ((frame[1] & 0x03) << 8) | frame[2]
+    payload = int.from_bytes(frame[HEADER_LEN:HEADER_LEN + length], "big")
+    total = length * 8
+    pos = 0
+
+    def take(n):
+        nonlocal pos
+        pos += n
+        return (payload >> (total - pos)) & ((1 << n) - 1)
+
+    def signed(value, n):
+        return value - (1 << n) if value & (1 << (n - 1)) else value
+
+    w = BitWriter()
+    w.add(take(12) - 3, 12)
+    w.add(take(157), 157)
+    nsat = bin(payload >> (total - 137) & ((1 << 64) - 1)).count("1")
+    nsig = bin(payload >> (total - 169) & ((1 << 32) - 1)).count("1")
+    cells = take(nsat * nsig)
+    w.add(cells, nsat * nsig)
+    ncell = bin(cells).count("1")
+    rough = [take(8) for _ in range(nsat)]
+    # Extended satellite info (dropped)
+    take(4 * nsat)
+    rough_mod = [take(10) for _ in range(nsat)]
+    # Rough phase range rates (dropped)
+    take(14 * nsat)
+    for value in rough:
+        w.add(value, 8)
+    for value in rough_mod:
+        w.add(value, 10)
+    fields = [[take(n) for _ in range(ncell)] for n in (20, 24, 10, 1, 10, 15)]
+    for value in fields[0]:
+        value = signed(value, 20)
+        w.add(-(1 << 14) if value == -(1 << 19) else max(-(1 << 14) + 1, min((1 << 14) - 1, round(value / 32 + 1e-9))), 15)
+    for value in fields[1]:
+        value = signed(value, 24)
+        w.add(-(1 << 21) if value == -(1 << 23) else max(-(1 << 21) + 1, min((1 << 21) - 1, round(value / 4 + 1e-9))), 22)
+    for value in fields[2]:
+        # DF407 -> minimum lock time (ms) -> DF402
+        if value < 64:
+            ms = value
+        else:
+            k = min((value - 64) // 32 + 1, 21)
+            ms = (min(value, 704) - 32 * k) * 2 ** k
+        w.add(0 if ms < 32 else min(15, ms.bit_length() - 5), 4)
+    for value in fields[3]:
+        w.add(value, 1)
+    for value in fields[4]:
+        w.add(min(63, round(value / 16 + 1e-9)), 6)
+    return rtcm_frame(w.bytes())
+
+
+# MSM7 message types generated each epoch: GPS, GLONASS, Galileo, BeiDou
+MSM7_TYPES = (1077, 1087, 1097, 1127)
+
+
+def synthetic_capture(seconds, rate=1, sats=10, sigs=2, seed=1):
+    """Generate `seconds` of GPS output at `rate` epochs per second, as a list of (seconds, bytes) bursts for machine.UART.
+
+    Each epoch is a set of NMEA sentences (with unique timestamps), then MSM7
+    frames for 4 constellations (and a 1005 frame once per second).
+    """
+    rand = random.Random(seed)
+    bursts = []
+    for epoch in range(int(seconds * rate)):
+        out = bytearray()
+        ms = 43200000 + epoch * 1000 // rate
+        hms = f"{ms // 3600000:02d}{ms // 60000 % 60:02d}{ms // 1000 % 60:02d}.{ms % 1000 // 10:02d}"
+        out += nmea(f"GNGGA,{hms},5637.2000,N,00356.4000,W,4,12,0.8,102.3,M,51.2,M,1.0,0000")
+        out += nmea(f"GNRMC,{hms},A,5637.2000,N,00356.4000,W,0.02,0.00,191026,,,R,V")
+        # Vary a field in each sentence, so they are all unique
+        out += nmea(f"GNGSA,A,3,02,05,12,15,18,20,25,29,,,,,1.2,0.8,0.{epoch % 1000:03d},1")
+        for i in range(3):
+            out += nmea(f"GPGSV,3,{i + 1},11,02,45,123,42,05,33,301,40,12,12,045,35,15,67,{epoch % 360:03d},{epoch % 100:02d},1")
+        if epoch % rate == 0:
+            out += rtcm_1005(1, epoch)
+        for i, mtype in enumerate(MSM7_TYPES):
+            out += rtcm_msm7(mtype, 1, ms % 604800000, sats, sigs, rand, multiple=i < len(MSM7_TYPES) - 1)
+        bursts.append((epoch / rate, bytes(out)))
+    return bursts
+
+
+def split_messages(data):
+    """Split a capture into (end offset, message) for each NMEA sentence and RTCM frame."""
+    msgs = []
+    i = 0
+    while i < len(data):
+        if data[i] == 0xD3 and i + 3 <= len(data):
+            end = i + 3 + ((data[i + 1] & 0x03) << 8 | data[i + 2]) + 3
+        elif data[i] == 0x24:
+            end = data.find(b"\n", i) + 1 or len(data)
+        else:
+            i += 1
+            continue
+        msgs.append((end, data[i:end]))
+        i = end
+    return msgs
@@ -0,0 +1,136 @@
+"""Host stand-in for the MicroPython `machine` module, for benchmarks and simulation.
+
+`UART` replays data set in `UART.captures` (by UART id) at the timing of the
+configured baud rate (10 bits per byte), and records everything written to it.
+A capture is either bytes (sent continuously), or a list of (seconds, bytes)
+bursts - e.g. one per GPS epoch - each starting at its time offset (or as soon
+as the previous burst has been sent). If data isn't read quickly enough, the
+rx buffer overflows as on the device.
+"""
+import time
+from bisect import bisect_right
+
+
+class UART():
+    # Data to replay, by UART id (set by the harness before the UART is created)
+    captures = {}
+    # Most recently created UART, by UART id
+    instances = {}
+
+    def __init__(self, id, baudrate=115200, tx=None, rx=None, txbuf=256, rxbuf=256, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        self.rxbuf = rxbuf
+        capture = UART.captures.get(id, b"")
+        if isinstance(capture, (bytes, bytearray)):
+            capture = [(0, capture)]
+        self.data = b"".join(data for _, data in capture)
+        # Bytes read (or lost to overflow) so far
+        self.pos = 0
+        self.start = time.perf_counter()
+        # Time offset of each burst, by its offset in data
+        self.bursts = []
+        offset = 0
+        for at, data in capture:
+            self.bursts.append((offset, self.start + at))
+            offset += len(data)
+        self.schedule()
+        self.overflows = 0
+        # (time, bytes) for each write
+        self.writes = []
+        UART.instances[id] = self
+
+    def schedule(self, offset=0, now=0):
+        """Calculate the time each burst (from offset onwards) starts arriving, at the current baud rate."""
+        # (data offset, start time) of each run of continuously arriving bytes
+        self.runs = [(o, t) for o, t in self.runs if o < offset] if offset else []
+        ends = 0
+        for i, (start, at) in enumerate(self.bursts):
+            end = self.bursts[i + 1][0] if i + 1 < len(self.bursts) else len(self.data)
+            if end <= offset:
+                continue
+            start = max(start, offset)
+            at = max(at, now, ends)
+            self.runs.append((start, at))
+            ends = at + (end - start) * 10 / self.baudrate
+        self.run_offsets = [o for o, _ in self.runs]
+
+    def init(self, baudrate=None, **kwargs):
+        if baudrate:
+            # Bytes not yet arrived are sent at the new rate
+            now = time.perf_counter()
+            arrived = self.arrived(now)
+            self.baudrate = baudrate
+            self.schedule(arrived, now)
+
+    def arrived(self, now=None):
+        """Number of bytes of the capture received so far."""
+        now = time.perf_counter() if now is None else now
+        i = bisect_right(self.runs, now, key=lambda run: run[1]) - 1
+        if i < 0:
+            return 0
+        offset, at = self.runs[i]
+        end = self.runs[i + 1][0] if i + 1 < len(self.runs) else len(self.data)
+        return min(end, offset + int((now - at) * self.baudrate / 10))
+
+    def arrival_time(self, offset):
+        """Time (perf_counter) at which the byte at offset in the capture arrived (at the current baud rate)."""
+        start, at = self.runs[bisect_right(self.run_offsets, offset) - 1]
+        return at + (offset + 1 - start) * 10 / self.baudrate
+
+    def done(self):
+        """True once the whole capture has been received and read."""
+        return self.pos >= len(self.data)
+
+    def any(self):
+        arrived = self.arrived()
+        if arrived - self.pos > self.rxbuf:
+            # Rx buffer overflow - oldest data lost
+            self.overflows += arrived - self.pos - self.rxbuf
+            self.pos = arrived - self.rxbuf
+        return arrived - self.pos
+
+    def read(self, nbytes=None):
+        avail = self.any()
+        if not avail:
+            return None
+        nbytes = avail if nbytes is None else min(nbytes, avail)
+        data = self.data[self.pos:self.pos + nbytes]
+        self.pos += nbytes
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        # MicroPython also accepts str
+        self.writes.append((time.perf_counter(), data.encode() if isinstance(data, str) else bytes(data)))
+        return len(data)
+
+    def txdone(self):
+        return True
+
+    def flush(self):
+        pass
+
+
+class Pin():
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=IN):
+        self.id = id
+        self._value = 0
+
+    def value(self, val=None):
+        if val is None:
+            return self._value
+        self._value = int(bool(val))
+
+
+def reset():
+    raise SystemExit("machine.reset()")
@@ -0,0 +1,56 @@
+"""Host stand-in for the MicroPython `network` module, for benchmarks and simulation.
+
+`WLAN.connect` succeeds immediately (after `connect_delay` seconds), for any SSID.
+Set `WLAN.link_up = False` to simulate the access point going away.
+"""
+import time
+
+# MAC address of this (simulated) device
+MAC = b"\x02\x00\x00\x00\x00\x01"
+
+
+class WLAN():
+    IF_STA = 0
+    IF_AP = 1
+    PM_NONE = 0
+    # Shared by all interfaces - set False to simulate losing the AP
+    link_up = True
+    connect_delay = 0.1
+
+    def __init__(self, interface=IF_STA):
+        self._active = False
+        self.ssid = None
+        self.connected_at = None
+        self.settings = {"mac": MAC, "channel": 6, "txpower": 20, "pm": 1}
+
+    def active(self, state=None):
+        if state is not None:
+            self._active = state
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            if args[0] == "ssid":
+                return self.ssid
+            if args[0] not in self.settings:
+                # As MicroPython (e.g. 'bssid' isn't readable on the ESP32 port)
+                raise ValueError("unknown config param")
+            return self.settings[args[0]]
+        self.settings.update(kwargs)
+
+    def scan(self):
+        # (ssid, bssid, channel, RSSI, security, hidden)
+        return [(b"sim", b"\x02\x00\x00\x00\x00\xaa", 6, -50, 3, False)]
+
+    def connect(self, ssid, key=None, bssid=None):
+        self.ssid = ssid
+        self.connected_at = time.perf_counter() + WLAN.connect_delay
+
+    def disconnect(self):
+        self.connected_at = None
+
+    def isconnected(self):
+        return WLAN.link_up and self.connected_at is not None and time.perf_counter() >= self.connected_at
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")